@@ -1,32 +1,71 @@
 from functools import reduce
+from math import ceil, exp
 
 #import pyrtl
 from pyrtl import *
 
-def relu_vector(vec, offset):
-    assert offset <= 24
-    return concat_list([ select(d[-1], falsecase=d, truecase=Const(0, len(d)))[24-offset:32-offset] for d in vec ])
+def relu_vector(vec, offset, data_width=8):
+    # offset: bits between the top of the data_width-bit result and the top of the accumulator
+    lo = len(vec[0]) - data_width - offset
+    assert lo >= 0
+    return concat_list([ select(d[-1], falsecase=d, truecase=Const(0, len(d)))[lo:lo+data_width] for d in vec ])
 
-def sigmoid(x):
-    rb = RomBlock(bitwidth=8, addrwidth=3, asynchronous=True, romdata={0: 128, 1: 187, 2: 225, 3: 243, 4: 251, 5: 254, 6: 255, 7: 255, 8: 255})
-    x_gt_7 = reduce(lambda x, y: x|y, x[3:])  # OR of bits 3 and up
-    return select(x_gt_7, falsecase=rb[x[:3]], truecase=Const(255, bitwidth=8))
+def sigmoid(x, data_width=8):
+    # sigmoid(x) scaled to the full unsigned range: a ROM for -8 <= x <= 7 (rounded up),
+    # saturating to 0 below and to the top of the range above
+    top = 2**data_width - 1
+    rb = RomBlock(bitwidth=data_width, addrwidth=4, asynchronous=True, romdata={ i % 16 : int(ceil(top / (1. + exp(-i)))) for i in range(-8, 8) })
+    high = x[3:]  # all equal to the sign bit when x fits in 4 bits
+    fits = (high == 0) | (high == 2**len(high) - 1)
+    return select(fits, rb[x[:4]], select(x[-1], Const(0, bitwidth=data_width), Const(top, bitwidth=data_width)))
 
-def sigmoid_vector(vec):
-    return concat_list([ sigmoid(x) for x in vec ])
+def sigmoid_vector(vec, data_width=8):
+    return concat_list([ sigmoid(x, data_width) for x in vec ])
 
 
-def act_top(start, start_addr, dest_addr, nvecs, func, accum_out):
+def lut_index(x, bits, shift=0):
+    '''x arithmetic-shifted right by shift and saturated to a bits-bit signed value.'''
+    y = x[shift:]
+    if len(y) <= bits:
+        return y.sign_extended(bits)
+    top = y[bits-1:]  # all equal to the sign bit when y fits
+    fits = (top == 0) | (top == 2**len(top) - 1)
+    saturated = select(y[-1], Const(2**(bits-1), bitwidth=bits), Const(2**(bits-1) - 1, bitwidth=bits))
+    return select(fits, y[:bits], saturated)
+
+def lut_vector(vec, lut, entries_per_row, bits, shift=0, data_width=8):
+    '''Look each accumulator value up in the activation table lut.
+
+    Entry i of the table, for inputs whose lut_index is i as a two's complement number, is
+    element i % entries_per_row of row i // entries_per_row.
+    '''
+    outs = []
+    ebits = (entries_per_row - 1).bit_length()
+    for x in vec:
+        i = lut_index(x, bits, shift)
+        row = lut[i[ebits:] if ebits < bits else Const(0)]
+        elements = [ row[e*data_width:(e+1)*data_width] for e in range(entries_per_row) ]
+        outs.append(mux(i[:ebits], *elements) if ebits else elements[0])
+    return concat_list(outs)
+
+
+def act_top(start, start_addr, dest_addr, nvecs, func, accum_out, data_width=8, lut_we=None, lut_waddr=None, lut_wdata=None, lut_bits=8, lut_shift=0, lut_entries=1, use_bias=0, bias_we=None, bias_wdata=None, bias_shift=None):
 
     # func: 0 - nothing
     #       1 - ReLU
     #       2 - sigmoid
+    #       3 - lookup table, if lut_we is given: the first lut_entries values of the UB vector
+    #           lut_wdata are written to row lut_waddr on lut_we (see lut_vector; the table has 2**lut_bits entries)
+    # use_bias: add the bias registers to the accumulator values first, if bias_we is given: on
+    #           bias_we each is loaded with its element of the UB vector bias_wdata, sign extended
+    #           and shifted left by bias_shift
 
     busy = Register(1)
     accum_addr = Register(len(start_addr))
     ub_waddr = Register(len(dest_addr))
     N = Register(len(nvecs))
     act_func = Register(len(func))
+    act_bias = Register(1)
     
     rtl_assert(~(start & busy), Exception("Dispatching new activate instruction while previous instruction is still running."))
     
@@ -36,6 +75,7 @@ def act_top(start, start_addr, dest_addr, nvecs, func, accum_out):
             ub_waddr.next |= dest_addr
             N.next |= nvecs
             act_func.next |= func
+            act_bias.next |= use_bias
             busy.next |= 1
         with busy:  # Do activate on another vector this cycle
             accum_addr.next |= accum_addr + 1
@@ -44,8 +84,22 @@ def act_top(start, start_addr, dest_addr, nvecs, func, accum_out):
             with N == 1:  # this was the last vector
                 busy.next |= 0
 
-    invals = concat_list([ x[:8] for x in accum_out ])
-    act_out = mux(act_func, invals, relu_vector(accum_out, 24), sigmoid_vector(accum_out), invals)
+    if bias_we is not None:
+        biases = [ Register(len(x)) for x in accum_out ]
+        for j, b in enumerate(biases):
+            element = bias_wdata[j*data_width:(j+1)*data_width].sign_extended(len(b))
+            b.next <<= select(bias_we, shift_left_logical(element, bias_shift), b)
+        accum_out = [ select(act_bias, (x + b)[:len(x)], x) for x, b in zip(accum_out, biases) ]
+
+    # Results are cut down to the low data_width bits of each accumulator
+    invals = concat_list([ x[:data_width] for x in accum_out ])
+    if lut_we is None:
+        looked_up = invals
+    else:
+        lut = MemBlock(bitwidth=lut_entries*data_width, addrwidth=len(lut_waddr), max_read_ports=len(accum_out), asynchronous=True)
+        lut[lut_waddr] <<= MemBlock.EnabledWrite(lut_wdata[:lut_entries*data_width], lut_we)
+        looked_up = lut_vector(accum_out, lut, lut_entries, lut_bits, lut_shift, data_width)
+    act_out = mux(act_func, invals, relu_vector(accum_out, len(accum_out[0]) - data_width, data_width), sigmoid_vector(accum_out, data_width), looked_up)
     #act_out = relu_vector(accum_out, 24)
     ub_we = busy
             
@@ -0,0 +1,202 @@
+'''
+Static analysis of an OpenTPU program: the work it does, the memory traffic it needs and
+the bound each puts on its run time, without simulating any data.
+
+    python3 analyze.py boston.out --config MATSIZE=16
+    python3 analyze.py mlp.a --weights-mem latency=40,bandwidth=4 --json mlp_roofline.json
+
+The program is timed with sim.py's TimingModel, which follows the instruction latencies
+in the README, and compared with a roofline: the matrix unit does at most MAT_ROWS x
+MAT_COLS MACs a cycle, and weight tiles arrive at the weight DRAM's bandwidth. A weight
+tile used for fewer vectors than it takes to load cannot keep the array busy. Cycles
+lost to NOP padding are the difference with the same program run on the scoreboard
+(INTERLOCK) without its NOPs.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import isa
+from config import Config
+from memory import MemoryModel
+import sim
+
+args = None
+
+
+def load(path):
+    '''Decoded instructions of a program, assembling it first if it is a .a file.'''
+    if not path.endswith('.a'):
+        return sim.load_program(path)
+    import assembler
+    workdir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(workdir, 'program.a')
+        shutil.copyfile(path, source)
+        assembler.assemble(source, 0)
+        return sim.load_program(os.path.join(workdir, 'program' + assembler.SUFFIX))
+    finally:
+        shutil.rmtree(workdir)
+
+
+def tile_vectors(program):
+    '''Vectors multiplied with each weight tile, in the order the tiles are loaded.
+
+    The matrix unit moves to the next tile on MMC.S, and on the first MMC.
+    '''
+    vectors = [0] * sum(1 for instr in program if instr[0] == 'RW')
+    tile = -1
+    for opcode, _, _, length, flag in program:
+        if opcode == 'MMC':
+            if flag & isa.SWITCH_MASK or tile < 0:
+                tile += 1
+            if tile < len(vectors):
+                vectors[tile] += length
+    return vectors
+
+
+def memories(cfg, weights_mem='', host_mem='', seed=0):
+    '''Fresh (weight DRAM, host memory) models from specs like sim.py's --weights-mem.'''
+    return (MemoryModel.from_spec(weights_mem, beat_bytes=cfg.WEIGHT_DRAM_BEAT_BYTES, seed=seed),
+            MemoryModel.from_spec(host_mem, beat_bytes=cfg.HOST_VECS_PER_BEAT*cfg.VECSIZE*cfg.DWIDTH//8, seed=seed + 1))
+
+
+def estimate(programs, cfg, weights_mem='', host_mem='', seed=0):
+    '''Cycles the programs take on the hardware, one per core.'''
+    timing = sim.MultiCoreTiming(cfg, *memories(cfg, weights_mem, host_mem, seed))
+    return timing.run(programs)
+
+
+def analyze(programs, cfg, weights_mem='', host_mem='', seed=0):
+    '''Figures of merit of the programs (one per core), as a dict. The memory specs are as in estimate().'''
+    weights_model, host_model = memories(cfg, weights_mem, host_mem, seed)
+    R, C = cfg.MAT_ROWS, cfg.MAT_COLS
+    vector_bytes = cfg.VECSIZE * cfg.DWIDTH // 8
+    tile_bytes = cfg.TILE_BEATS * cfg.WEIGHT_DRAM_BEAT_BYTES  # what an RW moves, padding included
+    weight_bw = cfg.WEIGHT_DRAM_BEAT_BYTES / float(weights_model.interval())  # bytes per cycle
+    host_bw = host_model.beat_bytes / float(host_model.interval())
+
+    ops = {}
+    lengths = {}
+    for program in programs:
+        for opcode, _, _, length, _ in program:
+            ops[opcode] = ops.get(opcode, 0) + 1
+            lengths[opcode] = lengths.get(opcode, 0) + length
+    vectors = [ v for program in programs for v in tile_vectors(program) ]
+    host_beats = sum(-(-length // cfg.HOST_VECS_PER_BEAT) for program in programs
+                     for opcode, _, _, length, _ in program if opcode in ('RHM', 'WHM'))
+    macs = lengths.get('MMC', 0) * R * C
+    weight_bytes = ops.get('RW', 0) * tile_bytes
+
+    # Lower bounds on the cycles of the busiest core, or of the memories the cores share
+    per_core = lambda opcode, extra=0: max(sum(length + extra for op, _, _, length, _ in program if op == opcode) for program in programs)
+    bounds = {
+        'compute' : per_core('MMC', 1),  # the array takes a vector a cycle, with a cycle between MMCs
+        'weights' : ops.get('RW', 0) * cfg.TILE_BEATS * weights_model.interval(),
+        'host' : host_beats * host_model.interval(),
+        'activate' : per_core('ACT', 1),
+        'issue' : max(len(program) for program in programs),
+    }
+
+    cycles = estimate(programs, cfg, weights_mem, host_mem, seed)
+    stripped = [ [ instr for instr in program if instr[0] != 'NOP' ] for program in programs ]
+    nop_free = estimate(stripped, Config(**dict(cfg.key(), INTERLOCK=True)), weights_mem, host_mem, seed)
+
+    peak = R * C * len(programs)  # MACs per cycle
+    ridge = peak / weight_bw  # MACs per weight byte the array needs to stay busy
+    intensity = macs / float(weight_bytes) if weight_bytes else float('inf')
+    load_cycles = tile_bytes / weight_bw
+    return {
+        'config' : dict(cfg.key()),
+        'instructions' : ops,
+        'macs' : macs,
+        'mmc_vectors' : lengths.get('MMC', 0),
+        'weight_tiles' : ops.get('RW', 0),
+        'weight_bytes' : weight_bytes,
+        'host_read_bytes' : lengths.get('RHM', 0) * vector_bytes,
+        'host_write_bytes' : lengths.get('WHM', 0) * vector_bytes,
+        'vectors_per_tile' : { 'min' : min(vectors or [0]), 'mean' : float(np.mean(vectors)) if vectors else 0., 'max' : max(vectors or [0]) },
+        'weight_bound_tiles' : sum(1 for v in vectors if v < load_cycles),
+        'intensity' : intensity,  # MACs per weight DRAM byte
+        'ridge' : ridge,
+        'peak_macs_per_cycle' : peak,
+        'weight_bytes_per_cycle' : weight_bw,
+        'host_bytes_per_cycle' : host_bw,
+        'attainable_macs_per_cycle' : min(peak, intensity * weight_bw),
+        'bounds' : bounds,
+        'bound' : max(sorted(bounds), key=lambda k: bounds[k]),
+        'cycles' : cycles,
+        'nop_cycles' : max(0, cycles - nop_free),
+        'achieved_macs_per_cycle' : macs / float(cycles) if cycles else 0.,
+        'utilization_bound' : lengths.get('MMC', 0) / float(len(programs) * max(bounds.values())) if macs else 0.,
+        'utilization' : lengths.get('MMC', 0) / float(len(programs) * cycles) if cycles else 0.,
+    }
+
+
+def report(name, result):
+    '''The analysis as text.'''
+    cfg = result['config']
+    b = result['bounds']
+    t = result['vectors_per_tile']
+    ops = ', '.join('{} {}'.format(op, n) for op, n in sorted(result['instructions'].items()))
+    lines = [
+        '{}: {} instructions ({}) on a {}x{} array{}'.format(name, sum(result['instructions'].values()), ops,
+            cfg['MAT_ROWS'], cfg['MAT_COLS'], ', {} cores'.format(cfg['NUM_CORES']) if cfg['NUM_CORES'] > 1 else ''),
+        '  work:        {} MACs in {} MMC vectors'.format(result['macs'], result['mmc_vectors']),
+        '  weights:     {} tiles, {} bytes; {:.1f} vectors per tile (min {}, max {}), {} too few to cover their load'.format(
+            result['weight_tiles'], result['weight_bytes'], t['mean'], t['min'], t['max'], result['weight_bound_tiles']),
+        '  host:        {} bytes read, {} written'.format(result['host_read_bytes'], result['host_write_bytes']),
+        '  intensity:   {:.2f} MACs per weight byte; ridge point {:.2f} ({} MACs/cycle over {:.2f} bytes/cycle)'.format(
+            result['intensity'], result['ridge'], result['peak_macs_per_cycle'], result['weight_bytes_per_cycle']),
+        '  roofline:    {:.1f} MACs/cycle attainable, {}-bound'.format(
+            result['attainable_macs_per_cycle'], 'compute' if result['intensity'] >= result['ridge'] else 'weight-bandwidth'),
+        '  bounds:      ' + ', '.join('{} {}'.format(k, b[k]) for k in ('compute', 'weights', 'host', 'activate', 'issue')) + ' cycles',
+        '  estimate:    {} cycles ({:.1f} MACs/cycle), {} of them lost to NOP padding'.format(
+            result['cycles'], result['achieved_macs_per_cycle'], result['nop_cycles']),
+        '  MMU busy:    {:.1%} of cycles estimated, at most {:.1%} ({} bound)'.format(
+            result['utilization'], result['utilization_bound'], result['bound']),
+    ]
+    return '\n'.join(lines)
+
+
+def parse_args():
+    global args
+
+    parser = argparse.ArgumentParser(description="Statically analyze an OpenTPU program: MACs, memory traffic, roofline and cycle bounds.")
+    parser.add_argument("program", help="Program to analyze (.out, or .a to assemble).")
+    parser.add_argument("--core-program", action='append', metavar='PROGRAM', default=[],
+                        help="With NUM_CORES > 1, the program for the next core (repeatable). Cores without one run the main program.")
+    parser.add_argument("--config", action='append', metavar="NAME=VALUE", default=[],
+                        help="Override a hardware parameter from config.py, e.g. --config MATSIZE=8 (repeatable).")
+    parser.add_argument("--weights-mem", metavar='SPEC', default='',
+                        help="Weight DRAM timing, e.g. latency=40,bandwidth=8 (see memory.py). Default: one beat per cycle.")
+    parser.add_argument("--host-mem", metavar='SPEC', default='',
+                        help="Host memory timing, in the same format.")
+    parser.add_argument("--mem-seed", type=int, default=0, help="Seed for the memory latency jitter.")
+    parser.add_argument("--json", metavar="FILE", help="Also write the figures to FILE.")
+    args = parser.parse_args()
+    overrides = {}
+    for setting in args.config:
+        name, _, value = setting.partition('=')
+        overrides[name] = int(value, 0)
+    args.cfg = Config(**overrides)
+
+
+if __name__ == '__main__':
+    parse_args()
+    cfg = args.cfg
+    programs = [ load(path) for path in [args.program] + args.core_program ]
+    if len(programs) > cfg.NUM_CORES:
+        sys.exit('{} programs for {} cores'.format(len(programs), cfg.NUM_CORES))
+    programs += [programs[0]] * (cfg.NUM_CORES - len(programs))
+    result = analyze(programs, cfg, args.weights_mem, args.host_mem, args.mem_seed)
+    print(report(args.program, result))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
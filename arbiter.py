@@ -0,0 +1,86 @@
+from functools import reduce
+
+from pyrtl import *
+
+
+def onehot_select(sel, values):
+    '''The value whose select bit is set (0 if none is); at most one bit of sel may be set.'''
+    width = max(len(v) for v in values)
+    return reduce(lambda x, y: x | y, [ select(s, v.zero_extended(width), Const(0, bitwidth=width)) for s, v in zip(sel, values) ])
+
+
+def round_robin(requests):
+    '''Grant at most one of the requests each cycle.
+
+    The search for a requester starts just after the one granted last, so every requester
+    is served within len(requests) grants.
+
+    Output
+    grants: one 1-bit wire per request, at most one of them high
+    '''
+    n = len(requests)
+    first = Register(max(1, (n - 1).bit_length()))  # requester with the highest priority
+
+    # A fixed-priority chain for each requester that can come first
+    chains = []
+    for start in range(n):
+        grant = [ None for i in range(n) ]
+        taken = Const(0)
+        for k in [ (start + i) % n for i in range(n) ]:
+            grant[k] = requests[k] & ~taken
+            taken = taken | requests[k]
+        chains.append(concat_list(grant))
+    granted = mux(first, *chains, default=chains[0])
+    grants = [ granted[k] for k in range(n) ]
+
+    with conditional_assignment:
+        for k, g in enumerate(grants):
+            with g:
+                first.next |= (k + 1) % n
+
+    return grants
+
+
+def transfer_queue(depth, push, owner, length, beat, units_per_beat):
+    '''In-order record of the transfers in flight on a memory port, naming the owner of each beat.
+
+    push: a transfer of length units is requested by owner this cycle
+    beat: a beat of the oldest transfer arrives this cycle, carrying up to units_per_beat units
+    depth: transfers that can be in flight at once
+
+    Output
+    head: owner of the oldest transfer in flight, to whom a beat this cycle belongs
+    '''
+    size = max(1, (depth - 1).bit_length())
+    owners = [ Register(len(owner)) for i in range(2**size) ]
+    lengths = [ Register(len(length)) for i in range(2**size) ]
+    first = Register(size)  # oldest transfer
+    last = Register(size)  # slot for the next one
+    count = Register(size + 1)
+    sent = Register(len(length))  # units of the oldest transfer delivered so far
+
+    head = mux(first, *owners)
+    done = beat & (mux(first, *lengths) <= sent + units_per_beat)  # last beat of the oldest transfer
+
+    rtl_assert(~(push & (count == depth) & ~done), Exception("Too many memory transfers in flight on one port."))
+
+    with conditional_assignment:
+        with push:
+            for i in range(2**size):
+                with last == i:
+                    owners[i].next |= owner
+                    lengths[i].next |= length
+            last.next |= last + 1
+    with conditional_assignment:
+        with done:
+            first.next |= first + 1
+            sent.next |= 0
+        with beat:
+            sent.next |= sent + units_per_beat
+    with conditional_assignment:
+        with push & ~done:
+            count.next |= count + 1
+        with done & ~push:
+            count.next |= count - 1
+
+    return head
@@ -14,6 +14,12 @@ mapping:
     0x1 -> Sigmoid
     0x2 -> MaxPooling
 
+ACT takes its function as a flag instead: .R for ReLU, .Q for sigmoid,
+.L for the activation lookup table, which LUT SRC, ROW, LEN loads from
+LEN UB vectors starting at SRC into its rows starting at ROW. .B adds
+the bias registers first, which BIAS SRC, SHIFT loads from UB vector
+SRC, each element shifted left by SHIFT bits.
+
 Comments start with #.
 
 EXAMPLES:
@@ -24,6 +30,10 @@ EXAMPLES:
     MMC 100, 2, 3
     MMC.C 100, 2, 3
     ACT 0xab, 12, 1
+    ACT.L 0xab, 12, 1
+    LUT 12, 0, 16
+    BIAS 12, 8
+    ACT.RB 0xab, 12, 1
     NOP
     HLT
 
@@ -67,7 +77,7 @@ def putbytes(val, lo, hi):
     val = int(val)
     lo = lo * 8  # convert bytes to bits
     hi = hi * 8 + 7
-    if val > pow(2, hi-lo+1):
+    if val >= pow(2, hi-lo+1):
         raise Exception("Value {} too large for bit range {}-{}".format(val, lo, hi))
     return val << lo
     
@@ -119,6 +129,10 @@ def assemble(path, n):
             flag |= FUNC_SIGMOID_MASK
         if 'R' in flags:
             flag |= FUNC_RELU_MASK
+        if 'L' in flags:
+            flag |= FUNC_LUT_MASK
+        if 'B' in flags:
+            flag |= BIAS_MASK
             
         # binary for flags
         bin_flags = flag.to_bytes(1, byteorder=ENDIANNESS)
@@ -129,14 +143,20 @@ def assemble(path, n):
             instr = format_instr(op=opcode, flags=0, length=0, addr=0, ubaddr=0)
         elif opcode == OPCODE2BIN['HLT'][0]:
             instr = format_instr(op=opcode, flags=0, length=0, addr=0, ubaddr=0)
+        elif opcode == OPCODE2BIN['SYNC'][0]:
+            # SYNC takes no operands: it waits for outstanding memory transfers
+            instr = format_instr(op=opcode, flags=0, length=0, addr=0, ubaddr=0)
         elif opcode == OPCODE2BIN['RW'][0]:
             # RW instruction only has only operand (weight DRAM address)
             instr = format_instr(op=opcode, flags=flag, length=0, addr=operands[0], ubaddr=0)
+        elif opcode == OPCODE2BIN['BIAS'][0]:
+            # BIAS reads a single UB vector: UB-addr and shift
+            instr = format_instr(op=opcode, flags=flag, length=1, addr=operands[1], ubaddr=operands[0])
         elif (opcode == OPCODE2BIN['RHM'][0]) or (opcode == OPCODE2BIN['ACT'][0]):
             # RHM and ACT have UB-addr as their destination field
             instr = format_instr(op=opcode, flags=flag, length=operands[2], addr=operands[0], ubaddr=operands[1])
         else:
-            # WHM and MMC have UB-addr as their source field
+            # WHM, MMC and LUT have UB-addr as their source field
             instr = format_instr(op=opcode, flags=flag, length=operands[2], addr=operands[1], ubaddr=operands[0])
 
         bin_code.write(instr.to_bytes(14, byteorder=ENDIANNESS))
@@ -0,0 +1,244 @@
+'''
+Simulator throughput benchmarks, with regression checks against a stored baseline.
+
+    python3 benchmark.py --json bench.json
+    python3 benchmark.py --baseline bench.json
+
+For each MATSIZE and batch size, an MLP from gen_workload.py (MLP_LAYERS MATSIZE x MATSIZE
+layers, with ReLUs) is run on the functional simulator (sim.py) in int and raw float mode,
+measuring instructions, MACs and inferences per second, and on the RTL simulator (runtpu.py),
+measuring elaboration time, simulated cycles per second and peak memory. The shipped
+simplemult and boston programs are run too, at every MATSIZE they fit.
+
+Each RTL case runs in a fresh worker process, so its peak RSS is its own. With --baseline,
+every metric is compared with the matching case of an earlier --json file, and the run
+fails if any got worse by more than --tolerance.
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+args = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MLP_LAYERS = 3
+
+SHIPPED = [
+    ('simplemult', 'simplemult.a', 'simplemult_hostmem.npy', 'simplemult_weights.npy'),
+    ('boston', 'boston.a', 'boston_input.npy', 'boston_weights.npy'),
+]
+
+# Metrics compared against the baseline: True when higher is better
+METRICS = {
+    'instructions_per_sec' : True,
+    'macs_per_sec' : True,
+    'inferences_per_sec' : True,
+    'cycles_per_sec' : True,
+    'elaboration_sec' : False,
+    'peak_rss_mb' : False,
+}
+
+
+def assemble(text, workdir, name):
+    '''Assemble program text in workdir, returning the path of the binary.'''
+    import assembler
+    path = os.path.join(workdir, name + '.a')
+    with open(path, 'w') as f:
+        f.write(text)
+    assembler.assemble(path, 0)
+    return os.path.join(workdir, name + assembler.SUFFIX)
+
+
+def workloads(cfg, batches, workdir):
+    '''(name, batch, program path, host memory array, weights array) of every case at cfg.'''
+    import gen_workload
+    cases = []
+    for batch in batches:
+        prefix = os.path.join(workdir, 'mlp{}_b{}'.format(cfg.MATSIZE, batch))
+        gen_workload.generate(prefix, cfg, [cfg.MAT_COLS] * (MLP_LAYERS + 1), batch, ['relu'])
+        cases.append(('mlp', batch, prefix + '.out', np.load(prefix + '_host.npy'), np.load(prefix + '_weights.npy')))
+    for name, program, hostfile, weightsfile in SHIPPED:
+        hostarray = gen_workload.pad(np.load(os.path.join(HERE, hostfile)), (cfg.VECSIZE,))
+        weightsarray = gen_workload.pad(np.load(os.path.join(HERE, weightsfile)), (cfg.MAT_ROWS, cfg.MAT_COLS))
+        if hostarray is None or weightsarray is None:
+            continue  # does not fit in this array
+        with open(os.path.join(HERE, program)) as f:
+            path = assemble(f.read(), workdir, '{}{}'.format(name, cfg.MATSIZE))
+        cases.append((name, len(hostarray), path, hostarray, weightsarray))
+    return cases
+
+
+def bench_sim(cfg, program, hostarray, weightsarray, batch, raw, repeat, workdir):
+    '''Best of repeat runs of the functional simulator.'''
+    import sim
+    dtype = np.float32 if raw else cfg.INT_DTYPE
+    hostfile, weightsfile = os.path.join(workdir, 'host.npy'), os.path.join(workdir, 'weights.npy')
+    np.save(hostfile, hostarray.astype(dtype))
+    np.save(weightsfile, weightsarray.astype(dtype))
+    best = None
+    for _ in range(repeat):
+        tpusim = sim.TPUSim(program, weightsfile, hostfile, cfg=cfg, raw=raw, verbose=False)
+        start = time.perf_counter()
+        tpusim.run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    instructions = sum(len(p) for p in tpusim.programs)
+    macs = sum(length for p in tpusim.programs for opcode, _, _, length, _ in p if opcode == 'MMC') * cfg.MAT_ROWS * cfg.MAT_COLS
+    return {
+        'seconds' : best,
+        'instructions' : instructions,
+        'macs' : macs,
+        'instructions_per_sec' : instructions / best,
+        'macs_per_sec' : macs / best,
+        'inferences_per_sec' : batch * cfg.NUM_CORES / best,
+    }
+
+
+def bench_rtl(job):
+    '''Elaborate and simulate one case on the RTL. Runs in a fresh worker process.'''
+    overrides, program, hostarray, weightsarray, batch = job
+    from config import Config
+    import runtpu
+    import tpu
+    import tracing
+
+    cfg = Config(**overrides)
+    start = time.perf_counter()
+    ports = tpu.load_tpu(cfg, cache_dir=None)
+    elaboration = time.perf_counter() - start
+
+    hostmem = { a : runtpu.concat_vec(vec, cfg.DWIDTH) for a, vec in enumerate(hostarray) }
+    weightsmem = { a : runtpu.concat_tile(tile, cfg.DWIDTH) for a, tile in enumerate(weightsarray) }
+    instrs = runtpu.load_program(program, cfg)
+    start = time.perf_counter()
+    cycles, _ = runtpu.run(ports, instrs, hostmem, weightsmem, tracing.NullTrace())
+    elapsed = time.perf_counter() - start
+    return {
+        'elaboration_sec' : elaboration,
+        'seconds' : elapsed,
+        'cycles' : cycles,
+        'cycles_per_sec' : cycles / elapsed,
+        'inferences_per_sec' : batch * cfg.NUM_CORES / elapsed,
+        'peak_rss_mb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+    }
+
+
+def case_key(r):
+    return (r['simulator'], r['workload'], r['MATSIZE'], r['batch'], r['mode'])
+
+
+def regressions(results, baseline, tolerance):
+    '''(case, metric, old, new) of every metric more than tolerance worse than in baseline.'''
+    old = { case_key(r) : r for r in baseline['results'] }
+    found = []
+    for r in results:
+        b = old.get(case_key(r))
+        if b is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in r or metric not in b or not b[metric]:
+                continue
+            change = r[metric] / b[metric] - 1
+            if (-change if higher_is_better else change) > tolerance:
+                found.append((case_key(r), metric, b[metric], r[metric]))
+    return found
+
+
+def print_table(results):
+    cols = ['simulator', 'workload', 'MATSIZE', 'batch', 'mode', 'instr/s', 'MACs/s', 'inf/s', 'cycles/s', 'elab s', 'RSS MB']
+    fmt = lambda r, k, spec: spec.format(r[k]) if k in r else '-'
+    rows = [ [r['simulator'], r['workload'], str(r['MATSIZE']), str(r['batch']), r['mode'],
+              fmt(r, 'instructions_per_sec', '{:.0f}'), fmt(r, 'macs_per_sec', '{:.3g}'), fmt(r, 'inferences_per_sec', '{:.1f}'),
+              fmt(r, 'cycles_per_sec', '{:.0f}'), fmt(r, 'elaboration_sec', '{:.1f}'), fmt(r, 'peak_rss_mb', '{:.0f}')] for r in results ]
+    widths = [max(len(c), *[len(row[i]) for row in rows]) for i, c in enumerate(cols)]
+    print('  '.join(c.rjust(w) for c, w in zip(cols, widths)))
+    for row in rows:
+        print('  '.join(v.rjust(w) for v, w in zip(row, widths)))
+
+
+def parse_list(text):
+    return [ int(v, 0) for v in text.split(',') if v ]
+
+
+def parse_args():
+    global args
+
+    parser = argparse.ArgumentParser(description="Measure the throughput of the functional and RTL simulators.")
+    parser.add_argument("--sizes", type=parse_list, default=[8, 16, 32, 64],
+                        help="MATSIZE values for the functional simulator (default 8,16,32,64).")
+    parser.add_argument("--rtl-sizes", type=parse_list, default=[8, 16, 32],
+                        help="MATSIZE values for the RTL simulator (default 8,16,32; 64 takes a long time and several GB to elaborate). Empty to skip it.")
+    parser.add_argument("--batches", type=parse_list, default=[16, 256],
+                        help="Batch sizes of the generated MLP (default 16,256).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each functional simulator case; the fastest counts.")
+    parser.add_argument("--config", action='append', metavar="NAME=VALUE", default=[],
+                        help="Fix a parameter from config.py for every case (repeatable).")
+    parser.add_argument("--json", metavar="FILE", help="Write the results to FILE.")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare with the results in FILE (from --json) and exit with status 1 on a regression.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Fraction a metric may get worse before it counts as a regression (default 0.2).")
+    args = parser.parse_args()
+
+
+if __name__ == '__main__':
+    parse_args()
+    from config import Config
+    import pyrtl
+
+    fixed = dict((name, int(value, 0)) for name, _, value in (s.partition('=') for s in args.config))
+    results = []
+    workdir = tempfile.mkdtemp(prefix='tpubench')
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    ctx = multiprocessing.get_context('spawn')
+    try:
+        for size in sorted(set(args.sizes) | set(args.rtl_sizes)):
+            overrides = dict(fixed, MATSIZE=size)
+            cfg = Config(**overrides)
+            for name, batch, program, hostarray, weightsarray in workloads(cfg, args.batches, workdir):
+                case = { 'workload' : name, 'MATSIZE' : size, 'batch' : batch }
+                if size in args.sizes:
+                    for raw in (False, True):
+                        print("sim.py {} MATSIZE={} batch={} {}".format(name, size, batch, 'raw' if raw else 'int'), flush=True)
+                        r = bench_sim(cfg, program, hostarray, weightsarray, batch, raw, args.repeat, workdir)
+                        results.append(dict(case, simulator='sim', mode='raw' if raw else 'int', **r))
+                if size in args.rtl_sizes:
+                    print("runtpu.py {} MATSIZE={} batch={}".format(name, size, batch), flush=True)
+                    pool = ctx.Pool(1)
+                    r = pool.apply(bench_rtl, ((overrides, program, hostarray, weightsarray, batch),))
+                    pool.close()
+                    pool.join()
+                    results.append(dict(case, simulator='rtl', mode='int', **r))
+    finally:
+        shutil.rmtree(workdir)
+
+    print()
+    print_table(results)
+    report = {
+        'meta' : { 'python' : platform.python_version(), 'pyrtl' : getattr(pyrtl, '__version__', None), 'numpy' : np.__version__,
+                   'machine' : platform.machine(), 'config' : fixed, 'time' : time.strftime('%Y-%m-%dT%H:%M:%S') },
+        'results' : results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline, args.tolerance)
+        print()
+        if not found:
+            print("No regressions against {} (tolerance {:.0%}).".format(args.baseline, args.tolerance))
+        for key, metric, before, after in found:
+            print("REGRESSION {}: {} {:.4g} -> {:.4g} ({:+.0%})".format(' '.join(map(str, key)), metric, before, after, after / before - 1))
+        sys.exit(1 if found else 0)
@@ -4,7 +4,7 @@
     If the result is shorter than HW width: (X is don't care)
 
     --------HW WIDTH---------
-    D D D D D D D X X X X X X 
+    D D D D D D D X X X X X X
     D D D D D D D X X X X X X
 
     else:
@@ -15,39 +15,155 @@
     D D D D D D D D D D D D D
     D D X X X X X X X X X X X
 
+    (a result row of R elements takes ceil(R / HW WIDTH) hostmem rows).
+
+    Files are memory-mapped and compared CHUNK rows at a time, so outputs
+    larger than memory can be checked.
 """
 
 import argparse
+import sys
 import numpy as np
 
 args = None
 
+CHUNK = 1 << 16  # result rows compared at once
+
+
+class CheckResult(object):
+    '''Mismatches between a result and its reference, element by element.
+
+    Errors are absolute differences, and for floats also distances in ULPs of the
+    reference dtype. Indices are (row, column) of the result; width, if given, is the
+    hardware width used to map them back to (hostmem row, element).
+    '''
+
+    def __init__(self, shape, is_float, width=None):
+        self.shape = shape
+        self.is_float = is_float
+        self.width = width
+        self.mismatches = 0
+        self.first = None  # index of the first mismatch, in row-major order
+        self.worst = None  # index of the largest error
+        self.max_abs = 0
+        self.max_ulp = 0
+        self.histogram = {}  # floor(log2(error)) -> mismatches; ULPs for floats
+
+    def __bool__(self):
+        return self.mismatches == 0
+
+    def add(self, row0, bad, err, ulp):
+        '''Fold in a chunk of rows starting at row0: its mismatch mask and errors.'''
+        n = int(np.count_nonzero(bad))
+        if not n:
+            return
+        self.mismatches += n
+        if self.first is None:
+            r, c = np.unravel_index(np.argmax(bad), bad.shape)
+            self.first = (row0 + int(r), int(c))
+        key = ulp if self.is_float else err
+        worst = np.unravel_index(np.argmax(np.where(bad, key, -1)), bad.shape)
+        if self.worst is None or key[worst] > (self.max_ulp if self.is_float else self.max_abs):
+            self.worst = (row0 + int(worst[0]), int(worst[1]))
+        self.max_abs = max(self.max_abs, err[bad].max())
+        if self.is_float:
+            self.max_ulp = max(self.max_ulp, int(ulp[bad].max()))
+        buckets, counts = np.unique(np.floor(np.log2(np.maximum(key[bad], 1))).astype(int), return_counts=True)
+        for b, count in zip(buckets, counts):
+            self.histogram[int(b)] = self.histogram.get(int(b), 0) + int(count)
+
+    def locate(self, index):
+        '''(hostmem row, element) that holds a result element.'''
+        row, col = index
+        if not self.width or self.shape[1] <= self.width:
+            return row, col
+        per_row = -(-self.shape[1] // self.width)
+        return row * per_row + col // self.width, col % self.width
+
+    def report(self):
+        total = int(np.prod(self.shape))
+        lines = ['{} of {} elements differ ({:.4%})'.format(self.mismatches, total, self.mismatches / max(total, 1))]
+        if self.mismatches:
+            for name, index in (('first', self.first), ('worst', self.worst)):
+                lines.append('  {} mismatch at {} (hostmem row {}, element {})'.format(name, index, *self.locate(index)))
+            lines.append('  max abs error {}'.format(self.max_abs) + (', max ULP error {}'.format(self.max_ulp) if self.is_float else ''))
+            unit = 'ULPs' if self.is_float else 'abs error'
+            for b in sorted(self.histogram):
+                lo = 2**b if b > 0 else 1
+                lines.append('  {:>12} {:<8} {}'.format('{}-{}'.format(lo, 2**(b + 1) - 1) if b > 0 else '1', unit, self.histogram[b]))
+        return '\n'.join(lines)
+
+
+def _ordered(x, dtype):
+    '''Floats of dtype as integers in the same order, one apart for adjacent floats.'''
+    bits = np.dtype(dtype).itemsize * 8
+    i = np.ascontiguousarray(x, dtype=dtype).view('int{}'.format(bits)).astype(np.int64)
+    return np.where(i < 0, -2**(bits - 1) - i, i)
+
+
+def _wrap(x, bits):
+    '''Integers as signed bits-bit values.'''
+    if bits >= 64:
+        return x
+    sign = 1 << (bits - 1)
+    return ((x & (2*sign - 1)) ^ sign) - sign
+
+
+def _compare_chunk(x, y, int_bits, float_dtype, atol, ulps):
+    '''Mismatch mask, absolute errors and ULP errors of two blocks of results.'''
+    if float_dtype is None:
+        # Integers are compared as int_bits-bit patterns, so int8 and uint8 results agree
+        err = np.abs(_wrap(x.astype(np.int64), int_bits) - _wrap(y.astype(np.int64), int_bits))
+        return err != 0, err, None
+    x64, y64 = x.astype(np.float64), y.astype(np.float64)
+    nan = np.isnan(x64) & np.isnan(y64)
+    err = np.where(nan, 0., np.abs(x64 - y64))
+    ulp = np.where(nan, 0, np.abs(_ordered(x, float_dtype) - _ordered(y, float_dtype)))
+    bad = ~((err <= atol) | (ulp <= ulps))
+    return bad, err, ulp
+
+
+def compare(a1, a2, width=None, atol=0., ulps=0, chunk=CHUNK):
+    '''Compare result a2 against the reference a1 in blocks of rows.
+
+    With width, a2 is hostmem as written by the hardware or simulator: a row of a1 wider than
+    width is spread over consecutive rows of a2. Returns a CheckResult.
+    '''
+    if a1.ndim == 1:
+        a1 = a1.reshape(-1, 1)
+    if a2.ndim == 1:
+        a2 = a2.reshape(-1, 1)
+    rows, r_width = a1.shape
+    per_row = 1
+    if width:
+        per_row = -(-r_width // width)
+        if a2.shape[0] < rows * per_row or a2.shape[1] < min(r_width, width):
+            raise ValueError('result file shape mismatch: {} holds no {} results of width {}'.format(a2.shape, a1.shape, width))
+    elif a1.shape != a2.shape:
+        raise ValueError('result file shape mismatch: {} vs {}'.format(a1.shape, a2.shape))
+
+    floats = [ a.dtype for a in (a1, a2) if np.issubdtype(a.dtype, np.floating) ]
+    float_dtype = floats[0] if floats else None
+    int_bits = 8 * min(a1.dtype.itemsize, a2.dtype.itemsize)
+    result = CheckResult(a1.shape, float_dtype is not None, width)
+    for r in range(0, rows, chunk):
+        n = min(chunk, rows - r)
+        x = np.asarray(a1[r:r+n])
+        y = np.asarray(a2[r*per_row:(r+n)*per_row])
+        if width:
+            y = y.reshape(n, -1)[:, :r_width] if per_row > 1 else y[:, :r_width]
+        result.add(r, *_compare_chunk(x, y, int_bits, float_dtype, atol, ulps))
+    return result
+
 def equal(a1, a2):
-    assert a1.shape == a2.shape, 'result file shape mismatch.'
-    if a1.dtype == np.int8:
-        a1 = a1.astype(np.uint8)
-    if a2.dtype == np.int8:
-        a2 = a2.astype(np.uint8)
-    for x, y in np.nditer([a1, a2]):
-        assert x == y, 'result value mismatch.'
-
-def check(p1, p2, width=None):
-    r1 = np.load(p1)
-    r2 = np.load(p2)
-    if not width:
-        # Checking sim8 against hw8.
-        equal(r1, r2)
-    else:
-        # Checking gt32 against sim32.
-        #assert width == r2.shape[1]
-        r_width = r1.shape[1]
-        if r_width <= width:
-            r2 = r2[:, :r_width]
-            equal(r1, r2)
-        else:
-            r2 = np.concatenate((r2[::2], r2[1::2]), axis=1)
-            r2 = r2[:, :r_width]
-            equal(r1, r2)
+    result = compare(a1, a2)
+    assert result, 'result value mismatch.\n' + result.report()
+
+def check(p1, p2, width=None, atol=0., ulps=0):
+    r1 = np.load(p1, mmap_mode='r')
+    r2 = np.load(p2, mmap_mode='r')
+    # Checking gt32 against sim32 with a width, sim8 against hw8 without
+    return compare(r1, r2, width, atol, ulps)
 
 
 def parse_args():
@@ -65,13 +181,21 @@ def parse_args():
                         help='path to i8 simulator result.')
     parser.add_argument('--hw8', action='store', default='hw8.npy',
                         help='path to i8 hardware result.')
+    parser.add_argument('--atol', action='store', type=float, default=0.,
+                        help='Absolute error allowed in the float results.')
+    parser.add_argument('--ulps', action='store', type=int, default=0,
+                        help='ULP error allowed in the float results (either tolerance passes).')
     args = parser.parse_args()
 
 
 if __name__ == '__main__':
     parse_args()
-    print 'HW width set to %d.' % args.width
-    check(args.gt32, args.sim32, args.width)
-    print '32-bit passed.'
-    check(args.sim8, args.hw8)
-    print '8-bit passed.'
+    print('HW width set to %d.' % args.width)
+    ok = True
+    for name, (p1, p2, width) in (('32-bit', (args.gt32, args.sim32, args.width)), ('8-bit', (args.sim8, args.hw8, None))):
+        result = check(p1, p2, width, args.atol, args.ulps)
+        print('{} {}.'.format(name, 'passed' if result else 'FAILED'))
+        if not result:
+            print(result.report())
+        ok = ok and bool(result)
+    sys.exit(0 if ok else 1)
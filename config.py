@@ -4,14 +4,135 @@ Hardware configuration.
 
 MATSIZE = 16
 
+# Shape of the MM array, MAT_ROWS inputs by MAT_COLS outputs; None for MATSIZE. Vectors in the
+# Unified Buffer and host memory are max(MAT_ROWS, MAT_COLS) elements wide
+MAT_ROWS = None
+MAT_COLS = None
+
 HOST_ADDR_SIZE = 64
 UB_ADDR_SIZE = 12
 WEIGHT_DRAM_ADDR_SIZE = 40
 ACC_ADDR_SIZE = 16
+# Bits per activation and weight (4, 8 or 16); the accumulators are ACC_WIDTH = 4*DWIDTH bits
 DWIDTH = 8
 INSTRUCTION_WIDTH = 14 * 8
 IMEM_ADDR_SIZE = 12
 
+# Register stages in each MAC (0 or 1): 1 registers the product (and has the accumulators prefetch
+# their operand), which adds a cycle to MMC but takes the multiply-add off the critical path
+MAC_PIPELINE = 0
+
+# Operand gating: a MAC with a zero activation or weight holds its multiplier inputs and skips the
+# add, saving switching activity on sparse data (see tracing.ToggleCounter) at the cost of a few
+# registers and muxes per MAC. Results and timing are unchanged
+MAC_ZERO_GATING = False
+
+# Tile buffers in the weight FIFO (at least 2), and the width of one weight DRAM transfer in bytes
+WEIGHT_FIFO_DEPTH = 4
+WEIGHT_DRAM_BEAT_BYTES = 64
+
+# Width of the host memory interface, in vectors moved per cycle by RHM and WHM
+HOST_VECS_PER_BEAT = 1
+
+# Activation lookup table (ACT.L), loaded from the UB by LUT: 2**ACT_LUT_BITS (up to 16) DWIDTH-bit entries,
+# indexed by each accumulator value shifted right by ACT_LUT_SHIFT and saturated to ACT_LUT_BITS
+# signed bits. 0 leaves the table out, and ACT.L passes values through like plain ACT
+ACT_LUT_BITS = 8
+ACT_LUT_SHIFT = 0
+
+# Per-column bias registers in the activate unit, loaded from the UB by BIAS and added to the
+# accumulator values by ACT.B before the activation function. False leaves them out. The add sits
+# between the accumulator read and the activation, on the critical path: it costs about 17% of
+# the clock frequency (71 vs 86 MHz at MATSIZE=4 by PyRTL's timing estimate), so it is off by default
+ACT_BIAS = False
+
+# Cores, each with its own instruction memory, Unified Buffer, MM and activate units; they share
+# the weight DRAM and host memory ports through round-robin arbiters
+NUM_CORES = 1
+
+# Scoreboard: stall issue on busy units and UB/accumulator hazards, so programs need no NOP padding
+INTERLOCK = True
+
+# Performance counter registers (readable as perf_* outputs); off by default so they cost nothing in synthesis
+PERF_COUNTERS = False
+PERF_COUNTER_WIDTH = 32
+
+
+class Config(object):
+    '''A set of hardware parameters: the module defaults above, with any overrides.
+
+    Config(MATSIZE=8) describes an 8x8 TPU without touching the module globals, so
+    designs with different parameters can be built side by side (see tpu.build_tpu).
+    MAT_ROWS and MAT_COLS left as None are filled in from MATSIZE.
+    '''
+
+    DATA_WIDTHS = (4, 8, 16)
+
+    def __init__(self, **overrides):
+        g = globals()
+        for name in g:
+            if name.isupper():
+                setattr(self, name, g[name])
+        for name, value in overrides.items():
+            if name not in g or not name.isupper():
+                raise ValueError('Unknown config parameter "{}"'.format(name))
+            setattr(self, name, value)
+        if self.MAT_ROWS is None:
+            self.MAT_ROWS = self.MATSIZE
+        if self.MAT_COLS is None:
+            self.MAT_COLS = self.MATSIZE
+        if self.DWIDTH not in self.DATA_WIDTHS:
+            raise ValueError('DWIDTH must be one of {} (got {})'.format(self.DATA_WIDTHS, self.DWIDTH))
+        if not 0 <= self.ACT_LUT_BITS <= 16:
+            raise ValueError('ACT_LUT_BITS must be between 0 and 16 (got {})'.format(self.ACT_LUT_BITS))
+
+    @property
+    def VECSIZE(self):
+        '''Elements in a Unified Buffer / host memory vector.'''
+        return max(self.MAT_ROWS, self.MAT_COLS)
+
+    @property
+    def ACC_WIDTH(self):
+        '''Bits per accumulator: a full product plus headroom for summing its column.'''
+        return 4 * self.DWIDTH
+
+    @property
+    def INT_DTYPE(self):
+        '''Name of the numpy integer type that holds a data element, e.g. in host memory files.'''
+        return 'int{}'.format(max(8, self.DWIDTH))
+
+    @property
+    def ACC_DTYPE(self):
+        '''Name of the numpy integer type that holds an accumulator.'''
+        return 'int{}'.format(self.ACC_WIDTH)
+
+    @property
+    def ACT_LUT_SHAPE(self):
+        '''(entries, rows) of the activation table: each row is loaded from the first entries
+        elements of a UB vector, a power of two so that rows are picked by bit slices. There
+        are at least two rows, as a row address has at least one bit.'''
+        size = 2**max(1, self.ACT_LUT_BITS)
+        entries = min(2**(self.VECSIZE.bit_length() - 1), size // 2)
+        return entries, size // entries
+
+    @property
+    def TILE_BEATS(self):
+        '''Weight DRAM beats that carry one MAT_ROWS x MAT_COLS weight tile.'''
+        return max(-(-self.MAT_ROWS*self.MAT_COLS*self.DWIDTH // (self.WEIGHT_DRAM_BEAT_BYTES*8)), 1)
+
+    def key(self):
+        '''Sorted (name, value) pairs, for hashing and comparison.'''
+        return tuple(sorted((k, v) for k, v in vars(self).items() if k.isupper()))
+
+    def __eq__(self, other):
+        return isinstance(other, Config) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return 'Config({})'.format(', '.join('{}={!r}'.format(k, v) for k, v in self.key()))
+
 # values = [host_addr_size, ub_addr_size, weight_dram_addr_size, acc_addr_size, mat_mul_size, data_width]
 #
 # def set_config(values):
@@ -2,40 +2,45 @@ from pyrtl import *
 import config
 import isa
 
-DATASIZE = config.DWIDTH
-MATSIZE = config.MATSIZE
-ACCSIZE = config.ACC_ADDR_SIZE
-
-def decode(instruction):
+def decode(instruction, cfg=config):
     """
     :param instruction: instruction + optional operands + flags
+    :param cfg: hardware parameters (a config.Config, or the config module itself)
     """
+    ACCSIZE = cfg.ACC_ADDR_SIZE
 
     accum_raddr = WireVector(ACCSIZE)
     accum_waddr = WireVector(ACCSIZE)
     accum_overwrite = WireVector(1)
     switch_weights = WireVector(1)
-    weights_raddr = WireVector(config.WEIGHT_DRAM_ADDR_SIZE)  # read address for weights DRAM
+    weights_raddr = WireVector(cfg.WEIGHT_DRAM_ADDR_SIZE)  # read address for weights DRAM
     weights_read = WireVector(1)  # raised high to perform DRAM read
 
     ub_addr = WireVector(24)  # goes to FSM
-    ub_raddr = WireVector(config.UB_ADDR_SIZE)  # goes to UB read addr port
-    ub_waddr = WireVector(config.UB_ADDR_SIZE)
+    ub_raddr = WireVector(cfg.UB_ADDR_SIZE)  # goes to UB read addr port
+    ub_waddr = WireVector(cfg.UB_ADDR_SIZE)
 
     whm_length = WireVector(8)
     rhm_length = WireVector(8)
     mmc_length = WireVector(16)
     act_length = WireVector(8)
     act_type = WireVector(2)
+    lut_length = WireVector(8)
+    lut_row = WireVector(16)  # first activation table row a LUT instruction writes
+    act_bias = WireVector(1)
+    bias_shift = WireVector(8)
 
-    rhm_addr = WireVector(config.HOST_ADDR_SIZE)
-    whm_addr = WireVector(config.HOST_ADDR_SIZE)
+    rhm_addr = WireVector(cfg.HOST_ADDR_SIZE)
+    whm_addr = WireVector(cfg.HOST_ADDR_SIZE)
 
     dispatch_mm = WireVector(1)
     dispatch_act = WireVector(1)
     dispatch_rhm = WireVector(1)
     dispatch_whm = WireVector(1)
     dispatch_halt = WireVector(1)
+    dispatch_sync = WireVector(1)
+    dispatch_lut = WireVector(1)
+    dispatch_bias = WireVector(1)
 
     # parse instruction
     op = instruction[ isa.OP_START*8 : isa.OP_END*8 ]
@@ -74,11 +79,12 @@ def decode(instruction):
             ub_waddr |= ubaddr
             act_length |= ilength
             act_type |= iflags[isa.ACT_FUNC_BITS]
+            act_bias |= iflags[isa.BIAS_BIT]
             #probe(act_length, "act_length")
             #probe(act_type, "act_type")
             # TODO: ACT takes function select bits
         with op == isa.OPCODE2BIN['SYNC'][0]:
-            pass
+            dispatch_sync |= 1
         with op == isa.OPCODE2BIN['RHM'][0]:
             dispatch_rhm |= 1
             rhm_addr |= memaddr
@@ -86,8 +92,17 @@ def decode(instruction):
             rhm_length |= ilength
         with op == isa.OPCODE2BIN['HLT'][0]:
             dispatch_halt |= 1
+        with op == isa.OPCODE2BIN['LUT'][0]:
+            dispatch_lut |= 1
+            ub_raddr |= ubaddr
+            lut_row |= memaddr
+            lut_length |= ilength
+        with op == isa.OPCODE2BIN['BIAS'][0]:
+            dispatch_bias |= 1
+            ub_raddr |= ubaddr
+            bias_shift |= memaddr
 
         #with otherwise:
         #    print("otherwise")
 
-    return dispatch_mm, dispatch_act, dispatch_rhm, dispatch_whm, dispatch_halt, ub_addr, ub_raddr, ub_waddr, rhm_addr, whm_addr, rhm_length, whm_length, mmc_length, act_length, act_type, accum_raddr, accum_waddr, accum_overwrite, switch_weights, weights_raddr, weights_read
+    return dispatch_mm, dispatch_act, dispatch_rhm, dispatch_whm, dispatch_halt, dispatch_sync, ub_addr, ub_raddr, ub_waddr, rhm_addr, whm_addr, rhm_length, whm_length, mmc_length, act_length, act_type, accum_raddr, accum_waddr, accum_overwrite, switch_weights, weights_raddr, weights_read, dispatch_lut, lut_row, lut_length, dispatch_bias, bias_shift, act_bias
@@ -0,0 +1,176 @@
+'''
+Design-space exploration: sweep config.py parameters, and for each point elaborate,
+simulate a fixed workload, synthesize and optimize, then report area, frequency and
+throughput with the Pareto-optimal points marked.
+
+    python3 dse.py boston.out boston_input.npy boston_weights.npy --sweep MATSIZE=8,16 --sweep WEIGHT_FIFO_DEPTH=2,4
+
+Points are evaluated in parallel worker processes. Results are cached in tpu.CACHE_DIR,
+keyed on the design and the workload, so a sweep that is extended or rerun only
+evaluates the new points.
+'''
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+args = None
+
+
+def parse_setting(setting):
+    name, _, values = setting.partition('=')
+    return name.strip(), [int(v, 0) for v in values.split(',')]
+
+
+def sweep_points(sweeps, fixed):
+    '''One dict of config overrides per point of the cross product of the sweeps.'''
+    names = [name for name, _ in sweeps]
+    for values in itertools.product(*[values for _, values in sweeps]):
+        point = dict(fixed)
+        point.update(zip(names, values))
+        yield point
+
+
+def workload_key(workload):
+    h = hashlib.sha1()
+    for path in workload:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def evaluate(job):
+    '''Elaborate, simulate, synthesize and optimize one configuration. Runs in a worker process.'''
+    overrides, workload, cache_dir = job
+    from pyrtl import set_working_block, synthesize, optimize
+    from pyrtl.analysis import area_estimation, TimingAnalysis
+    from config import Config
+    from gen_workload import pad
+    import runtpu
+    import tpu
+    import tracing
+
+    cfg = Config(**overrides)
+    path = None
+    if cache_dir is not None:
+        key = hashlib.sha1((tpu.design_key(cfg, False) + workload_key(workload)).encode()).hexdigest()
+        path = os.path.join(cache_dir, 'dse', key + '.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+
+    result = { 'config' : overrides, 'cores' : cfg.NUM_CORES }
+    ports = tpu.load_tpu(cfg, cache_dir=cache_dir)
+
+    # Cycle count of the workload, run on every core; its vectors and tiles are zero-padded up to the array shape
+    prog, hostfile, weightsfile = workload
+    hostarray = pad(np.load(hostfile), (cfg.VECSIZE,))
+    weightsarray = pad(np.load(weightsfile), (cfg.MAT_ROWS, cfg.MAT_COLS))
+    if hostarray is None or weightsarray is None:
+        result['cycles'] = None  # the workload does not fit in the array
+    else:
+        hostmem = { a : runtpu.concat_vec(vec, cfg.DWIDTH) for a, vec in enumerate(hostarray) }
+        weightsmem = { a : runtpu.concat_tile(tile, cfg.DWIDTH) for a, tile in enumerate(weightsarray) }
+        instrs = runtpu.load_program(prog, cfg)
+        result['cycles'], _ = runtpu.run(ports, instrs, hostmem, weightsmem, tracing.NullTrace())
+
+    with set_working_block(ports.block):
+        synthesize()
+        optimize()
+        result['logic_area'], result['mem_area'] = area_estimation()
+        result['max_freq'] = TimingAnalysis().max_freq()
+
+    if path is not None:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp = path + '.tmp{}'.format(os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(result, f)
+        os.rename(tmp, path)
+    return result
+
+
+def pareto(results):
+    '''Mark the results no other result beats on area, frequency and throughput at once.'''
+    def key(r):
+        return (-(r['logic_area'] + r['mem_area']), r['max_freq'], r['inferences_per_sec'] or 0)
+    for r in results:
+        k = key(r)
+        r['pareto'] = not any(all(a >= b for a, b in zip(key(o), k)) and key(o) != k for o in results)
+
+
+def print_table(results, names):
+    cols = names + ['logic mm^2', 'mem mm^2', 'MHz', 'cycles', 'inf/s', 'pareto']
+    rows = []
+    for r in sorted(results, key=lambda r: r['logic_area'] + r['mem_area']):
+        rows.append([str(r['config'][n]) for n in names] + [
+            '{:.3f}'.format(r['logic_area']),
+            '{:.3f}'.format(r['mem_area']),
+            '{:.1f}'.format(r['max_freq']),
+            '-' if r['cycles'] is None else str(r['cycles']),
+            '-' if r['inferences_per_sec'] is None else '{:.0f}'.format(r['inferences_per_sec']),
+            '*' if r['pareto'] else '',
+        ])
+    widths = [max(len(c), *[len(row[i]) for row in rows]) for i, c in enumerate(cols)]
+    print('  '.join(c.rjust(w) for c, w in zip(cols, widths)))
+    for row in rows:
+        print('  '.join(v.rjust(w) for v, w in zip(row, widths)))
+
+
+def parse_args():
+    global args
+
+    parser = argparse.ArgumentParser(description="Sweep hardware parameters and report area, frequency and throughput for each design point.")
+    parser.add_argument("prog", metavar="program.bin", help="The workload: a binary program for OpenTPU.")
+    parser.add_argument("hostmem", metavar="HostMemoryArray", help="Initial host memory of the workload (vectors are zero-padded to the UB vector width).")
+    parser.add_argument("weightsmem", metavar="WeightsMemoryArray", help="Weights memory of the workload (tiles are zero-padded to MAT_ROWS x MAT_COLS).")
+    parser.add_argument("--sweep", action='append', metavar="NAME=V1,V2,...", default=[],
+                        help="Values to sweep for a parameter from config.py, e.g. --sweep MATSIZE=8,16 (repeatable; the sweeps are crossed).")
+    parser.add_argument("--config", action='append', metavar="NAME=VALUE", default=[],
+                        help="Fix a parameter from config.py for every point (repeatable).")
+    parser.add_argument("--inferences", type=int, default=None,
+                        help="Inferences the workload performs on one core, for inferences/sec (default: one per host memory vector).")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(), help="Worker processes (default: one per CPU).")
+    parser.add_argument("--no-cache", action='store_true', help="Evaluate every point, ignoring and not writing cached results.")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results to FILE.")
+    args = parser.parse_args()
+
+
+if __name__ == '__main__':
+    parse_args()
+    import tpu
+
+    sweeps = [parse_setting(s) for s in args.sweep]
+    fixed = dict((name, values[0]) for name, values in map(parse_setting, args.config))
+    points = list(sweep_points(sweeps, fixed))
+    workload = (args.prog, args.hostmem, args.weightsmem)
+    cache_dir = None if args.no_cache else tpu.CACHE_DIR
+    inferences = args.inferences or len(np.load(args.hostmem))
+
+    # Elaboration recurses deeply; give workers the same headroom as the main process
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    jobs = [(point, workload, cache_dir) for point in points]
+    print("Evaluating {} design points with {} workers...".format(len(jobs), min(args.jobs, len(jobs))))
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        results = pool.map(evaluate, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = [evaluate(job) for job in jobs]
+
+    for r in results:
+        cycles = r['cycles']
+        r['inferences_per_sec'] = None if cycles is None else inferences * r['cores'] * r['max_freq'] * 1e6 / cycles
+    pareto(results)
+    print_table(results, [name for name, _ in sweeps] or sorted(fixed))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
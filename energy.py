@@ -0,0 +1,113 @@
+'''
+Energy estimates, for comparing configurations and schedules on performance per watt.
+
+    python3 runtpu.py boston.out boston_input.npy boston_weights.npy --energy --inferences 10
+    python3 sim.py boston.out boston_input.npy boston_weights.npy --energy --inferences 10
+
+runtpu.py counts the bit toggles on every wire of the design (tracing.ToggleCounter) and
+charges each toggle by the operation driving the wire: a multiplier output toggle costs
+more than a register's. Leakage is charged by the area from PyRTL's area_estimation()
+for the cycles the run took; the weight DRAM and host memory are off chip and not
+counted. sim.py instead counts operations (MACs, SRAM and DRAM bytes, activations,
+instructions), which is far cheaper but blind to the data's switching activity beyond
+zero operands.
+
+The coefficients are rough 45nm figures (after Horowitz, "Computing's energy problem",
+ISSCC 2014), scaled with the operand width where it matters. Only comparisons between
+runs under the same coefficients are meaningful, not the absolute numbers.
+'''
+
+# pJ per bit toggle on a wire, by the op of the net driving it ('*' multiplier, '+' adder,
+# 'r' register, 'm' memory read); anything else is charged TOGGLE_PJ_DEFAULT
+TOGGLE_PJ = { '*' : 0.025, '+' : 0.006, '-' : 0.006, 'r' : 0.005, 'm' : 0.15 }
+TOGGLE_PJ_DEFAULT = 0.002
+
+# pJ per operation, at 8-bit data and 32-bit accumulators
+OP_PJ = {
+    'mult' : 0.2,  # 8-bit multiply
+    'add' : 0.1,  # 32-bit add
+    'sram_byte' : 1.25,  # on-chip SRAM (UB, accumulators, FIFO, instruction memory)
+    'dram_byte' : 160.,  # weight DRAM and host memory
+    'activation' : 0.05,  # one element through the activate unit
+}
+
+# Process node for PyRTL's area and timing estimates, to match the coefficients
+TECH_NM = 45
+LEAKAGE_MW_PER_MM2 = 1.0
+
+
+def mac_pj(cfg):
+    '''One MAC: a DWIDTH-bit multiply and an ACC_WIDTH-bit add.'''
+    return OP_PJ['mult'] * (cfg.DWIDTH / 8.)**2 + OP_PJ['add'] * cfg.ACC_WIDTH / 32.
+
+
+def static_pj(area_mm2, cycles, clock_mhz):
+    '''Leakage over a run of cycles at clock_mhz.'''
+    return LEAKAGE_MW_PER_MM2 * area_mm2 * cycles / clock_mhz * 1e3  # mW * us = nJ
+
+
+def toggle_energy(counter):
+    '''Dynamic energy in pJ, by module (see tracing.module), of the toggles a ToggleCounter saw.'''
+    from tracing import wire_modules
+    energy = {}
+    for name, (m, op) in wire_modules(counter.block).items():
+        if name in counter.toggles:
+            energy[m] = energy.get(m, 0.) + counter.toggles[name] * TOGGLE_PJ.get(op, TOGGLE_PJ_DEFAULT)
+    return energy
+
+
+def op_counts(programs, cfg, mmc_stats=()):
+    '''Operations the programs perform: MACs, SRAM and DRAM bytes, activations and instructions.
+
+    mmc_stats are sim.TPUSim's, for the MACs MAC_ZERO_GATING skips; without them none are.
+    '''
+    import isa
+    R, C = cfg.MAT_ROWS, cfg.MAT_COLS
+    vec = cfg.VECSIZE * cfg.DWIDTH // 8
+    acc = C * cfg.ACC_WIDTH // 8  # bytes in an accumulator row
+    tile = R * C * cfg.DWIDTH // 8
+    counts = dict.fromkeys(['macs', 'gated_macs', 'sram_bytes', 'dram_bytes', 'host_bytes', 'activations', 'instructions'], 0)
+    for program in programs:
+        for opcode, _, _, length, flag in program:
+            counts['instructions'] += 1
+            counts['sram_bytes'] += isa.INSTRUCTION_WIDTH_BYTES
+            if opcode == 'MMC':
+                counts['macs'] += length * R * C
+                # UB reads, and accumulator writes (read-modify-write unless overwriting)
+                counts['sram_bytes'] += length * (vec + acc * (1 if flag & isa.OVERWRITE_MASK else 2))
+            elif opcode == 'ACT':
+                counts['activations'] += length * C
+                counts['sram_bytes'] += length * (acc + vec)
+            elif opcode in ('RHM', 'WHM'):
+                counts['host_bytes'] += length * vec
+                counts['sram_bytes'] += length * vec
+            elif opcode == 'RW':
+                counts['dram_bytes'] += tile
+                counts['sram_bytes'] += 2 * tile  # into the FIFO and out to the array
+            elif opcode in ('LUT', 'BIAS'):
+                counts['sram_bytes'] += length * vec
+    if cfg.MAC_ZERO_GATING:
+        counts['gated_macs'] = int(sum(length * R * C * zero for _, _, length, _, _, zero in mmc_stats))
+    return counts
+
+
+def op_energy(counts, cfg):
+    '''Dynamic energy in pJ, by kind of operation, of op_counts().'''
+    return {
+        'mac_array' : (counts['macs'] - counts['gated_macs']) * mac_pj(cfg),
+        'sram' : counts['sram_bytes'] * OP_PJ['sram_byte'],
+        'weight_dram' : counts['dram_bytes'] * OP_PJ['dram_byte'],
+        'host' : counts['host_bytes'] * OP_PJ['dram_byte'],
+        'activate' : counts['activations'] * OP_PJ['activation'],
+    }
+
+
+def report(dynamic, inferences, static=None):
+    '''Text summary: dynamic energy by part, leakage if known, and the total per inference.'''
+    total = sum(dynamic.values()) + (static or 0.)
+    lines = ['Energy: {:.4g} nJ, {:.4g} nJ per inference ({} inferences)'.format(total / 1e3, total / 1e3 / max(inferences, 1), inferences)]
+    for part, pj in sorted(dynamic.items(), key=lambda item: -item[1]):
+        lines.append('  {:<16} {:>12.4g} nJ  {:5.1f}%'.format(part, pj / 1e3, 100. * pj / max(total, 1e-12)))
+    if static is not None:
+        lines.append('  {:<16} {:>12.4g} nJ  {:5.1f}%'.format('leakage', static / 1e3, 100. * static / max(total, 1e-12)))
+    return '\n'.join(lines)
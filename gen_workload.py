@@ -0,0 +1,275 @@
+'''
+Synthetic workloads: an MLP program with its host memory, weight DRAM and reference outputs.
+
+    python3 gen_workload.py mlp --layers 784,256,10 --batch 10000 --acts relu,none --sparsity 0.5 --config MATSIZE=16
+    python3 sim.py mlp.out mlp_host.npy mlp_weights.npy --config MATSIZE=16
+    python3 gen_workload.py mlp --check sim8.npy
+    python3 sim.py mlp.out mlp_host_raw.npy mlp_weights_raw.npy --config MATSIZE=16 --raw
+    python3 gen_workload.py mlp --check sim32.npy --ulps 16
+
+writes, for PREFIX mlp:
+
+    mlp.a, mlp.out        the program
+    mlp_host.npy          host memory: the inputs, then room for the outputs
+    mlp_weights.npy       weight DRAM, one MAT_ROWS x MAT_COLS tile per address
+    mlp_host_raw.npy, mlp_weights_raw.npy   the same as floats, for sim.py --raw
+    mlp_ref_int.npy       what the hardware outputs (DWIDTH-bit ints), a row per input
+    mlp_ref_float.npy     the outputs of the same network without any wrapping (sim.py --raw)
+    mlp.json              the layout of host memory, for outputs()
+
+Activations are split into blocks of min(MAT_ROWS, MAT_COLS) elements, one UB vector each:
+an MMC reads the first MAT_ROWS elements of a vector and an ACT writes MAT_COLS, so on a
+wide array each tile only fills its first MAT_ROWS columns. The batch is run CHUNK inputs
+at a time (at most 255, the largest length an instruction holds); in host memory each
+chunk's inputs, and then each chunk's outputs, are stored block by block: block i of the
+chunk's n inputs is n consecutive vectors. Inputs and outputs are written
+a chunk at a time to memory-mapped files, so batches far larger than memory can be made.
+
+Programs rely on the scoreboard (INTERLOCK) rather than NOP padding, and ones longer than
+2**IMEM_ADDR_SIZE instructions only run on sim.py.
+'''
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from config import Config
+import sim
+
+args = None
+
+ACTS = { 'none' : '', 'relu' : '.R', 'sigmoid' : '.Q' }
+MAX_LENGTH = 255  # vectors one instruction can move or process
+ACC_ROWS = 4000  # accumulator rows in sim.py
+
+
+def block_size(cfg):
+    '''Elements of an activation in each UB vector.'''
+    return min(cfg.MAT_ROWS, cfg.MAT_COLS)
+
+
+def blocks(n, cfg):
+    '''UB vectors holding an activation of n elements.'''
+    return -(-n // block_size(cfg))
+
+
+def wrap(x, bits):
+    '''Integers cut down to signed bits-bit values, like the hardware's registers.'''
+    x = np.asarray(x, dtype=np.int64)
+    if bits >= 64:
+        return x
+    sign = 1 << (bits - 1)
+    return ((x & (2*sign - 1)) ^ sign) - sign
+
+
+def chunk_size(cfg, layers):
+    '''Inputs per chunk: two UB regions, each big enough for any layer's activations, and two accumulator buffers.'''
+    most = max(blocks(n, cfg) for n in layers)
+    return max(1, min(MAX_LENGTH, 2**cfg.UB_ADDR_SIZE // (2 * most), min(2**cfg.ACC_ADDR_SIZE, ACC_ROWS) // 2))
+
+
+def to_host(x, cfg):
+    '''n activations of an MLP layer as host memory vectors, block by block.'''
+    n, k = x.shape
+    e = block_size(cfg)
+    padded = np.zeros((n, blocks(k, cfg) * e), dtype=x.dtype)
+    padded[:, :k] = x
+    vecs = np.zeros((blocks(k, cfg) * n, cfg.VECSIZE), dtype=x.dtype)
+    vecs[:, :e] = padded.reshape(n, -1, e).transpose(1, 0, 2).reshape(-1, e)
+    return vecs
+
+
+def from_host(vecs, n, k, cfg):
+    '''The inverse of to_host: n activations of k elements from their host memory vectors.'''
+    e = block_size(cfg)
+    return np.asarray(vecs)[:, :e].reshape(-1, n, e).transpose(1, 0, 2).reshape(n, -1)[:, :k]
+
+
+def forward(x, weights, acts, cfg, raw=False):
+    '''Outputs of the MLP for inputs x, as sim.py computes them (raw: exactly, in floats).'''
+    a = x.astype(np.float64)
+    for w, act in zip(weights, acts):
+        acc = a @ w.astype(np.float64)  # exact for DWIDTH-bit ints, being far below 2**53
+        if not raw:
+            acc = wrap(acc.astype(np.int64), cfg.ACC_WIDTH)
+        if act == 'relu':
+            acc = np.maximum(acc, 0)
+        elif act == 'sigmoid':
+            acc = sim.sigmoid(acc, cfg.DWIDTH, raw)
+        a = acc if raw else wrap(acc, cfg.DWIDTH).astype(np.float64)
+    return a if raw else a.astype(np.int64)
+
+
+def chunk_program(cfg, layers, acts, n, host_in, host_out, tile0=0):
+    '''Instructions running n inputs through the MLP: read from host_in, written to host_out.'''
+    region = [ 0, 2**cfg.UB_ADDR_SIZE // 2 ]
+    prog = [ 'RHM {}, {}, {}'.format(host_in + i*n, region[0] + i*n, n) for i in range(blocks(layers[0], cfg)) ]
+    tile = tile0
+    for l, act in enumerate(acts):
+        src, dst = region[l % 2], region[(l + 1) % 2]
+        for j in range(blocks(layers[l+1], cfg)):
+            acc = (j % 2) * n  # alternate, so an ACT can drain one while the next MMCs fill the other
+            for i in range(blocks(layers[l], cfg)):
+                prog.append('RW {}'.format(tile))
+                prog.append('MMC.S{} {}, {}, {}'.format('O' if i == 0 else '', src + i*n, acc, n))
+                tile += 1
+            prog.append('ACT{} {}, {}, {}'.format(ACTS[act], acc, dst + j*n, n))
+    out = region[len(acts) % 2]
+    prog += [ 'WHM {}, {}, {}'.format(out + j*n, host_out + j*n, n) for j in range(blocks(layers[-1], cfg)) ]
+    return prog
+
+
+def tiles(weights, cfg):
+    '''Weight DRAM: the tiles of every layer in the order chunk_program reads them.'''
+    e = block_size(cfg)
+    out = []
+    for w in weights:
+        k, n = w.shape
+        for j in range(blocks(n, cfg)):
+            for i in range(blocks(k, cfg)):
+                tile = np.zeros((cfg.MAT_ROWS, cfg.MAT_COLS), dtype=w.dtype)
+                block = w[i*e:(i+1)*e, j*e:(j+1)*e]
+                tile[:block.shape[0], :block.shape[1]] = block
+                out.append(tile)
+    return np.array(out)
+
+
+def pad(array, shape):
+    '''Zero-pad the last axes of a host memory (N x n) or weights (T x rows x cols) array to shape.'''
+    if any(n > size for n, size in zip(array.shape[1:], shape)):
+        return None
+    return np.pad(array, [(0, 0)] + [(0, size - n) for n, size in zip(array.shape[1:], shape)], 'constant')
+
+
+def random_ints(rng, shape, sparsity, cfg):
+    x = rng.randint(-2**(cfg.DWIDTH - 1), 2**(cfg.DWIDTH - 1), shape).astype(cfg.INT_DTYPE)
+    if sparsity:
+        x[rng.random_sample(shape) < sparsity] = 0
+    return x
+
+
+def generate(prefix, cfg, layers, batch, acts=None, sparsity=0., weight_sparsity=0., seed=0, chunk=None):
+    '''Write the files of an MLP workload (see the module docstring) and return its manifest.
+
+    layers are the activation sizes, from the inputs to the outputs; acts the activation of
+    each layer (none, relu or sigmoid), the last one repeated as needed (default: ReLU on
+    the hidden layers only).
+    '''
+    import assembler
+
+    nlayers = len(layers) - 1
+    if acts is None:
+        acts = ['relu'] * (nlayers - 1) + ['none']
+    acts = (list(acts) + [acts[-1]] * nlayers)[:nlayers]
+    for act in acts:
+        if act not in ACTS:
+            raise ValueError('Unknown activation "{}" (one of {})'.format(act, ', '.join(sorted(ACTS))))
+    chunk = chunk or chunk_size(cfg, layers)
+    if not 0 < chunk <= chunk_size(cfg, layers):
+        raise ValueError('Chunks of {} inputs do not fit (at most {})'.format(chunk, chunk_size(cfg, layers)))
+
+    rng = np.random.RandomState(seed)
+    weights = [ random_ints(rng, (k, n), weight_sparsity, cfg) for k, n in zip(layers, layers[1:]) ]
+    weight_tiles = tiles(weights, cfg)
+    np.save(prefix + '_weights.npy', weight_tiles)
+    np.save(prefix + '_weights_raw.npy', weight_tiles.astype(np.float32))
+
+    in_blocks, out_blocks = blocks(layers[0], cfg), blocks(layers[-1], cfg)
+    output_base = batch * in_blocks
+    host_shape = (output_base + batch * out_blocks, cfg.VECSIZE)
+    host = np.lib.format.open_memmap(prefix + '_host.npy', mode='w+', dtype=cfg.INT_DTYPE, shape=host_shape)
+    host_raw = np.lib.format.open_memmap(prefix + '_host_raw.npy', mode='w+', dtype=np.float32, shape=host_shape)
+    ref_int = np.lib.format.open_memmap(prefix + '_ref_int.npy', mode='w+', dtype=cfg.INT_DTYPE, shape=(batch, layers[-1]))
+    ref_float = np.lib.format.open_memmap(prefix + '_ref_float.npy', mode='w+', dtype=np.float32, shape=(batch, layers[-1]))
+
+    with open(prefix + '.a', 'w') as f:
+        f.write('# MLP {} on {} inputs, {} at a time ({})\n'.format('x'.join(map(str, layers)), batch, chunk, ', '.join(acts)))
+        for start in range(0, batch, chunk):
+            n = min(chunk, batch - start)
+            x = random_ints(rng, (n, layers[0]), sparsity, cfg)
+            for array in (host, host_raw):
+                array[start*in_blocks:(start+n)*in_blocks] = to_host(x, cfg)
+                array[output_base + start*out_blocks:output_base + (start+n)*out_blocks] = 0
+            ref_int[start:start+n] = forward(x, weights, acts, cfg)
+            ref_float[start:start+n] = forward(x, weights, acts, cfg, raw=True)
+            for line in chunk_program(cfg, layers, acts, n, start*in_blocks, output_base + start*out_blocks):
+                f.write(line + '\n')
+        f.write('HLT\n')
+    for array in (host, host_raw, ref_int, ref_float):
+        array.flush()
+    assembler.assemble(prefix + '.a', 0)
+
+    manifest = {
+        'layers' : list(layers), 'acts' : acts, 'batch' : batch, 'chunk' : chunk, 'seed' : seed,
+        'sparsity' : sparsity, 'weight_sparsity' : weight_sparsity,
+        'config' : dict(cfg.key()), 'output_base' : output_base,
+    }
+    with open(prefix + '.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def outputs(hostmem, manifest):
+    '''The outputs of a workload, a row per input, from the host memory after running it.'''
+    cfg = Config(**manifest['config'])
+    batch, chunk, k = manifest['batch'], manifest['chunk'], manifest['layers'][-1]
+    nblocks = blocks(k, cfg)
+    rows = []
+    for start in range(0, batch, chunk):
+        n = min(chunk, batch - start)
+        base = manifest['output_base'] + start * nblocks
+        rows.append(from_host(hostmem[base:base + n*nblocks], n, k, cfg))
+    return np.concatenate(rows) if rows else np.zeros((0, k), dtype=hostmem.dtype)
+
+
+def parse_args():
+    global args
+
+    parser = argparse.ArgumentParser(description="Generate an MLP workload: program, host memory, weights and reference outputs.")
+    parser.add_argument("prefix", help="Prefix of the files written (or checked).")
+    parser.add_argument("--layers", default="16,16,16",
+                        help="Activation sizes from the inputs to the outputs, e.g. 784,256,10 (default 16,16,16).")
+    parser.add_argument("--batch", type=int, default=16, help="Inputs to run (default 16).")
+    parser.add_argument("--acts", default=None,
+                        help="Activation of each layer (none, relu or sigmoid), the last repeated as needed (default: relu, none on the last layer).")
+    parser.add_argument("--sparsity", type=float, default=0., help="Fraction of the inputs that are zero.")
+    parser.add_argument("--weight-sparsity", type=float, default=0., help="Fraction of the weights that are zero.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument("--chunk", type=int, default=None, help="Inputs run at a time (default: as many as fit, up to 255).")
+    parser.add_argument("--config", action='append', metavar="NAME=VALUE", default=[],
+                        help="Override a hardware parameter from config.py, e.g. --config MATSIZE=8 (repeatable).")
+    parser.add_argument("--check", metavar="HOSTMEM",
+                        help="Instead of generating, compare the outputs in a final host memory (e.g. sim8.npy, or sim32.npy against the float reference) with PREFIX's reference.")
+    parser.add_argument("--atol", type=float, default=0., help="Absolute error allowed when checking float outputs.")
+    parser.add_argument("--ulps", type=int, default=0, help="ULP error allowed when checking float outputs (either tolerance passes).")
+    args = parser.parse_args()
+    overrides = {}
+    for setting in args.config:
+        name, _, value = setting.partition('=')
+        overrides[name] = int(value, 0)
+    args.cfg = Config(**overrides)
+
+
+if __name__ == '__main__':
+    parse_args()
+
+    if args.check:
+        import checker
+        with open(args.prefix + '.json') as f:
+            manifest = json.load(f)
+        hostmem = np.load(args.check, mmap_mode='r')
+        raw = np.issubdtype(hostmem.dtype, np.floating)
+        ref = np.load(args.prefix + ('_ref_float.npy' if raw else '_ref_int.npy'), mmap_mode='r')
+        result = checker.compare(ref, outputs(hostmem, manifest).astype(ref.dtype), atol=args.atol, ulps=args.ulps)
+        print('{} outputs: {}'.format('float' if raw else 'int', 'passed' if result else 'FAILED'))
+        if not result:
+            print(result.report())
+        sys.exit(0 if result else 1)
+
+    layers = [ int(n) for n in args.layers.split(',') ]
+    acts = args.acts.split(',') if args.acts else None
+    manifest = generate(args.prefix, args.cfg, layers, args.batch, acts, args.sparsity, args.weight_sparsity, args.seed, args.chunk)
+    print('{} inputs of {} through {} layers ({}), {} at a time'.format(args.batch, layers[0], len(layers) - 1, ', '.join(manifest['acts']), manifest['chunk']))
+    print('Wrote {0}.a, {0}.out, {0}_host[_raw].npy, {0}_weights[_raw].npy, {0}_ref_int.npy, {0}_ref_float.npy and {0}.json'.format(args.prefix))
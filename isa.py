@@ -14,13 +14,16 @@ for HLT, it is
 
 All numbers above are expressed in BYTES.
 The 'addr' field is used for host memory address (for RHM and WHM),
-weight DRAM address (for RW), and accumulator address (for MMC and ACT).
+weight DRAM address (for RW), accumulator address (for MMC and ACT),
+activation table row (for LUT) and bias shift (for BIAS).
 For the later two, the field is larger than necessary, and only the lower bits are used.
 'ub addr' is always a Unified Buffer address.
 'length' is the number of vectors to read/write/process.
 
-FLAG field is r|r|f|f|f|o|s|c, r stands for reserved bit, s for switch bit,
-c for convolve bit, f for function select bits, and o for override bit.
+FLAG field is r|r|b|f|f|o|s|c, r stands for reserved bit, s for switch bit,
+c for convolve bit, o for override bit, b for bias bit (ACT adds the bias
+registers) and f for function select bits (ACT: 0 for none, 1 for ReLU,
+2 for sigmoid, 3 for the lookup table).
 
 """
 
@@ -61,6 +64,8 @@ OPCODE2BIN = {
         'SYNC': (0x5, 0, 0, 0),
         'RHM':  (0x6, HOST_ADDR_SIZE, UB_ADDR_SIZE,   1),
         'HLT':  (0x7, 0, 0, 0),
+        'LUT':  (0x8, UB_ADDR_SIZE,   1,              1),
+        'BIAS': (0x9, UB_ADDR_SIZE,   1,              0),
         }
 
 BIN2OPCODE = {v[0]: k for k, v in OPCODE2BIN.items()}
@@ -68,13 +73,16 @@ BIN2OPCODE = {v[0]: k for k, v in OPCODE2BIN.items()}
 SWITCH_MASK =       0b00000001
 CONV_MASK =         0b00000010
 OVERWRITE_MASK =    0b00000100  # whether MMC should overwrite accumulator value or add to it
-ACT_FUNC_MASK =     0b00011000  # 0 for nothing; 1 for ReLU; 2 for sigmoid
+ACT_FUNC_MASK =     0b00011000  # 0 for nothing; 1 for ReLU; 2 for sigmoid; 3 for the lookup table
 FUNC_RELU_MASK =    0b00001000
 FUNC_SIGMOID_MASK = 0b00010000
+FUNC_LUT_MASK =     0b00011000
+BIAS_MASK =         0b00100000  # whether ACT adds the bias registers first
 
 SWITCH_BIT        = 0
 OVERWRITE_BIT     = 2
 ACT_FUNC_BITS     = slice(3,5)
 FUNC_RELU_BIT     = 3
 FUNC_SIGMOID_BIT  = 4
+BIAS_BIT          = 5
 
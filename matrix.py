@@ -3,18 +3,24 @@ from pyrtl import *
 from pyrtl import rtllib
 from pyrtl.rtllib import multipliers
 
+from tracing import module
+
 #set_debug_mode()
 globali = 0  # To give unique numbers to each MAC
-def MAC(data_width, matrix_size, data_in, acc_in, switchw, weight_in, weight_we, weight_tag):
+def MAC(data_width, matrix_size, data_in, acc_in, switchw, weight_in, weight_we, weight_tag, pipeline=0, zero_gating=False, acc_width=32):
     '''Multiply-Accumulate unit with programmable weight.
     Inputs
-    data_in: The 8-bit activation value to multiply by weight.
-    acc_in: 32-bit value to accumulate with product.
+    data_in: The data_width-bit activation value to multiply by weight.
+    acc_in: acc_width-bit value to accumulate with product.
     switchw: Control signal; when 1, switch to using the other weight buffer.
-    weight_in: 8-bit value to write to the secondary weight buffer.
+    weight_in: data_width-bit value to write to the secondary weight buffer.
     weight_we: When high, weights are being written; if tag matches, store weights.
                Otherwise, pass them through with incremented tag.
-    weight_tag: If equal to 255, weight is for this row; store it.
+    weight_tag: If equal to matrix_size-1, weight is for this row; store it.
+    pipeline: Extra register stages before the accumulate: 0 multiplies and adds in one cycle,
+              1 registers the product.
+    zero_gating: When either operand is zero, hold the multiplier inputs at their last values
+                 and pass acc_in through instead of adding, so the datapath does not toggle.
 
     Outputs
     out: Result of the multiply accumulate; moves one cell down to become acc_in.
@@ -26,10 +32,12 @@ def MAC(data_width, matrix_size, data_in, acc_in, switchw, weight_in, weight_we,
     '''
     global globali
     # Check lengths of inupts
-    if len(weight_in) != len(data_in) != data_width:
-        raise Exception("Expected 8-bit value in MAC.")
+    if len(weight_in) != data_width or len(data_in) != data_width:
+        raise Exception("Expected {}-bit values in MAC.".format(data_width))
     if len(switchw) != len(weight_we) != 1:
         raise Exception("Expected 1-bit control signal in MAC.")
+    if pipeline not in (0, 1):
+        raise Exception("MAC pipeline depth must be 0 or 1.")
 
     # Should never switch weight buffers while they're changing
     #rtl_assert(~(weight_we & switchw), Exception("Cannot switch weight values when they're being loaded!"))
@@ -56,10 +64,30 @@ def MAC(data_width, matrix_size, data_in, acc_in, switchw, weight_in, weight_we,
     weight = select(current_buffer, wbuf2, wbuf1)
     #probe(weight, "weight" + str(globali))
     globali += 1
+    data_reg = Register(len(data_in))  # pipeline register, holds data value for cell to the right
+    data_reg.next <<= data_in
+    weight_op, data_op = weight, data_in
+    if zero_gating:  # isolate the multiplier: keep its inputs from the last nonzero operand pair
+        zero = (weight_op == 0) | (data_op == 0)
+        held_weight, held_data = Register(len(weight_op)), Register(len(data_op))
+        with conditional_assignment:
+            with ~zero:
+                held_weight.next |= weight_op
+                held_data.next |= data_op
+        weight_op = select(zero, held_weight, weight_op)
+        data_op = select(zero, held_data, data_op)
     #inlen = max(len(weight), len(data_in))
     #product = weight.sign_extended(inlen*2) * data_in.sign_extended(inlen*2)
     #product = product[:inlen*2]
-    product = helperfuncs.mult_signed(weight, data_in)[:32]
+    product = helperfuncs.mult_signed(weight_op, data_op)[:acc_width]
+    if pipeline:  # split the multiply from the accumulate
+        product_reg = Register(len(product))
+        product_reg.next <<= product
+        product = product_reg
+        if zero_gating:
+            zero_reg = Register(1)
+            zero_reg.next <<= zero
+            zero = zero_reg
     #plen = len(weight) + len(data_in)
     #product = weight.sign_extended(plen) * data_in.sign_extended(plen)
     #product = product[:plen]
@@ -70,12 +98,12 @@ def MAC(data_width, matrix_size, data_in, acc_in, switchw, weight_in, weight_we,
     #l = max(len(product), len(acc_in))
     #out = product.sign_extended(l) + acc_in.sign_extended(l)
 
-    if len(out) > 32:
-        out = out[:32]
+    if len(out) > acc_width:
+        out = out[:acc_width]
+    if zero_gating:  # the product is zero; skip the add
+        out = select(zero, acc_in.sign_extended(len(out)), out)
                 
     # For values that need to be forward to the right/bottom, store in pipeline registers
-    data_reg = Register(len(data_in))  # pipeline register, holds data value for cell to the right
-    data_reg.next <<= data_in
     switch_reg = Register(1)  # pipeline register, holds switch control signal for cell to the right
     switch_reg.next <<= switchw
     acc_reg = Register(len(out))  # output value for MAC below
@@ -90,30 +118,38 @@ def MAC(data_width, matrix_size, data_in, acc_in, switchw, weight_in, weight_we,
     return acc_reg, data_reg, switch_reg, weight_reg, weight_we_reg, weight_tag_reg
 
     
-def MMArray(data_width, matrix_size, data_in, new_weights, weights_in, weights_we):
+def MMArray(data_width, matrix_size, data_in, new_weights, weights_in, weights_we, pipeline=0, matrix_cols=None, zero_gating=False, acc_width=32):
     '''
-    data_in: 256-array of 8-bit activation values from systolic_setup buffer
+    matrix_size: number of rows (inputs); matrix_cols: number of columns (outputs), default matrix_size
+    data_in: 256-array of data_width-bit activation values from systolic_setup buffer
     new_weights: 256-array of 1-bit control values indicating that new weight should be used
-    weights_in: output of weight FIFO (8 x matsize x matsize bit wire)
+    weights_in: output of weight FIFO (data_width x rows x cols bit wire)
     weights_we: 1-bit signal to begin writing new weights into the matrix
+    pipeline: extra register stages in each MAC (see MAC); every partial sum is delayed the
+              same, so the skew between rows is unchanged and results come out pipeline cycles later
+    zero_gating: skip the multiply and add in MACs with a zero operand (see MAC)
+    acc_width: width of the partial sums and of the results
     '''
 
+    cols = matrix_size if matrix_cols is None else matrix_cols
+
     # For signals going to the right, store in a var; for signals going down, keep a list
     # For signals going down, keep a copy of inputs to top row to connect to later
-    weights_in_top = [ WireVector(data_width) for i in range(matrix_size) ]  # input weights to top row
+    weights_in_top = [ WireVector(data_width) for i in range(cols) ]  # input weights to top row
     weights_in_last = [x for x in weights_in_top]
-    weights_enable_top = [ WireVector(1) for i in range(matrix_size) ]  # weight we to top row
+    weights_enable_top = [ WireVector(1) for i in range(cols) ]  # weight we to top row
     weights_enable = [x for x in weights_enable_top]
-    weights_tag_top = [ WireVector(data_width) for i in range(matrix_size) ]  # weight row tag to top row
+    size = max(1, (matrix_size - 1).bit_length())  # bits to count the rows
+    weights_tag_top = [ WireVector(size) for i in range(cols) ]  # weight row tag to top row
     weights_tag = [x for x in weights_tag_top]
-    data_out = [Const(0) for i in range(matrix_size)]  # will hold output from final row
+    data_out = [Const(0) for i in range(cols)]  # will hold output from final row
     # Build array of MACs
     for i in range(matrix_size):  # for each row
         din = data_in[i]
         switchin = new_weights[i]
         #probe(switchin, "switch" + str(i))
-        for j in range(matrix_size):  # for each column
-            acc_out, din, switchin, newweight, newwe, newtag  = MAC(data_width, matrix_size, din, data_out[j], switchin, weights_in_last[j], weights_enable[j], weights_tag[j])
+        for j in range(cols):  # for each column
+            acc_out, din, switchin, newweight, newwe, newtag  = MAC(data_width, matrix_size, din, data_out[j], switchin, weights_in_last[j], weights_enable[j], weights_tag[j], pipeline, zero_gating, acc_width)
             #probe(data_out[j], "MACacc{}_{}".format(i, j))
             #probe(acc_out, "MACout{}_{}".format(i, j))
             #probe(din, "MACdata{}_{}".format(i, j))
@@ -124,9 +160,6 @@ def MMArray(data_width, matrix_size, data_in, new_weights, weights_in, weights_w
     
     # Handle weight reprogramming
     programming = Register(1)  # when 1, we're in the process of loading new weights
-    size = 1
-    while pow(2, size) < matrix_size:
-        size = size + 1
     progstep = Register(size)  # 256 steps to program new weights (also serves as tag input)
     with conditional_assignment:
         with weights_we & (~programming):
@@ -140,13 +173,13 @@ def MMArray(data_width, matrix_size, data_in, new_weights, weights_in, weights_w
         with otherwise:
             progstep.next |= Const(0)
 
-    # Divide FIFO output into rows (each row datawidth x matrixsize bits)
-    rowsize = data_width * matrix_size
+    # Divide FIFO output into rows (each row datawidth x cols bits)
+    rowsize = data_width * cols
     weight_arr = [ weights_in[i*rowsize : i*rowsize + rowsize] for i in range(matrix_size) ]
     # Mux the wire for this row
     current_weights_wire = mux(progstep, *weight_arr)
-    # Split the wire into an array of 8-bit values
-    current_weights = [ current_weights_wire[i*data_width:i*data_width+data_width] for i in reversed(range(matrix_size)) ]
+    # Split the wire into an array of data_width-bit values
+    current_weights = [ current_weights_wire[i*data_width:i*data_width+data_width] for i in reversed(range(cols)) ]
 
     # Connect top row to input and control signals
     for i, win in enumerate(weights_in_top):
@@ -159,27 +192,37 @@ def MMArray(data_width, matrix_size, data_in, new_weights, weights_in, weights_w
         # Tag is same for whole row; use state index (runs from 0 to 255)
         wt <<= progstep
 
-    return [ x.sign_extended(32) for x in data_out ]
+    return [ x.sign_extended(acc_width) for x in data_out ]
 
 
-def accum(size, data_in, waddr, wen, wclear, raddr, lastvec):
-    '''A single 32-bit accumulator with 2^size 32-bit buffers.
+def accum(size, data_in, waddr, wen, wclear, raddr, lastvec, waddr_next=None):
+    '''A single accumulator with 2^size buffers as wide as data_in.
     On wen, writes data_in to the specified address (waddr) if wclear is high;
     otherwise, it performs an accumulate at the specified address (buffer[waddr] += data_in).
     lastvec is a control signal indicating that the operation being stored now is the
     last vector of a matrix multiply instruction (at the final accumulator, this becomes
     a "done" signal).
+    waddr_next, if given, is the address that will be written next cycle; the accumulate
+    then reads it a cycle early into a register, so the memory read and the add are in
+    different cycles.
     '''
 
-    mem = MemBlock(bitwidth=32, addrwidth=size)
-    
+    mem = MemBlock(bitwidth=len(data_in), addrwidth=size)
+
+    if waddr_next is None:
+        current = mem[waddr]
+    else:
+        current = Register(mem.bitwidth)
+    total = select(wclear, data_in, (data_in + current)[:mem.bitwidth])
+
     # Writes
     with conditional_assignment:
         with wen:
-            with wclear:
-                mem[waddr] |= data_in
-            with otherwise:
-                mem[waddr] |= (data_in + mem[waddr])[:mem.bitwidth]
+            mem[waddr] |= total
+
+    if waddr_next is not None:
+        # Forward this cycle's write if the next accumulate is to the same address
+        current.next <<= select(wen & (waddr_next == waddr), total, mem[waddr_next])
 
     # Read
     data_out = mem[raddr]
@@ -196,9 +239,10 @@ def accum(size, data_in, waddr, wen, wclear, raddr, lastvec):
 
     return data_out, waddrsave, wensave, wclearsave, lastsave
 
-def accumulators(accsize, datas_in, waddr, we, wclear, raddr, lastvec):
+def accumulators(accsize, datas_in, waddr, we, wclear, raddr, lastvec, waddr_next=None):
     '''
     Produces array of accumulators of same dimension as datas_in.
+    waddr_next: waddr one cycle early; if given, every accumulator prefetches its operand (see accum).
     '''
 
     #probe(we, "accum_wen")
@@ -214,46 +258,54 @@ def accumulators(accsize, datas_in, waddr, we, wclear, raddr, lastvec):
         #probe(x, "acc_{}_in".format(i))
         #probe(wein, "acc_{}_we".format(i))
         #probe(waddrin, "acc_{}_waddr".format(i))
-        dout, waddrin, wein, wclearin, lastvecin = accum(accsize, x, waddrin, wein, wclearin, raddr, lastvecin)
+        # Each accumulator sees the control signals of the one before it a cycle later
+        waddrcur = waddrin
+        dout, waddrin, wein, wclearin, lastvecin = accum(accsize, x, waddrin, wein, wclearin, raddr, lastvecin, waddr_next)
+        if waddr_next is not None:
+            waddr_next = waddrcur
         accout[i] = dout
         done = lastvecin
 
     return accout, done
 
 
-def FIFO(matsize, mem_data, mem_valid, advance_fifo):
+def FIFO(matsize, mem_data, mem_valid, advance_fifo, depth=4, cols=None, data_width=8):
     '''
-    matsize is the length of one row of the Matrix.
-    mem_data is the connection from the DRAM controller, which is assumed to be 64 bytes wide.
+    matsize is the number of rows of the Matrix, and cols the length of one row (default matsize).
+    mem_data is the connection from the DRAM controller; its width (typically 64 bytes) sets the size of one transfer.
     mem_valid is a one bit control signal from the controller indicating that the read completed and the current value is valid.
     advance_fifo signals to drop the tile at the end of the FIFO and advance everything forward.
+    depth is the number of tile buffers (at least 2): the top buffer filled from DRAM, and depth-1 behind it.
+    data_width is the width of one weight.
 
     Output
-    tile, ready, full
-    tile: entire tile at the front of the queue (8 x matsize x matsize bits)
+    tile, ready, full, occupancy
+    tile: entire tile at the front of the queue (data_width x matsize x cols bits)
     ready: the tile output is valid
     full: there is no room in the FIFO
+    occupancy: number of the FIFO slots holding a tile (0-depth)
     '''
 
+    if depth < 2:
+        raise ValueError('The weight FIFO needs at least two tile buffers (got {})'.format(depth))
+
     #probe(mem_data, "fifo_dram_in")
     #probe(mem_valid, "fifo_dram_valid")
     #probe(advance_fifo, "weights_advance_fifo")
     
     # Make some size parameters, declare state register
-    totalsize = matsize * matsize  # total size of a tile in bytes
-    tilesize = totalsize * 8  # total size of a tile in bits
+    tilesize = matsize * (matsize if cols is None else cols) * data_width  # total size of a tile in bits
     ddrwidth = int(len(mem_data)/8)  # width from DDR in bytes (typically 64)
-    size = 1
-    while pow(2, size) < (totalsize/ddrwidth):  # compute log of number of transfers required
-        size = size + 1
-    state = Register(size)  # Number of reads to receive (each read is ddrwidth bytes)
+    nchunks = max(1, -(-tilesize // len(mem_data)))  # number of transfers required
+    size = max(1, (nchunks - 1).bit_length())
+    state = Register(size, 'fifo_state')  # Number of reads to receive (each read is ddrwidth bytes)
     startup = Register(1)
     startup.next <<= 1
 
     #probe(state, "fifo_state")
     
     # Declare top row of buffer: need to write to it in ddrwidth-byte chunks
-    topbuf = [ Register(ddrwidth*8) for i in range(max(1, int(totalsize/ddrwidth))) ]
+    topbuf = [ Register(ddrwidth*8) for i in range(nchunks) ]
 
     # Latch command to advance FIFO, since it may not complete immediately
     droptile = Register(1)
@@ -268,78 +320,76 @@ def FIFO(matsize, mem_data, mem_valid, advance_fifo):
     #probe(clear_droptile, "fifo_clear_droptile")
     
     # When we get data from DRAM controller, write to next buffer space
+    lastchunk = state == Const(nchunks-1, bitwidth=size)
     with conditional_assignment:
         with mem_valid:
-            state.next |= state + 1  # state tracks which ddrwidth-byte chunk we're writing to
+            state.next |= select(lastchunk, Const(0, bitwidth=size), state + 1)  # state tracks which ddrwidth-byte chunk we're writing to
             for i, reg in enumerate(reversed(topbuf)):  # enumerate a decoder for write-enable signals
                 #probe(reg, "fifo_reg{}".format(i))
                 with state == Const(i, bitwidth=size):
                     reg.next |= mem_data
 
     # Track when first buffer is filled and when data moves out of it
-    full = Register(1)  # goes high when last chunk of top buffer is filled
+    full = Register(1, 'fifo_top_full')  # goes high when last chunk of top buffer is filled
     cleartop = WireVector(1)
     with conditional_assignment:
-        with mem_valid & (state == Const(len(topbuf)-1)):  # writing the last buffer spot now
+        with mem_valid & lastchunk:  # writing the last buffer spot now
             full.next |= 1
         with cleartop:  # advancing FIFO, so buffer becomes empty
             full.next |= 0
 
-    # Build buffers for remainder of FIFO
-    buf2, buf3, buf4 = Register(tilesize), Register(tilesize), Register(tilesize)
+    # Build buffers for remainder of FIFO; the last one is the front of the queue
+    bufs = [ Register(tilesize) for i in range(depth-1) ]
     #probe(concat_list(topbuf), "buf1")
-    #probe(buf2, "buf2")
-    #probe(buf3, "buf3")
-    #probe(buf4, "buf4")
     #probe(full, "buf1_full")
     # If a given row is empty, track that so we can fill immediately
-    empty2, empty3, empty4 = Register(1), Register(1), Register(1)
-    #probe(empty2, "buf2_empty")
-    #probe(empty3, "buf3_empty")
-    #probe(empty4, "buf4_empty")
+    empty = [ Register(1) for i in range(depth-1) ]
 
-    # Handle moving data between the buffers
+    # Handle moving data between the buffers, at most one move per cycle
     with conditional_assignment:
         with ~startup:
-            empty2.next |= 1
-            empty3.next |= 1
-            empty4.next |= 1
-        with full & empty2:  # First buffer is full, second is empty
-            buf2.next |= concat_list(topbuf)  # move data to second buffer
+            for e in empty:
+                e.next |= 1
+        with full & empty[0]:  # First buffer is full, second is empty
+            bufs[0].next |= concat_list(topbuf)[:tilesize]  # move data to second buffer
             cleartop |= 1  # empty the first buffer
-            empty2.next |= 0  # mark the second buffer as non-empty
-        with empty3 & ~empty2:  # Third buffer is empty and second is full
-            buf3.next |= buf2
-            empty3.next |= 0
-            empty2.next |= 1
-        with empty4 & ~empty3:  # Fourth buffer is empty and third is full
-            buf4.next |= buf3
-            empty4.next |= 0
-            empty3.next |= 1
+            empty[0].next |= 0  # mark the second buffer as non-empty
+        for i in range(1, depth-1):
+            with empty[i] & ~empty[i-1]:  # This buffer is empty and the one before it is full
+                bufs[i].next |= bufs[i-1]
+                empty[i].next |= 0
+                empty[i-1].next |= 1
         with droptile:
-            empty4.next |= 1  # mark fourth buffer as free; tiles will advance automatically
+            empty[-1].next |= 1  # mark last buffer as free; tiles will advance automatically
             clear_droptile |= 1
     
-    ready = startup & (~empty4) & (~droptile)  # there is data in final buffer and we're not about to change it
+    ready = startup & (~empty[-1]) & (~droptile)  # there is data in final buffer and we're not about to change it
 
-    return buf4, ready, full
+    # The empty flags are only initialized after the first cycle
+    width = depth.bit_length()
+    filled = [ full.zero_extended(width) ] + [ (~e).zero_extended(width) for e in empty ]
+    occupancy = select(startup, reduce(lambda x, y: (x + y)[:width], filled), Const(0, bitwidth=width))
 
-def systolic_setup(data_width, matsize, vec_in, waddr, valid, clearbit, lastvec, switch):
+    return bufs[-1], ready, full, occupancy
+
+def systolic_setup(data_width, matsize, vec_in, waddr, valid, clearbit, lastvec, switch, pipeline=0):
     '''Buffers vectors from the unified SRAM buffer so that they can be fed along diagonals to the
     Matrix Multiply array.
 
-    matsize: row size of Matrix
+    matsize: number of rows of the Matrix (elements of each vector it takes)
     vec_in: row read from unified buffer
     waddr: the accumulator address this vector is bound for
     valid: this is a valid vector; write it when done
     clearbit: if 1, store result (default accumulate)
     lastvec: this is the last vector of a matrix
     switch: use the next weights tile beginning with this vector
+    pipeline: extra register stages in each MAC; the control signals are delayed to match
 
     Output
     next_row: diagonal cross-cut of vectors to feed to MM array
     switchout: switch signals for MM array
     addrout: write address for first accumulator
+    addrnext: addrout one cycle early
     weout: write enable for first accumulator
     clearout: clear signal for first accumulator
     doneout: done signal for first accumulator
@@ -380,7 +430,8 @@ def systolic_setup(data_width, matsize, vec_in, waddr, valid, clearbit, lastvec,
     #probe(clearout, "sys_clear_in")
     # Need one extra cycle of delay for control signals before giving them to first accumulator
     # But we already did registers for first row, so cancels out
-    for i in range(0, matsize):
+    for i in range(0, matsize + pipeline):
+        addrnext = addrout
         a = Register(len(addrout))
         a.next <<= addrout
         addrout = a
@@ -411,19 +462,21 @@ def systolic_setup(data_width, matsize, vec_in, waddr, valid, clearbit, lastvec,
         reg.next <<= din
     
         
-    return lastcolumn, switchout, addrout, weout, clearout, doneout
+    return lastcolumn, switchout, addrout, addrnext, weout, clearout, doneout
 
 
-def MMU(data_width, matrix_size, accum_size, vector_in, accum_raddr, accum_waddr, vec_valid, accum_overwrite, lastvec, switch_weights, ddr_data, ddr_valid):  #, weights_in, weights_we):
-    
+def MMU(data_width, matrix_size, accum_size, vector_in, accum_raddr, accum_waddr, vec_valid, accum_overwrite, lastvec, switch_weights, ddr_data, ddr_valid, fifo_depth=4, mac_pipeline=0, matrix_cols=None, zero_gating=False, acc_width=32):  #, weights_in, weights_we):
+
+    # The wait after a switch covers the time it takes to cross a row of matrix_cols MACs
+    cols = matrix_size if matrix_cols is None else matrix_cols
     logn1 = 1
-    while pow(2, logn1) < (matrix_size + 1):
+    while pow(2, logn1) < (cols + 1):
         logn1 = logn1 + 1
     logn = 1
     while pow(2, logn) < (matrix_size):
         logn = logn + 1
 
-    programming = Register(1)  # if high, we're programming new weights now
+    programming = Register(1, 'weights_programming')  # if high, we're programming new weights now
     waiting = WireVector(1)  # if high, a switch is underway and we're waiting
         
     weights_wait = Register(logn1, "weights_wait")  # counts cycles since last weight push
@@ -433,22 +486,29 @@ def MMU(data_width, matrix_size, accum_size, vector_in, accum_raddr, accum_waddr
     weights_we = WireVector(1)
     done_programming = WireVector(1)
     first_tile = Register(1)  # Tracks if we've programmed the first tile yet
+    next_tile = Register(1)  # A switch happened; program the next tile once it is in the FIFO
 
     #rtl_assert(~(switch_weights & (weights_wait != 0)), Exception("Weights are not ready to switch. Need a minimum of {} + 1 cycles since last switch.".format(matrix_size)))
 
     # FIFO
-    weights_tile, tile_ready, full = FIFO(matsize=matrix_size, mem_data=ddr_data, mem_valid=ddr_valid, advance_fifo=done_programming)
+    with module('fifo'):
+        weights_tile, tile_ready, full, fifo_occupancy = FIFO(matsize=matrix_size, mem_data=ddr_data, mem_valid=ddr_valid, advance_fifo=done_programming, depth=fifo_depth, cols=cols, data_width=data_width)
+    tile_ready.name = 'weights_tile_ready'
     #probe(tile_ready, "tile_ready")
     #probe(weights_tile, "FIFO_weights_out")
     
-    matin, switchout, addrout, weout, clearout, doneout = systolic_setup(data_width=data_width, matsize=matrix_size, vec_in=vector_in, waddr=accum_waddr, valid=vec_valid, clearbit=accum_overwrite, lastvec=lastvec, switch=switch_weights)
+    with module('systolic_setup'):
+        matin, switchout, addrout, addrnext, weout, clearout, doneout = systolic_setup(data_width=data_width, matsize=matrix_size, vec_in=vector_in, waddr=accum_waddr, valid=vec_valid, clearbit=accum_overwrite, lastvec=lastvec, switch=switch_weights, pipeline=mac_pipeline)
 
-    mouts = MMArray(data_width=data_width, matrix_size=matrix_size, data_in=matin, new_weights=switchout, weights_in=weights_tile, weights_we=weights_we)
+    with module('mac_array'):
+        mouts = MMArray(data_width=data_width, matrix_size=matrix_size, data_in=matin, new_weights=switchout, weights_in=weights_tile, weights_we=weights_we, pipeline=mac_pipeline, matrix_cols=cols, zero_gating=zero_gating, acc_width=acc_width)
 
-    accout, done = accumulators(accsize=accum_size, datas_in=mouts, waddr=addrout, we=weout, wclear=clearout, raddr=accum_raddr, lastvec=doneout)
+    # With a pipelined MAC the accumulators prefetch their operand too, so neither bounds the clock
+    with module('accumulators'):
+        accout, done = accumulators(accsize=accum_size, datas_in=mouts, waddr=addrout, we=weout, wclear=clearout, raddr=accum_raddr, lastvec=doneout, waddr_next=addrnext if mac_pipeline else None)
 
     switchstart = switchout[0]
-    totalwait = Const(matrix_size + 1)
+    totalwait = Const(cols + 1)
     waiting <<= weights_wait != totalwait  # if high, we have to wait 
 
     #probe(waiting, "waiting")
@@ -465,8 +525,11 @@ def MMU(data_width, matrix_size, accum_size, vector_in, accum_raddr, accum_waddr
             first_tile.next |= 1
         with switchstart:  # Weight switch initiated; begin waiting
             weights_wait.next |= 0
+            next_tile.next |= 1
+        with next_tile & tile_ready:  # switch has cleared and the next tile is in the FIFO
             programming.next |= 1
             weights_count.next |= 0
+            next_tile.next |= 0
         with programming:  # We're pushing new weights now
             with weights_count == Const(matrix_size-1):  # We've reached the end
                 programming.next |= 0
@@ -500,13 +563,28 @@ def MMU(data_width, matrix_size, accum_size, vector_in, accum_raddr, accum_waddr
             weights_we |= 1
     '''
 
-    return accout, done
+    # A programmed tile is waiting in the array to be switched in
+    weights_loaded = Register(1, 'weights_loaded')
+    with conditional_assignment:
+        with switch_weights:
+            weights_loaded.next |= 0
+        with done_programming:
+            weights_loaded.next |= 1
+
+    return accout, done, programming, fifo_occupancy, full, weights_loaded
 
-def MMU_top(data_width, matrix_size, accum_size, ub_size, start, start_addr, nvecs, dest_acc_addr, overwrite, swap_weights, ub_rdata, accum_raddr, weights_dram_in, weights_dram_valid):
+def MMU_top(data_width, matrix_size, accum_size, ub_size, start, start_addr, nvecs, dest_acc_addr, overwrite, swap_weights, ub_rdata, accum_raddr, weights_dram_in, weights_dram_valid, fifo_depth=4, mac_pipeline=0, matrix_cols=None, zero_gating=False, acc_width=32):
     '''
+    The array is matrix_size rows (elements of each UB vector multiplied) by matrix_cols
+    columns (accumulators, one per output element); matrix_cols defaults to matrix_size.
+    Activations and weights are data_width bits; the accumulators are acc_width bits.
 
     Outputs
     ub_raddr: read address for unified buffer
+    acc_out, busy, done: accumulator read data, vector issue in progress, last vector accumulated
+    programming, fifo_occupancy: weights are being loaded into the array, tiles held in the weight FIFO
+    fifo_full: the top of the weight FIFO is full (a new tile transfer would overwrite it)
+    weights_loaded: the next weight tile is programmed and can be switched in
     '''
 
     #probe(ub_rdata, "ub_mm_rdata")
@@ -548,11 +626,11 @@ def MMU_top(data_width, matrix_size, accum_size, ub_size, start, start_addr, nve
                 accum_waddr.next |= accum_waddr + 1
                 last |= 0
         
-    acc_out, done = MMU(data_width=data_width, matrix_size=matrix_size, accum_size=accum_size, vector_in=ub_rdata, accum_raddr=accum_raddr, accum_waddr=accum_waddr, vec_valid=vec_valid, accum_overwrite=overwrite_reg, lastvec=last, switch_weights=swap_reg, ddr_data=weights_dram_in, ddr_valid=weights_dram_valid)
+    acc_out, done, programming, fifo_occupancy, fifo_full, weights_loaded = MMU(data_width=data_width, matrix_size=matrix_size, accum_size=accum_size, vector_in=ub_rdata, accum_raddr=accum_raddr, accum_waddr=accum_waddr, vec_valid=vec_valid, accum_overwrite=overwrite_reg, lastvec=last, switch_weights=swap_reg, ddr_data=weights_dram_in, ddr_valid=weights_dram_valid, fifo_depth=fifo_depth, mac_pipeline=mac_pipeline, matrix_cols=matrix_cols, zero_gating=zero_gating, acc_width=acc_width)
 
     #probe(ub_raddr, "ub_mm_raddr")
 
-    return ub_raddr, acc_out, busy, done
+    return ub_raddr, acc_out, busy, done, programming, fifo_occupancy, fifo_full, weights_loaded
 
     
 
@@ -597,7 +675,7 @@ def testall(input_vectors, weights_vectors):
     weightsdata = Input(64*8)
     weightsvalid = Input(1)
     
-    accout, done = MMU(data_width=DATWIDTH, matrix_size=MATSIZE, accum_size=ACCSIZE, vector_in=invec, accum_raddr=raddr, accum_waddr=waddr, vec_valid=valid, accum_overwrite=Const(0), lastvec=lastvec, switch_weights=swap, ddr_data=weightsdata, ddr_valid=weightsvalid)
+    accout, done, _, _, _, _ = MMU(data_width=DATWIDTH, matrix_size=MATSIZE, accum_size=ACCSIZE, vector_in=invec, accum_raddr=raddr, accum_waddr=waddr, vec_valid=valid, accum_overwrite=Const(0), lastvec=lastvec, switch_weights=swap, ddr_data=weightsdata, ddr_valid=weightsvalid)
 
     donesig <<= done
     for out, accout in zip(outs, accout):
@@ -0,0 +1,73 @@
+'''
+Timing model for the off-chip memories (weight DRAM and host memory).
+
+The hardware only sees a request go out and data beats come back (or, for writes,
+beats get accepted) some cycles later. MemoryModel decides when: each channel has a
+latency, a bandwidth, a burst size and optional random jitter. The same model drives
+the runtpu.py harness and the timing model in sim.py.
+'''
+
+import math
+import random
+
+
+class MemoryModel(object):
+    '''One memory channel. Transfers are served in order, one beat at a time.
+
+    latency: cycles from a request to the first beat of each burst (1: the cycle after the request)
+    bandwidth: bytes per cycle the channel sustains (None: one beat per cycle)
+    burst: beats per burst; each burst pays the latency again (0: a whole transfer is one burst)
+    jitter: up to this many extra cycles of latency per burst, uniformly random
+    beat_bytes: size of one beat (the width of the data port)
+    '''
+
+    PARAMS = ['latency', 'bandwidth', 'burst', 'jitter']
+
+    def __init__(self, beat_bytes, latency=1, bandwidth=None, burst=0, jitter=0, seed=0):
+        if latency < 1:
+            raise ValueError('Memory latency must be at least one cycle')
+        self.beat_bytes = beat_bytes
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.burst = burst
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.free = 0  # requests wait until the channel is done with this cycle
+
+    @classmethod
+    def from_spec(cls, spec, beat_bytes, seed=0):
+        '''Build a model from a string like "latency=40,bandwidth=32,burst=4,jitter=8".'''
+        kwargs = {}
+        for item in spec.split(',') if spec else []:
+            name, _, value = item.partition('=')
+            name = name.strip()
+            if name not in cls.PARAMS:
+                raise ValueError('Unknown memory parameter "{}" (expected one of {})'.format(name, ', '.join(cls.PARAMS)))
+            kwargs[name] = float(value) if name == 'bandwidth' else int(value)
+        return cls(beat_bytes, seed=seed, **kwargs)
+
+    def interval(self):
+        '''Cycles between beats within a burst.'''
+        if not self.bandwidth:
+            return 1
+        return max(1, int(math.ceil(self.beat_bytes / float(self.bandwidth))))
+
+    def schedule(self, now, nbeats):
+        '''Cycles at which the beats of a transfer requested in cycle now arrive (or are accepted).'''
+        times = []
+        burst = self.burst or nbeats
+        t = max(now, self.free)
+        for i in range(nbeats):
+            if i % burst == 0:  # a new burst pays the latency (after the previous beat's slot)
+                t += self.latency + (self.interval() - 1 if i else 0)
+                if self.jitter:
+                    t += self.rng.randint(0, self.jitter)
+            else:
+                t += self.interval()
+            times.append(t)
+        if times:
+            self.free = times[-1] + self.interval() - 1
+        return times
+
+    def __repr__(self):
+        return 'MemoryModel(beat_bytes={}, {})'.format(self.beat_bytes, ', '.join('{}={!r}'.format(p, getattr(self, p)) for p in self.PARAMS))
@@ -0,0 +1,134 @@
+'''
+A registry of models for hosts that switch between many: decoded programs and weight
+images stay in memory, keyed by a hash of their contents, and are evicted least recently
+used first once they outgrow a memory budget.
+
+    models = Registry(budget=512 << 20)
+    program = models.program('boston.out')  # sim.load_program's decoded instructions
+    tiles = models.tiles('boston_weights.npy')  # the weight DRAM array TPUSim takes
+    instrs = models.instructions('boston.out', cfg)  # runtpu.load_program's instruction words
+    weightsmem = models.packed_weights('boston_weights.npy', cfg)  # runtpu.py's tile images
+    print(models.stats())
+
+A file is hashed again only when its size or modification time changes, so a hit costs a
+stat(). An .npy file is hashed as the array it holds, so the same contents under another
+name, or as an array, share one entry. Entries are
+shared between callers and must not be modified: arrays are returned read-only.
+'''
+
+from collections import OrderedDict
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+
+def _sizeof(value):
+    '''Rough bytes held by a cached value.'''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+
+
+def _array_digest(array):
+    '''Hash of an array's dtype, shape and elements, however it is laid out in memory.'''
+    h = hashlib.sha256('{} {}'.format(array.dtype.str, array.shape).encode())
+    h.update(np.ascontiguousarray(array).data)
+    return h.hexdigest()
+
+
+class Registry(object):
+    '''LRU cache of decoded programs and weight images under a budget in bytes.
+
+    Sources are paths, or arrays for the weight images. An entry bigger than the whole
+    budget is built and returned but not kept.
+    '''
+
+    def __init__(self, budget=256 << 20):
+        self.budget = budget
+        self.entries = OrderedDict()  # (content hash, kind, params) -> (value, bytes), least recent first
+        self.used = 0
+        self.hashes = {}  # path -> ((size, mtime), content hash)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def digest(self, source):
+        '''Content hash of a file, or of an array (or the array in an .npy file) with its dtype and shape.'''
+        if isinstance(source, np.ndarray):
+            return _array_digest(source)
+        st = os.stat(source)
+        stamp = (st.st_size, st.st_mtime_ns)
+        cached = self.hashes.get(source)
+        if cached is None or cached[0] != stamp:
+            if source.endswith('.npy'):
+                digest = _array_digest(np.load(source, mmap_mode='r'))
+            else:
+                h = hashlib.sha256()
+                with open(source, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        h.update(block)
+                digest = h.hexdigest()
+            cached = self.hashes[source] = (stamp, digest)
+        return cached[1]
+
+    def get(self, key, build):
+        '''The entry under key, made with build() on a miss.'''
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+        self.misses += 1
+        value = build()
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+        size = _sizeof(value)
+        if size <= self.budget:
+            self.entries[key] = (value, size)
+            self.used += size
+            while self.used > self.budget:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.used -= evicted
+                self.evictions += 1
+        return value
+
+    def program(self, path):
+        '''Decoded instructions of a binary program, as sim.load_program returns them.'''
+        import sim
+        return self.get((self.digest(path), 'program'), lambda: sim.load_program(path))
+
+    def instructions(self, path, cfg):
+        '''Instruction words of a binary program, as runtpu.load_program returns them.'''
+        import runtpu
+        return self.get((self.digest(path), 'instructions', cfg.INSTRUCTION_WIDTH), lambda: runtpu.load_program(path, cfg))
+
+    def tiles(self, source):
+        '''Weight DRAM as the array of tiles TPUSim takes, from an .npy file or an array.'''
+        load = (lambda: np.load(source)) if isinstance(source, str) else (lambda: np.array(source))
+        return self.get((self.digest(source), 'tiles'), load)
+
+    def packed_weights(self, source, cfg):
+        '''Weight DRAM as runtpu.py's memory image: address -> the tile packed into one integer.'''
+        import runtpu
+        build = lambda: { a : runtpu.concat_tile(tile, cfg.DWIDTH) for a, tile in enumerate(self.tiles(source)) }
+        return self.get((self.digest(source), 'packed_weights', cfg.DWIDTH), build)
+
+    def clear(self):
+        self.entries.clear()
+        self.hashes.clear()
+        self.used = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries' : len(self.entries),
+            'bytes' : self.used,
+            'budget' : self.budget,
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'evictions' : self.evictions,
+            'hit_rate' : self.hits / float(lookups) if lookups else 0.,
+        }
@@ -1,37 +1,40 @@
 from pyrtl import *
 import argparse
+from collections import deque
 import numpy as np
+import pickle
 
 #set_debug_mode()
 
-from tpu import *
-import config
+import tpu
+from tpu import load_tpu
+from config import Config
+from memory import MemoryModel
+import tracing
+import sim as funcsim
 
 import sys
 
-parser = argparse.ArgumentParser(description="Run the PyRTL spec for the TPU on the indicated program.")
-parser.add_argument("prog", metavar="program.bin", help="A valid binary program for OpenTPU.")
-parser.add_argument("hostmem", metavar="HostMemoryArray", help="A file containing a numpy array containing the initial contents of host memory. Each row represents one vector.")
-parser.add_argument("weightsmem", metavar="WeightsMemoryArray", help="A file containing a numpy array containing the contents of the weights memroy. Each row represents one tile (the first row corresponds to the top row of the weights matrix).")
+args = None
 
-args = parser.parse_args()
-    
 
-# Read the program and build an instruction list
-with open(args.prog, 'rb') as f:
-    ins = [x for x in f.read()]  # create byte list from input
+def load_program(path, cfg):
+    # Read the program and build an instruction list
+    with open(path, 'rb') as f:
+        ins = [x for x in f.read()]  # create byte list from input
 
-instrs = []
-width = config.INSTRUCTION_WIDTH / 8
-# This assumes instructions are strictly byte-aligned
+    instrs = []
+    width = cfg.INSTRUCTION_WIDTH / 8
+    # This assumes instructions are strictly byte-aligned
 
-for i in range(int(len(ins)/width)):  # once per instruction
-    val = 0
-    for j in range(int(width)):  # for each byte
-        val = (val << 8) | ins.pop(0)
-    instrs.append(val)
+    for i in range(int(len(ins)/width)):  # once per instruction
+        val = 0
+        for j in range(int(width)):  # for each byte
+            val = (val << 8) | ins.pop(0)
+        instrs.append(val)
 
-#print(list(map(hex, instrs)))
+    #print(list(map(hex, instrs)))
+    return instrs
 
 def concat_vec(vec, bits=8):
     t = 0
@@ -56,13 +59,13 @@ def make_vec(value, bits=8):
     mask = int('1'*bits, 2)
     while value > 0:
         vec.append(value & mask)
-        value = value >> 8
+        value = value >> bits
     return list(reversed(vec))
 
-def print_mem(mem):
+def print_mem(mem, bits=8):
     ks = sorted(mem.keys())
     for a in ks:
-        print(a, make_vec(mem[a]))
+        print(a, make_vec(mem[a], bits))
 
 def print_weight_mem(mem, bits=8, size=8):
     ks = sorted(mem.keys())
@@ -72,31 +75,12 @@ def print_weight_mem(mem, bits=8, size=8):
         vec = []
         tile = mem[a]
         while tile > 0:
-            vec.append(make_vec(tile & mask))
-            tile = tile >> (8*8)
+            vec.append(make_vec(tile & mask, bits))
+            tile = tile >> (size*bits)
         if vec != []:
             vecs.append(vec)
     for a, vec in enumerate(vecs):
         print(a, list(reversed(vec)))
-        
-# Read the dram files and build memory images
-hostarray = np.load(args.hostmem)
-#print(hostarray)
-#print(hostarray.shape)
-hostmem = { a : concat_vec(vec) for a,vec in enumerate(hostarray) }
-print("Host memory:")
-print_mem(hostmem)
-    
-
-weightsarray = np.load(args.weightsmem)
-size = weightsarray.shape[-1]
-#print(weightsarray)
-#print(weightsarray.shape)
-weightsmem = { a : concat_tile(tile) for a,tile in enumerate(weightsarray) }
-#weightsmem = { a : concat_vec(vec) for a,vec in enumerate(weightsarray) }
-print("Weight memory:")
-print_weight_mem(weightsmem, size=size)
-#print(weightsmem)
 
 '''
 Left-most element of each vector should be left-most in memory: use concat_list for each vector
@@ -107,75 +91,399 @@ The first vector should be at the "front" of the tile.
 For host mem, each vector goes at one address. First vector at address 0.
 '''
 
-tilesize = config.MATSIZE * config.MATSIZE  # number of weights in a tile
-nchunks = max(tilesize / 64, 1)  # Number of DRAM transfers needed from Weight DRAM for one tile
-chunkmask = pow(2,64*8)-1
-def getchunkfromtile(tile, chunkn):
+def tile_chunks(cfg):
+    return cfg.TILE_BEATS  # Number of DRAM transfers needed from Weight DRAM for one tile
+
+def getchunkfromtile(tile, chunkn, nchunks, beat_bytes=64):
+    chunkbits = beat_bytes*8
+    chunkmask = pow(2,chunkbits)-1
     #print("Get chunk: ", chunkn, nchunks, chunkmask, tile)
-    #print((tile >> ((nchunks - chunkn - 1)*64*8)) & chunkmask)
+    #print((tile >> ((nchunks - chunkn - 1)*chunkbits)) & chunkmask)
     if chunkn >= nchunks:
         raise Exception("Reading more weights than are present in one tile?")
-    return (tile >> int(((nchunks - chunkn - 1))*64*8)) & chunkmask
-
-# Run Simulation
-sim_trace = SimulationTrace()
-sim = FastSimulation(tracer=sim_trace, memory_value_map={ IMem : { a : v for a,v in enumerate(instrs)} })
-
-din = {
-    weights_dram_in : 0,
-    weights_dram_valid : 0,
-    hostmem_rdata : 0,
-}
-
-cycle = 0
-chunkaddr = nchunks
-sim.step(din)
-i = 0
-while True:
-    i += 1
-    # Halt signal
-    if sim.inspect(halt):
-        break
-
-    d = din.copy()
-
-    # Check if we're doing a Read Weights
-    if chunkaddr < nchunks:
-        #print("Sending weights from chunk {}: {}".format(chunkaddr, getchunkfromtile(weighttile, chunkaddr)))
-        #print(getchunkfromtile(weighttile, chunkaddr))
-        #print(weighttile)
-        d[weights_dram_in] = getchunkfromtile(weighttile, chunkaddr)
-        d[weights_dram_valid] = 1
-        chunkaddr += 1
-
-    # Read host memory signal
-    if sim.inspect(hostmem_re):
-        raddr = sim.inspect(hostmem_raddr)
-        if raddr in hostmem:
-            d[hostmem_rdata] = hostmem[raddr]
-
-    # Write host memory signal
-    if sim.inspect(hostmem_we):
-        waddr = sim.inspect(hostmem_waddr)
-        wdata = sim.inspect(hostmem_wdata)
-        hostmem[waddr] = wdata
-
-    # Read weights memory signal
-    if sim.inspect(weights_dram_read):
-        weightaddr = sim.inspect(weights_dram_raddr)
-        weighttile = weightsmem[weightaddr]
-        chunkaddr = 0
-        #print("Read Weights: addr {}".format(weightaddr))
-        #print(weighttile)
-        
-    sim.step(d)
-    cycle += 1
-
-print("\n\n")
-print("Simulation terminated at cycle {}".format(cycle))
-print("Final Host memory:")
-print_mem(hostmem)
-
-#sim_trace.render_trace()
-with open("trace.vcd", 'w') as f:
-    sim_trace.print_vcd(f)
+    return (tile >> int(((nchunks - chunkn - 1))*chunkbits)) & chunkmask
+
+
+class CompiledBackend(object):
+    '''Wraps CompiledSimulation so the run loop can drive it like a FastSimulation.
+
+    CompiledSimulation can only inspect wires through its tracer, so it gets a private
+    trace of the top-level I/O that is cut back to the latest value every step. The
+    user's tracer, if any, is fed from that; only Inputs and Outputs can be traced.
+    '''
+
+    def __init__(self, block, memory_value_map, tracer):
+        io = block.wirevector_subset((Input, Output))
+        for w in tracer.wires_to_track:
+            if w not in io:
+                raise PyrtlError('The compiled backend can only trace top-level I/O, not "{}"'.format(w.name))
+        self.io_trace = SimulationTrace(wires_to_track=io, block=block)
+        self.sim = CompiledSimulation(tracer=self.io_trace, memory_value_map=memory_value_map, block=block)
+        self.tracer = tracer
+
+    def step(self, provided_inputs):
+        self.sim.step(provided_inputs)
+        for vals in self.io_trace.trace.values():
+            del vals[:-1]
+        if self.tracer.wires_to_track:
+            self.tracer.add_step({ w : self.io_trace.trace[w.name][-1] for w in self.tracer.wires_to_track })
+
+    def inspect(self, w):
+        return self.sim.inspect(w)
+
+
+def make_sim(backend, ports, memory_value_map, tracer, register_value_map=None):
+    if backend == 'fast':
+        return FastSimulation(tracer=tracer, register_value_map=register_value_map or {}, memory_value_map=memory_value_map, block=ports.block)
+    elif backend == 'compiled':
+        if register_value_map:
+            raise PyrtlError('Checkpoints need the fast backend')
+        return CompiledBackend(ports.block, memory_value_map, tracer)
+    raise PyrtlError('Unknown simulation backend "{}"'.format(backend))
+
+
+def memories(block):
+    '''The design's RAMs, by name.'''
+    mems = ( net.op_param[1] for net in block.logic_subset('m@') )
+    return { mem.name : mem for mem in mems if not isinstance(mem, RomBlock) }
+
+
+def _pack(obj):
+    return np.frombuffer(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL), dtype=np.uint8)
+
+
+def save_checkpoint(path, sim, ports, cycle, inputs, harness):
+    '''Save a run to a compressed .npz as it is about to step into cycle + 1: the design's
+    registers and memories, the inputs of that step, and the harness state (host memory,
+    memory models and the transfers in flight). The weight DRAM is not saved; it never changes.'''
+    if not isinstance(sim, FastSimulation):
+        raise PyrtlError('Checkpoints need the fast backend')
+    mems = { name : dict(sim.inspect_mem(mem)) for name, mem in memories(ports.block).items() }
+    np.savez_compressed(path, config=repr(ports.cfg.key()), cycle=cycle, registers=_pack(dict(sim.regs)), memories=_pack(mems),
+                        inputs=_pack({ w.name : v for w, v in inputs.items() }), harness=_pack(harness))
+
+
+def load_checkpoint(path, ports):
+    '''(register values, memory values, cycle, inputs, harness state) saved by save_checkpoint(), for the same design.'''
+    block = ports.block
+    with np.load(path) as state:
+        regs, mems, inputs, harness = [ pickle.loads(state[k].tobytes()) for k in ('registers', 'memories', 'inputs', 'harness') ]
+        config, cycle = str(state['config']), int(state['cycle'])
+    names = memories(block)
+    if config != repr(ports.cfg.key()) or set(mems) != set(names) or set(regs) != set(r.name for r in block.wirevector_subset(Register)):
+        raise PyrtlError('Checkpoint {} is of another design'.format(path))
+    register_value_map = { block.get_wirevector_by_name(name) : v for name, v in regs.items() }
+    memory_value_map = { names[name] : values for name, values in mems.items() }
+    inputs = { block.get_wirevector_by_name(name) : v for name, v in inputs.items() }
+    return register_value_map, memory_value_map, cycle, inputs, harness
+
+
+def beats(nvecs, vecs_per_beat):
+    '''Host memory beats needed to move nvecs vectors.'''
+    return (nvecs + vecs_per_beat - 1) // vecs_per_beat
+
+
+def host_beat_bytes(cfg):
+    return cfg.HOST_VECS_PER_BEAT * cfg.VECSIZE * cfg.DWIDTH // 8
+
+
+def run(ports, instrs, hostmem, weightsmem, tracer, backend='fast', weights_model=None, host_model=None, core_instrs=(),
+        checkpoint_at=None, checkpoint_file='checkpoint.npz', stop=None, restore=None):
+    '''Simulate the program until it halts. hostmem is updated in place.
+
+    With several cores, core_instrs holds the programs of cores 1, 2, ...; cores without
+    one of their own run instrs too. The run ends when every core has halted.
+
+    weights_model and host_model are memory.MemoryModels deciding when weight DRAM beats and
+    host memory beats arrive (default: one beat per cycle starting the cycle after the request).
+    A host memory beat carries HOST_VECS_PER_BEAT vectors.
+    Returns the cycle count and a dict of the design's performance counters at halt
+    (empty unless it was built with PERF_COUNTERS).
+
+    The run is saved to checkpoint_file at the end of cycle checkpoint_at, and stops at the
+    end of cycle stop. restore goes on from a checkpoint of the same design and weights,
+    replacing the programs and hostmem with the saved ones. Both need the fast backend.
+    '''
+    cfg = ports.cfg
+    if weights_model is None:
+        weights_model = MemoryModel(beat_bytes=cfg.WEIGHT_DRAM_BEAT_BYTES)
+    if host_model is None:
+        host_model = MemoryModel(beat_bytes=host_beat_bytes(cfg))
+
+    programs = [instrs] + list(core_instrs)
+    if len(programs) > cfg.NUM_CORES:
+        raise ValueError('{} programs for {} cores'.format(len(programs), cfg.NUM_CORES))
+    programs += [instrs] * (cfg.NUM_CORES - len(programs))
+    halt = ports.halt
+    weights_dram_in, weights_dram_valid = ports.weights_dram_in, ports.weights_dram_valid
+    weights_dram_read, weights_dram_raddr = ports.weights_dram_read, ports.weights_dram_raddr
+    hostmem_re, hostmem_raddr, hostmem_rlen = ports.hostmem_re, ports.hostmem_raddr, ports.hostmem_rlen
+    hostmem_rdata, hostmem_rvalid = ports.hostmem_rdata, ports.hostmem_rvalid
+    hostmem_wreq, hostmem_wlen, hostmem_wready = ports.hostmem_wreq, ports.hostmem_wlen, ports.hostmem_wready
+    hostmem_we, hostmem_waddr, hostmem_wdata = ports.hostmem_we, ports.hostmem_waddr, ports.hostmem_wdata
+
+    din = {
+        weights_dram_in : 0,
+        weights_dram_valid : 0,
+        hostmem_rdata : 0,
+        hostmem_rvalid : 0,
+        hostmem_wready : 0,
+    }
+
+    # Beats in flight, in arrival order: (cycle, data) for weights, (cycle, address, vectors)
+    # for host reads, (cycle, vectors) for host write slots
+    weight_beats = deque()
+    read_beats = deque()
+    write_slots = deque()
+    writes_accepted = deque()  # vectors in each write beat the design has been told it may send
+
+    memory_value_map = { imem : { a : v for a,v in enumerate(prog)} for imem, prog in zip(ports.imems, programs) }
+    register_value_map = {}
+    cycle, d = -1, din  # the inputs of the next step, into cycle + 1
+    if restore is not None:
+        register_value_map, memory_value_map, cycle, d, harness = load_checkpoint(restore, ports)
+        hostmem.clear()
+        hostmem.update(harness['hostmem'])
+        weights_model, host_model = harness['weights_model'], harness['host_model']
+        weight_beats, read_beats, write_slots, writes_accepted = harness['transfers']
+    sim = make_sim(backend, ports, memory_value_map, tracer, register_value_map)
+
+    vecs = cfg.HOST_VECS_PER_BEAT
+    vecwidth = cfg.VECSIZE * cfg.DWIDTH
+    vecmask = (1 << vecwidth) - 1
+
+    nchunks = tile_chunks(cfg)
+    while True:
+        sim.step(d)
+        cycle += 1
+
+        # Halt signal
+        if sim.inspect(halt):
+            break
+
+        # Requests made in this cycle
+        if sim.inspect(weights_dram_read):
+            weighttile = weightsmem[sim.inspect(weights_dram_raddr)]
+            times = weights_model.schedule(cycle, nchunks)
+            weight_beats.extend((t, getchunkfromtile(weighttile, n, nchunks, cfg.WEIGHT_DRAM_BEAT_BYTES)) for n, t in enumerate(times))
+            #print("Read Weights: addr {}".format(weightaddr))
+
+        if sim.inspect(hostmem_re):
+            raddr = sim.inspect(hostmem_raddr)
+            rlen = sim.inspect(hostmem_rlen)
+            times = host_model.schedule(cycle, beats(rlen, vecs))
+            read_beats.extend((t, raddr + n*vecs, min(vecs, rlen - n*vecs)) for n, t in enumerate(times))
+
+        if sim.inspect(hostmem_wreq):
+            wlen = sim.inspect(hostmem_wlen)
+            times = host_model.schedule(cycle, beats(wlen, vecs))
+            write_slots.extend((t, min(vecs, wlen - n*vecs)) for n, t in enumerate(times))
+
+        # Host memory writes accepted in this cycle
+        if sim.inspect(hostmem_we):
+            waddr = sim.inspect(hostmem_waddr)
+            wdata = sim.inspect(hostmem_wdata)
+            for i in range(writes_accepted.popleft()):
+                hostmem[waddr + i] = (wdata >> (i*vecwidth)) & vecmask
+
+        # Drive whatever arrives in the next cycle
+        d = din.copy()
+        if weight_beats and weight_beats[0][0] == cycle + 1:
+            d[weights_dram_in] = weight_beats.popleft()[1]
+            d[weights_dram_valid] = 1
+        if read_beats and read_beats[0][0] == cycle + 1:
+            _, raddr, n = read_beats.popleft()
+            d[hostmem_rdata] = sum(hostmem.get(raddr + i, 0) << (i*vecwidth) for i in range(n))
+            d[hostmem_rvalid] = 1
+        if write_slots and write_slots[0][0] == cycle + 1:
+            writes_accepted.append(write_slots.popleft()[1])
+            d[hostmem_wready] = 1
+
+        if cycle == checkpoint_at:
+            harness = { 'hostmem' : hostmem, 'weights_model' : weights_model, 'host_model' : host_model,
+                        'transfers' : (weight_beats, read_beats, write_slots, writes_accepted) }
+            save_checkpoint(checkpoint_file, sim, ports, cycle, d, harness)
+        if cycle == stop:
+            break
+
+    perf = { name : sim.inspect(w) for name, w in ports.perf.items() }
+    return cycle, perf
+
+
+def print_perf(perf, ncores=1):
+    cycles = perf['cycles']
+    for k in range(ncores):
+        prefix = tpu.core_prefix(k)
+        print("Performance counters{}:".format(" (core {})".format(k) if ncores > 1 else ""))
+        for name in tpu.PERF_COUNTERS:
+            value = perf[prefix + name]
+            if name == 'cycles':
+                print("  {:<20} {}".format(name, cycles))
+            elif name == 'fifo_occupancy':
+                print("  {:<20} {:.2f} tiles on average".format(name, value / max(cycles, 1)))
+            else:
+                print("  {:<20} {:<10} ({:.1f}%)".format(name, value, 100.0 * value / max(cycles, 1)))
+
+
+def print_timeline(timeline, ncores=1, top=10):
+    '''Per-instruction latencies, unit utilization and the critical path of each core.'''
+    cycles = max(len(timeline), 1)
+    for k in range(ncores):
+        core = timeline.cores[k]
+        path = timeline.critical_path(k)
+        on_path = set(pc for pc, _, _ in path)
+        print("Instructions{}:".format(" (core {})".format(k) if ncores > 1 else ""))
+        print("  {:>5}  {:<24} {:>7} {:>7} {:>7} {:>7} {:>7}".format('pc', 'instruction', 'fetch', 'issue', 'stalled', 'done', 'latency'))
+        for pc, fetched, issued, done in timeline.instructions(k):
+            if core.text(pc).endswith(': NOP'):
+                continue
+            print("  {:>5}{} {:<24} {:>7} {:>7} {:>7} {:>7} {:>7}".format(pc, '*' if pc in on_path else ' ', core.text(pc).partition(': ')[2] or core.text(pc), fetched, issued, issued - fetched, done, done - issued))
+        busy = timeline.utilization(k)
+        print("  Unit utilization: " + ", ".join("{} {:.1f}%".format(unit, 100.0 * busy[unit] / cycles) for unit in timeline.UNITS if busy[unit]))
+        print("  Critical path (*), longest steps first:")
+        for pc, n, blocker in sorted(path, key=lambda step: -step[1])[:top]:
+            how = 'in order' if blocker is None or (blocker == pc - 1 and n <= 1) else 'after {}'.format(core.text(blocker))
+            print("    {:>7} cycles  {} ({})".format(n, core.text(pc), how))
+
+
+def parse_args():
+    global args
+
+    parser = argparse.ArgumentParser(description="Run the PyRTL spec for the TPU on the indicated program.")
+    parser.add_argument("prog", metavar="program.bin", help="A valid binary program for OpenTPU.")
+    parser.add_argument("--core-program", action='append', metavar="PROGRAM", default=[],
+                        help="With NUM_CORES > 1, the program for the next core (repeatable: cores 1, 2, ...). Cores without one run program.bin.")
+    parser.add_argument("hostmem", metavar="HostMemoryArray", help="A file containing a numpy array containing the initial contents of host memory. Each row represents one vector.")
+    parser.add_argument("weightsmem", metavar="WeightsMemoryArray", help="A file containing a numpy array containing the contents of the weights memroy. Each row represents one MAT_ROWS x MAT_COLS tile (the first row corresponds to the top row of the weights matrix).")
+    parser.add_argument("--config", action='append', metavar="NAME=VALUE", default=[],
+                        help="Override a hardware parameter from config.py for this run, e.g. --config MATSIZE=8 (repeatable).")
+    parser.add_argument("--perf", action='store_true',
+                        help="Build the design with performance counters and print them when the program halts.")
+    parser.add_argument("--weights-mem", metavar="SPEC", default="",
+                        help="Weight DRAM timing, e.g. latency=40,bandwidth=32,burst=4,jitter=8 (latency in cycles, bandwidth in bytes/cycle, burst in WEIGHT_DRAM_BEAT_BYTES-byte beats). Default: a beat every cycle from the cycle after the request.")
+    parser.add_argument("--host-mem", metavar="SPEC", default="",
+                        help="Host memory timing, in the same format as --weights-mem (one beat is one vector).")
+    parser.add_argument("--mem-seed", type=int, default=0, help="Seed for the memory latency jitter.")
+    parser.add_argument("--backend", choices=['fast', 'compiled'], default='fast',
+                        help="PyRTL simulation backend: fast (FastSimulation, default) or compiled (CompiledSimulation, needs a C compiler; slower to start but much faster per cycle).")
+    parser.add_argument("--optimize", action='store_true',
+                        help="Run PyRTL's optimization passes on the design before simulating. Internal wire names are lost, so only top-level I/O can be traced.")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="Always elaborate the design instead of loading it from the elaboration cache.")
+    parser.add_argument("--trace", choices=['off', 'full', 'window', 'stream', 'toggles', 'timeline'], default='off',
+                        help="Tracing mode: off (default); full keeps the whole trace in memory and dumps it at the end; window keeps only the cycles in --trace-window; stream writes the VCD to disk as the simulation runs; toggles writes no VCD but counts the bit toggles on every wire (or the --trace-signals), a proxy for switching energy; timeline records the instruction each unit works on every cycle, prints per-instruction latencies and the critical path, and writes a Chrome trace (chrome://tracing or ui.perfetto.dev).")
+    parser.add_argument("--trace-signals", nargs='+', metavar="NAME", default=None,
+                        help="Only trace the named wires (e.g. pc instr dispatch_mm mm_busy act_busy). Defaults to all named wires; 'all' traces every wire.")
+    parser.add_argument("--trace-window", nargs=2, type=int, metavar=("START", "END"), default=None,
+                        help="Only trace cycles in [START, END) (window and stream modes).")
+    parser.add_argument("--checkpoint-at", type=int, metavar="CYCLE", default=None,
+                        help="Save the run's state at the end of CYCLE to --checkpoint-file (fast backend only).")
+    parser.add_argument("--checkpoint-file", metavar="FILE", default='checkpoint.npz', help="Where to save the state (default checkpoint.npz).")
+    parser.add_argument("--stop-at", type=int, metavar="CYCLE", default=None,
+                        help="Stop at the end of CYCLE, saving the state there unless --checkpoint-at says otherwise.")
+    parser.add_argument("--restore", metavar="FILE", default=None,
+                        help="Go on from the state saved in FILE by a run of the same design and weights. Its programs and host memory replace the ones given.")
+    parser.add_argument("--energy", action='store_true',
+                        help="Estimate the energy of the run from its bit toggles (implies --trace toggles) and the design's area; see energy.py.")
+    parser.add_argument("--clock-mhz", type=float, default=None,
+                        help="Clock for the leakage estimate with --energy (default: the design's maximum from timing analysis).")
+    parser.add_argument("--inferences", type=int, default=None,
+                        help="Inferences the program runs, for the energy per inference; required with --energy.")
+    parser.add_argument("--trace-file", default=None, help="Where to write the trace (default trace.vcd, or trace.json for the timeline).")
+    args = parser.parse_args()
+    if args.energy and args.inferences is None:
+        parser.error("--energy needs --inferences: the inferences a program runs cannot be told from its host memory")
+    if args.energy:
+        args.trace = 'toggles'
+    if args.checkpoint_at is None:
+        args.checkpoint_at = args.stop_at
+    if args.trace_file is None:
+        args.trace_file = 'trace.json' if args.trace == 'timeline' else 'trace.vcd'
+    if args.trace_signals == ['all']:
+        args.trace_signals = 'all'
+    overrides = {}
+    for setting in args.config:
+        name, _, value = setting.partition('=')
+        overrides[name] = int(value, 0)
+    if args.perf:
+        overrides['PERF_COUNTERS'] = True
+    args.cfg = Config(**overrides)
+
+
+if __name__ == '__main__':
+    parse_args()
+
+    instrs = load_program(args.prog, args.cfg)
+    core_instrs = [ load_program(path, args.cfg) for path in args.core_program ]
+
+    # Read the dram files and build memory images
+    hostarray = np.load(args.hostmem)
+    #print(hostarray)
+    #print(hostarray.shape)
+    bits = args.cfg.DWIDTH
+    hostmem = { a : concat_vec(vec, bits) for a,vec in enumerate(hostarray) }
+    print("Host memory:")
+    print_mem(hostmem, bits)
+
+    weightsarray = np.load(args.weightsmem)
+    size = weightsarray.shape[-1]
+    #print(weightsarray)
+    #print(weightsarray.shape)
+    weightsmem = { a : concat_tile(tile, bits) for a,tile in enumerate(weightsarray) }
+    #weightsmem = { a : concat_vec(vec) for a,vec in enumerate(weightsarray) }
+    print("Weight memory:")
+    print_weight_mem(weightsmem, bits=bits, size=size)
+    #print(weightsmem)
+
+    # Build (or load the cached) design
+    ports = load_tpu(args.cfg, optimized=args.optimize, cache_dir=None if args.no_cache else tpu.CACHE_DIR)
+    block = ports.block
+
+    # Run Simulation
+    if args.backend == 'compiled' and args.trace_signals is None:
+        args.trace_signals = sorted(w.name for w in block.wirevector_subset((Input, Output)))
+    tracefile = open(args.trace_file, 'w') if args.trace == 'stream' else None
+    labels = [ [ funcsim.describe(*instr) for instr in funcsim.load_program(path) ] for path in [args.prog] + args.core_program ]
+    labels += [labels[0]] * (args.cfg.NUM_CORES - len(labels))
+    sim_trace = tracing.make_tracer(args.trace, signals=args.trace_signals, window=args.trace_window, f=tracefile, block=block, cfg=args.cfg, labels=labels)
+    weights_model = MemoryModel.from_spec(args.weights_mem, beat_bytes=args.cfg.WEIGHT_DRAM_BEAT_BYTES, seed=args.mem_seed)
+    host_model = MemoryModel.from_spec(args.host_mem, beat_bytes=host_beat_bytes(args.cfg), seed=args.mem_seed + 1)
+    cycle, perf = run(ports, instrs, hostmem, weightsmem, tracer=sim_trace, backend=args.backend, weights_model=weights_model, host_model=host_model, core_instrs=core_instrs,
+                      checkpoint_at=args.checkpoint_at, checkpoint_file=args.checkpoint_file, stop=args.stop_at, restore=args.restore)
+
+    print("\n\n")
+    if args.checkpoint_at is not None and args.checkpoint_at <= cycle:
+        print("Saved the state at cycle {} to {}".format(args.checkpoint_at, args.checkpoint_file))
+    print("Simulation {} at cycle {}".format('stopped' if cycle == args.stop_at else 'terminated', cycle))
+    print("Final Host memory:")
+    print_mem(hostmem, bits)
+    if perf:
+        print_perf(perf, args.cfg.NUM_CORES)
+
+    #sim_trace.render_trace()
+    if args.trace == 'stream':
+        sim_trace.close()
+        tracefile.close()
+    elif args.trace == 'toggles':
+        total = sim_trace.total()
+        print("Bit toggles: {} ({:.1f} per cycle)".format(total, total / max(1, len(sim_trace))))
+        ops = sim_trace.by_op()
+        print("  on multiplier outputs {}, adder outputs {}, registers {}".format(ops.get('*', 0), ops.get('+', 0), ops.get('r', 0)))
+        for name, n in sorted(sim_trace.by_module().items(), key=lambda item: -item[1]):
+            print("  in {:37} {}".format(name, n))
+        for name, n in sim_trace.busiest():
+            print("  {:40} {}".format(name, n))
+        if args.energy:
+            import energy
+            logic_area, mem_area = area_estimation(tech_in_nm=energy.TECH_NM, block=block)
+            clock = args.clock_mhz or TimingAnalysis(block).max_freq(tech_in_nm=energy.TECH_NM)
+            static = energy.static_pj(logic_area + mem_area, cycle, clock)
+            print("Area {:.3f} mm^2 ({:.3f} logic, {:.3f} memory), clock {:.0f} MHz".format(logic_area + mem_area, logic_area, mem_area, clock))
+            print(energy.report(energy.toggle_energy(sim_trace), args.inferences, static))
+    elif args.trace == 'timeline':
+        print_timeline(sim_trace, args.cfg.NUM_CORES)
+        with open(args.trace_file, 'w') as f:
+            sim_trace.chrome_trace(f)
+    elif args.trace != 'off':
+        with open(args.trace_file, 'w') as f:
+            sim_trace.print_vcd(f)
@@ -0,0 +1,107 @@
+from pyrtl import *
+
+
+def overlaps(lo_a, hi_a, lo_b, hi_b):
+    '''True if the address ranges [lo_a, hi_a) and [lo_b, hi_b) intersect.'''
+    return (lo_a < hi_b) & (lo_b < hi_a)
+
+
+def addr_range(start, length, addrwidth):
+    '''[start, start+length) as a pair of wires one bit wider than an address, so the end cannot wrap.'''
+    lo = start[:addrwidth].zero_extended(addrwidth+1)
+    return lo, (lo + length)[:addrwidth+1]
+
+
+def held_range(dispatch, lo, hi):
+    '''Latch the range of an instruction when it is dispatched, for as long as its unit is busy.'''
+    lo_reg, hi_reg = Register(len(lo)), Register(len(hi))
+    with conditional_assignment:
+        with dispatch:
+            lo_reg.next |= lo
+            hi_reg.next |= hi
+    return lo_reg, hi_reg
+
+
+def scoreboard(ub_size, acc_size, op, ub_start_addr, ub_dec_addr, ub_dest_addr, accum_waddr, accum_raddr, mmc_length, act_length, rhm_length, whm_length, switch_weights, mm_busy, mm_done, act_busy, rhm_busy, whm_busy, weights_loaded, fifo_top_full, rw_pending, lut_length, lut_busy, bias_busy):
+    '''
+    Issue logic: decides whether the decoded instruction can be dispatched this cycle.
+
+    op is a dict of the raw (ungated) dispatch signals from the decoder: mm, act, rhm, whm, rw, lut, bias and halt.
+    An instruction stalls while the unit it needs is busy, or while a unit still in flight
+    writes a range it reads or reads/writes a range it writes:
+
+    MMC  reads UB [ub, ub+N) and writes the accumulators [acc, acc+N); MMC.S also needs the next
+         weight tile fully programmed into the array
+    ACT  reads the accumulators [acc, acc+N) (written by any outstanding MMC until its mm_done)
+         and writes UB [ub, ub+N)
+    RHM  writes UB [ub, ub+N)
+    WHM  reads UB [ub, ub+N)
+    LUT  reads UB [ub, ub+N) into the activation table, which no ACT may be using
+    BIAS reads UB [ub, ub+1) into the bias registers, which no ACT may be using
+    RW   needs the previous tile transfers finished (rw_pending) and the top of the weight FIFO empty
+    HLT  waits for every unit to drain
+
+    Outputs
+    stall: hold the PC and suppress every dispatch this cycle
+    '''
+
+    # Ranges of the instruction being decoded
+    mmc_ub = addr_range(ub_start_addr, mmc_length, ub_size)
+    mmc_acc = addr_range(accum_waddr, mmc_length, acc_size)
+    act_acc = addr_range(accum_raddr, act_length, acc_size)
+    act_ub = addr_range(ub_dest_addr, act_length, ub_size)
+    rhm_ub = addr_range(ub_dec_addr, rhm_length, ub_size)
+    whm_ub = addr_range(ub_dec_addr, whm_length, ub_size)
+    lut_ub = addr_range(ub_dec_addr, lut_length, ub_size)
+    bias_ub = addr_range(ub_dec_addr, 1, ub_size)
+
+    stall = WireVector(1)
+    go = ~stall
+
+    # Ranges held by units in flight
+    mm_ub_lo, mm_ub_hi = held_range(op['mm'] & go, *mmc_ub)
+    act_acc_lo, act_acc_hi = held_range(op['act'] & go, *act_acc)
+    act_ub_lo, act_ub_hi = held_range(op['act'] & go, *act_ub)
+    rhm_ub_lo, rhm_ub_hi = held_range(op['rhm'] & go, *rhm_ub)
+    whm_ub_lo, whm_ub_hi = held_range(op['whm'] & go, *whm_ub)
+    lut_ub_lo, lut_ub_hi = held_range(op['lut'] & go, *lut_ub)
+    bias_ub_lo, bias_ub_hi = held_range(op['bias'] & go, *bias_ub)
+
+    # MMC results land in the accumulators long after mm_busy falls; track the union of the
+    # accumulator ranges of every MMC that has not signalled mm_done yet
+    mm_outstanding = Register(8, 'mm_outstanding')
+    mm_acc_lo, mm_acc_hi = Register(acc_size+1), Register(acc_size+1)
+    mm_issue = op['mm'] & go
+    with conditional_assignment:
+        with mm_issue & ~mm_done:
+            mm_outstanding.next |= mm_outstanding + 1
+        with mm_done & ~mm_issue:
+            mm_outstanding.next |= mm_outstanding - 1
+    with conditional_assignment:
+        with mm_issue:
+            with (mm_outstanding == 0) | ((mm_outstanding == 1) & mm_done):
+                mm_acc_lo.next |= mmc_acc[0]
+                mm_acc_hi.next |= mmc_acc[1]
+            with otherwise:
+                mm_acc_lo.next |= select(mmc_acc[0] < mm_acc_lo, mmc_acc[0], mm_acc_lo)
+                mm_acc_hi.next |= select(mmc_acc[1] > mm_acc_hi, mmc_acc[1], mm_acc_hi)
+    mm_pending = mm_outstanding != 0
+
+    def ub_write_pending(lo, hi):  # an RHM or ACT in flight writes part of [lo, hi)
+        return (rhm_busy & overlaps(lo, hi, rhm_ub_lo, rhm_ub_hi)) | (act_busy & overlaps(lo, hi, act_ub_lo, act_ub_hi))
+
+    def ub_read_pending(lo, hi):  # an MMC, WHM, LUT or BIAS in flight reads part of [lo, hi)
+        return (mm_busy & overlaps(lo, hi, mm_ub_lo, mm_ub_hi)) | (whm_busy & overlaps(lo, hi, whm_ub_lo, whm_ub_hi)) | (lut_busy & overlaps(lo, hi, lut_ub_lo, lut_ub_hi)) | (bias_busy & overlaps(lo, hi, bias_ub_lo, bias_ub_hi))
+
+    mm_hazard = mm_busy | (mm_outstanding == 255) | ub_write_pending(*mmc_ub) | (act_busy & overlaps(mmc_acc[0], mmc_acc[1], act_acc_lo, act_acc_hi)) | (switch_weights & ~weights_loaded)
+    act_hazard = act_busy | lut_busy | (mm_pending & overlaps(act_acc[0], act_acc[1], mm_acc_lo, mm_acc_hi)) | ub_write_pending(*act_ub) | ub_read_pending(*act_ub)
+    rhm_hazard = rhm_busy | ub_write_pending(*rhm_ub) | ub_read_pending(*rhm_ub)
+    whm_hazard = whm_busy | ub_write_pending(*whm_ub)
+    rw_hazard = rw_pending | fifo_top_full
+    lut_hazard = lut_busy | bias_busy | act_busy | ub_write_pending(*lut_ub)
+    bias_hazard = lut_busy | act_busy | ub_write_pending(*bias_ub)
+    halt_hazard = mm_busy | mm_pending | act_busy | rhm_busy | whm_busy | rw_pending | lut_busy | bias_busy
+
+    stall <<= (op['mm'] & mm_hazard) | (op['act'] & act_hazard) | (op['rhm'] & rhm_hazard) | (op['whm'] & whm_hazard) | (op['rw'] & rw_hazard) | (op['lut'] & lut_hazard) | (op['bias'] & bias_hazard) | (op['halt'] & halt_hazard)
+
+    return stall
@@ -0,0 +1,341 @@
+'''
+A long-lived functional simulator: models stay resident in sim.TPUSim, and single inputs
+from any number of clients are batched into one run.
+
+    python3 gen_workload.py mlp --layers 64,64,10 --batch 1 --config MATSIZE=16
+    python3 server.py mlp --port 8470
+    python3 server.py mlp other --socket /tmp/tpu.sock --max-delay-ms 5
+
+Models are gen_workload.py prefixes: the .json manifest gives the network's layers,
+activations and config, and PREFIX_weights.npy (PREFIX_weights_raw.npy with --raw) its
+weight DRAM. The requests for a model are queued until --max-batch of them (at most the
+workload's chunk size, itself at most 255, the longest an RHM or MMC can be) have arrived
+or the oldest has waited --max-delay-ms, and then run as one batch: the program running n
+inputs at a time is assembled the first time a batch of n is run, and reused after.
+
+The protocol is a JSON object per line each way, over TCP on localhost or a Unix socket.
+Replies carry the id of their request, and need not come back in order:
+
+    {"id": 7, "model": "mlp", "input": [3, -1, ...]}  ->  {"id": 7, "output": [...], "batch": 12, "latency_ms": 2.1}
+    {"id": 8, "op": "metrics"}  ->  {"id": 8, "mlp": {"queue_depth": 0, "requests": 12, "p50_ms": 2.0, "p99_ms": 2.1, ...}}
+    {"id": 9, "op": "models"}  ->  {"id": 9, "mlp": {"layers": [64, 64, 10], "acts": ["relu", "none"], "max_batch": 255}}
+
+Errors come back as {"id": ..., "error": "..."}. Client talks to the server from asyncio code.
+'''
+
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from config import Config
+import gen_workload
+import sim
+
+args = None
+
+PORT = 8470
+HALT = [('HLT', 0, 0, 0, 0)]  # program of the cores a batch does not use
+
+
+def assemble(lines):
+    '''Decoded instructions of a program given as lines of assembly.'''
+    import assembler
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, 'batch.a')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        assembler.assemble(path, 0)
+        return sim.load_program(os.path.join(workdir, 'batch' + assembler.SUFFIX))
+    finally:
+        shutil.rmtree(workdir)
+
+
+class Model(object):
+    '''A gen_workload.py network resident in a TPUSim, with the programs that run batches of it.'''
+
+    def __init__(self, prefix, raw=False):
+        with open(prefix + '.json') as f:
+            manifest = json.load(f)
+        self.name = os.path.basename(prefix)
+        self.cfg = Config(**manifest['config'])
+        self.layers, self.acts = manifest['layers'], manifest['acts']
+        self.dtype = np.float32 if raw else self.cfg.INT_DTYPE
+        self.max_batch = gen_workload.chunk_size(self.cfg, self.layers)
+        self.in_blocks = gen_workload.blocks(self.layers[0], self.cfg)
+        self.out_blocks = gen_workload.blocks(self.layers[-1], self.cfg)
+        weights = np.load(prefix + ('_weights_raw.npy' if raw else '_weights.npy'))
+        self.tpusim = sim.TPUSim(HALT, weights, np.zeros((0, self.cfg.VECSIZE), dtype=self.dtype), cfg=self.cfg, raw=raw, verbose=False)
+        self.programs = {}  # batch size -> decoded program
+
+    def input(self, x):
+        '''x as a row of the host memory, if it is one input the model can take.'''
+        x = np.asarray(x, dtype=np.float64)
+        if x.shape != (self.layers[0],):
+            raise ValueError('Model "{}" takes {} inputs, not {}'.format(self.name, self.layers[0], x.shape))
+        if not np.isfinite(x).all():
+            raise ValueError('Inputs must be finite numbers')
+        if np.dtype(self.dtype).kind == 'i':
+            info = np.iinfo(self.dtype)
+            if (x != np.round(x)).any() or x.min() < info.min or x.max() > info.max:
+                raise ValueError('Model "{}" takes integers from {} to {}'.format(self.name, info.min, info.max))
+        elif not np.isfinite(x.astype(self.dtype)).all():
+            raise ValueError('Inputs must fit in {}'.format(np.dtype(self.dtype).name))
+        return x.astype(self.dtype)
+
+    def program(self, n):
+        '''The program running a batch of n inputs, assembled on first use.'''
+        if n not in self.programs:
+            lines = gen_workload.chunk_program(self.cfg, self.layers, self.acts, n, 0, n * self.in_blocks)
+            self.programs[n] = assemble(lines + ['HLT'])
+        return self.programs[n]
+
+    def run(self, x):
+        '''Outputs for the inputs x, a row each, and the hardware cycles sim.py estimates for them.'''
+        n = len(x)
+        host = np.zeros((n * (self.in_blocks + self.out_blocks), self.cfg.VECSIZE), dtype=self.dtype)
+        host[:n * self.in_blocks] = gen_workload.to_host(x, self.cfg)
+        tpusim = self.tpusim
+        tpusim.programs = [self.program(n)] + [HALT] * (self.cfg.NUM_CORES - 1)
+        tpusim.host_memory = host
+        tpusim.mmc_stats = []
+        tpusim.reset_core()
+        host = tpusim.run()
+        return gen_workload.from_host(host[n * self.in_blocks:], n, self.layers[-1], self.cfg), tpusim.cycles[0]
+
+
+class Stats(object):
+    '''Request and batch counts of a model, and the latencies of its last history requests.'''
+
+    def __init__(self, history=10000):
+        self.latencies = deque(maxlen=history)  # seconds
+        self.requests = 0
+        self.batches = 0
+        self.cycles = 0  # estimated hardware cycles of every batch
+
+    def metrics(self, queue_depth):
+        latencies = np.array(self.latencies) * 1e3
+        percentile = lambda q: float(np.percentile(latencies, q)) if len(latencies) else None
+        return {
+            'queue_depth' : queue_depth,
+            'requests' : self.requests,
+            'batches' : self.batches,
+            'mean_batch' : self.requests / float(self.batches) if self.batches else 0.,
+            'p50_ms' : percentile(50),
+            'p99_ms' : percentile(99),
+            'hw_cycles' : self.cycles,
+        }
+
+
+class Request(object):
+    def __init__(self, x, future):
+        self.x = x
+        self.future = future
+        self.start = time.perf_counter()
+
+
+class Server(object):
+    '''Batches the requests for each model, and runs the batches one at a time.
+
+    max_batch caps every model's batches (default: each model's chunk size); a batch runs
+    as soon as it is full or its oldest request has waited max_delay seconds.
+    '''
+
+    def __init__(self, models, max_batch=None, max_delay=0.002, history=10000):
+        self.models = { model.name : model for model in models }
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = { name : deque() for name in self.models }
+        self.stats = { name : Stats(history) for name in self.models }
+        self.wakeup = {}
+        self.tasks = []
+        self.executor = ThreadPoolExecutor(1)  # keeps the event loop free while a batch runs
+
+    def limit(self, name):
+        return min(self.models[name].max_batch, self.max_batch or gen_workload.MAX_LENGTH)
+
+    async def start(self, host='127.0.0.1', port=PORT, path=None):
+        '''Start the batchers, and listen on the Unix socket path, or else on host:port.'''
+        for name in self.models:
+            self.wakeup[name] = asyncio.Event()
+            self.tasks.append(asyncio.ensure_future(self.batcher(name)))
+        if path:
+            return await asyncio.start_unix_server(self.handle, path=path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def infer(self, name, x):
+        '''Outputs of model name for the input x, and the size of the batch it ran in.'''
+        if name not in self.models:
+            raise KeyError('Unknown model "{}"'.format(name))
+        request = Request(self.models[name].input(x), asyncio.get_event_loop().create_future())
+        self.pending[name].append(request)
+        self.wakeup[name].set()
+        return await request.future
+
+    async def batcher(self, name):
+        pending, wakeup = self.pending[name], self.wakeup[name]
+        while True:
+            if not pending:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            wait = pending[0].start + self.max_delay - time.perf_counter()
+            if len(pending) < self.limit(name) and wait > 0:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            batch = [ pending.popleft() for _ in range(min(self.limit(name), len(pending))) ]
+            await self.run_batch(name, batch)
+
+    async def run_batch(self, name, batch):
+        stats = self.stats[name]
+        loop = asyncio.get_event_loop()
+        try:
+            outputs, cycles = await loop.run_in_executor(self.executor, self.models[name].run, np.stack([ r.x for r in batch ]))
+        except Exception as e:
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+            return
+        now = time.perf_counter()
+        stats.batches += 1
+        stats.requests += len(batch)
+        stats.cycles += cycles
+        for r, output in zip(batch, outputs):
+            stats.latencies.append(now - r.start)
+            if not r.future.done():
+                r.future.set_result((output, len(batch)))
+
+    def metrics(self):
+        return { name : self.stats[name].metrics(len(self.pending[name])) for name in self.models }
+
+    def describe(self):
+        return { name : { 'layers' : m.layers, 'acts' : m.acts, 'max_batch' : self.limit(name) } for name, m in self.models.items() }
+
+    async def handle(self, reader, writer):
+        '''Serve one connection. Its requests are answered as they complete, so they can share batches.'''
+        tasks = set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            task = asyncio.ensure_future(self.respond(line, writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        writer.close()
+
+    async def respond(self, line, writer):
+        start = time.perf_counter()
+        rid = None
+        try:
+            request = json.loads(line)
+            rid = request.get('id')
+            op = request.get('op', 'infer')
+            if op == 'infer':
+                output, n = await self.infer(request['model'], request['input'])
+                reply = { 'output' : output.tolist(), 'batch' : n, 'latency_ms' : (time.perf_counter() - start) * 1e3 }
+            elif op == 'metrics':
+                reply = self.metrics()
+            elif op == 'models':
+                reply = self.describe()
+            else:
+                raise ValueError('Unknown op "{}"'.format(op))
+        except Exception as e:  # every request gets a reply, or its client would wait forever
+            reply = { 'error' : '{}: {}'.format(type(e).__name__, e) }
+        reply['id'] = rid
+        writer.write((json.dumps(reply) + '\n').encode())
+
+
+class Client(object):
+    '''Talks to a Server. Any number of calls may be in flight at once.'''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.waiting = {}  # request id -> future of its reply
+        self.next_id = 0
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=PORT, path=None):
+        if path:
+            return cls(*await asyncio.open_unix_connection(path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def receive(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            future = self.waiting.pop(reply.pop('id'), None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in self.waiting.values():
+            future.set_exception(ConnectionError('Server closed the connection'))
+
+    async def call(self, **request):
+        '''Send a request and wait for its reply. Raises RuntimeError with the message of an error reply.'''
+        self.next_id += 1
+        request['id'] = self.next_id
+        future = self.waiting[self.next_id] = asyncio.get_event_loop().create_future()
+        self.writer.write((json.dumps(request) + '\n').encode())
+        reply = await future
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    async def infer(self, model, x):
+        reply = await self.call(model=model, input=np.asarray(x).tolist())
+        return np.array(reply['output'])
+
+    async def metrics(self):
+        return await self.call(op='metrics')
+
+    async def close(self):
+        self.writer.close()
+        await self.receiver
+
+
+def parse_args():
+    global args
+
+    parser = argparse.ArgumentParser(description="Serve gen_workload.py models from resident functional simulators, batching requests.")
+    parser.add_argument("models", nargs='+', metavar="PREFIX", help="gen_workload.py prefix of a model to serve; the model is called by its base name.")
+    parser.add_argument("--host", default='127.0.0.1', help="Address to listen on (default 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=PORT, help="TCP port (default {}).".format(PORT))
+    parser.add_argument("--socket", metavar="PATH", help="Listen on a Unix socket instead of TCP.")
+    parser.add_argument("--raw", action='store_true', help="Run the models on floats, as sim.py --raw does.")
+    parser.add_argument("--max-batch", type=int, default=None, help="Largest batch to run (default: each model's chunk size, at most 255).")
+    parser.add_argument("--max-delay-ms", type=float, default=2., help="Longest a request waits for its batch to fill (default 2).")
+    parser.add_argument("--history", type=int, default=10000, help="Requests per model the latency percentiles are taken over.")
+    args = parser.parse_args()
+
+
+async def serve(server):
+    listener = await server.start(args.host, args.port, args.socket)
+    print("Serving {} on {}".format(', '.join(sorted(server.models)), args.socket or '{}:{}'.format(args.host, args.port)), flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == '__main__':
+    parse_args()
+    server = Server([ Model(prefix, args.raw) for prefix in args.models ], args.max_batch, args.max_delay_ms / 1e3, args.history)
+    try:
+        asyncio.run(serve(server))
+    except KeyboardInterrupt:
+        pass
@@ -1,136 +1,540 @@
 # coding=utf-8
 import argparse
+import hashlib
+import itertools
 import sys
 import numpy as np
 from collections import deque
-from math import exp
 
 import isa
-from config import MATSIZE as WIDTH
+from config import Config
+from memory import MemoryModel
 
 args = None
-# width of the tile
-#WIDTH = 16
+
+
+def sigmoid(x, data_width=8, raw=False):
+    '''The activate unit's sigmoid, scaled to the full unsigned data_width-bit range.
+
+    The hardware looks inputs -8 to 7 up in a ROM, rounding up, and saturates to 0 below
+    and to the top of the range above. raw truncates the function itself instead.
+    '''
+    top = 2**data_width - 1
+    if raw:
+        with np.errstate(over='ignore'):
+            return (top / (1. + np.exp(-np.asarray(x, dtype=np.float64)))).astype(np.int64)
+    x = np.asarray(x, dtype=np.int64)
+    rom = np.ceil(top / (1. + np.exp(-np.arange(-8, 8)))).astype(np.int64)
+    return np.where(x < -8, 0, np.where(x > 7, top, rom[np.clip(x, -8, 7) + 8]))
+
+
+def decode(instr):
+    '''(opcode, addr, ubaddr, length, flag) of a binary instruction.'''
+    field = lambda start, end: int.from_bytes(instr[isa.INSTRUCTION_WIDTH_BYTES-end : isa.INSTRUCTION_WIDTH_BYTES-start], byteorder='big')
+    opcode = isa.BIN2OPCODE[field(isa.OP_START, isa.OP_END)]
+    flag = field(isa.FLAGS_START, isa.FLAGS_END)
+    length = field(isa.LEN_START, isa.LEN_END)
+    addr = field(isa.ADDR_START, isa.ADDR_END)
+    ubaddr = field(isa.UBADDR_START, isa.UBADDR_END)
+    return opcode, addr, ubaddr, length, flag
+
+
+def describe(opcode, addr, ubaddr, length, flag):
+    '''A decoded instruction in assembly syntax.'''
+    func = { isa.FUNC_RELU_MASK : 'R', isa.FUNC_SIGMOID_MASK : 'Q', isa.FUNC_LUT_MASK : 'L' }.get(flag & isa.ACT_FUNC_MASK, '')
+    flags = ''.join(c for mask, c in ((isa.SWITCH_MASK, 'S'), (isa.CONV_MASK, 'C'), (isa.OVERWRITE_MASK, 'O'), (isa.BIAS_MASK, 'B')) if flag & mask) + func
+    name = opcode + ('.' + flags if flags else '')
+    if opcode in ('RHM', 'ACT'):
+        operands = [addr, ubaddr, length]
+    elif opcode in ('WHM', 'MMC', 'LUT'):
+        operands = [ubaddr, addr, length]
+    elif opcode == 'RW':
+        operands = [addr]
+    elif opcode == 'BIAS':
+        operands = [ubaddr, addr]
+    else:
+        operands = []
+    return ' '.join([name, ', '.join(map(str, operands))]).strip()
+
+
+def load_program(program_filename):
+    '''Decode a whole assembled program up front.'''
+    program = []
+    with open(program_filename, 'rb') as f:
+        while True:
+            instr = f.read(isa.INSTRUCTION_WIDTH_BYTES)
+            if len(instr) < isa.INSTRUCTION_WIDTH_BYTES:
+                break
+            program.append(decode(instr))
+    return program
+
+
+class TimingModel(object):
+    '''Cycle estimate of a program on the RTL design, without simulating the hardware.
+
+    Follows the issue rules of the hardware: instructions issue in order, at most one per
+    cycle, and with the scoreboard (cfg.INTERLOCK) each waits for its unit and for the UB
+    and accumulator rows it depends on; SYNC waits for memory transfers either way. Memory
+    transfers are timed with memory.MemoryModel, so runs with different memory models show
+    how many cycles are lost to memory stalls.
+    '''
+
+    def __init__(self, cfg, weights_model=None, host_model=None):
+        self.cfg = cfg
+        self.weights_model = weights_model or MemoryModel(beat_bytes=cfg.WEIGHT_DRAM_BEAT_BYTES)
+        self.host_model = host_model or MemoryModel(beat_bytes=cfg.HOST_VECS_PER_BEAT*cfg.VECSIZE*cfg.DWIDTH//8)
+        self.nchunks = cfg.TILE_BEATS  # DRAM beats per weight tile
+
+        self.cycle = -1  # issue cycle of the previous instruction
+        self.halted = None  # issue cycle of HLT
+        self.free = { 'mm' : 0, 'act' : 0, 'rhm' : 0, 'whm' : 0, 'lut' : 0, 'bias' : 0 }  # first cycle each unit can take an instruction
+        self.ub_ready = np.zeros(2**cfg.UB_ADDR_SIZE, dtype=np.int64)  # UB rows are written by then
+        self.ub_free = np.zeros(2**cfg.UB_ADDR_SIZE, dtype=np.int64)  # and no longer being read
+        self.acc_ready = np.zeros(2**cfg.ACC_ADDR_SIZE, dtype=np.int64)  # accumulator rows hold their MMC results
+        self.acc_free = np.zeros(2**cfg.ACC_ADDR_SIZE, dtype=np.int64)  # and no longer being read by ACT
+        self.mm_done = 0  # cycle every MMC issued so far has finished
+        self.rw_done = 0  # cycle the last weight transfer has landed
+        self.arrivals = []  # cycle the last DRAM beat of each weight tile arrived
+        self.switches = []  # issue cycle of each MMC.S
+        self.stalls = {}  # cycles spent waiting to issue, by opcode
+
+    def loaded(self, k):
+        '''(programmed, left FIFO) cycles of weight tile k; the array programs tile k after switch k-1.'''
+        R, C = self.cfg.MAT_ROWS, self.cfg.MAT_COLS
+        if k >= len(self.arrivals) or k > len(self.switches):
+            raise Exception('Weight tile {} is never loaded: the hardware would wait forever'.format(k))
+        depth = self.cfg.WEIGHT_FIFO_DEPTH
+        ready = self.arrivals[k] + depth  # through the FIFO stages
+        if k == 0:
+            start = ready + 1
+        else:
+            ready = max(ready, self.loaded(k-1)[1] + 3)
+            start = max(self.switches[k-1] + C + 5, ready + 1)  # the previous switch has to clear the array
+        return start + R, start + R - 1  # a row of the tile per cycle
+
+    def ready(self, opcode, addr, ubaddr, length, flag):
+        '''First cycle the instruction can issue in, if it does not have to wait for a memory port.'''
+        ub = slice(ubaddr, ubaddr + length)
+        acc = slice(addr, addr + length)
+        earliest = self.cycle + 1
+        waits = []
+
+        if opcode == 'MMC':
+            waits = [self.free['mm'], self.ub_ready[ub].max(initial=0), self.acc_free[acc].max(initial=0)]
+            if flag & isa.SWITCH_MASK:
+                waits.append(self.loaded(len(self.switches))[0])
+        elif opcode == 'ACT':
+            waits = [self.free['act'], self.free['lut'], self.acc_ready[acc].max(initial=0), self.ub_ready[ub].max(initial=0), self.ub_free[ub].max(initial=0)]
+        elif opcode == 'RHM':
+            waits = [self.free['rhm'], self.ub_ready[ub].max(initial=0), self.ub_free[ub].max(initial=0)]
+        elif opcode == 'WHM':
+            waits = [self.free['whm'], self.ub_ready[ub].max(initial=0)]
+        elif opcode == 'LUT':
+            waits = [self.free['lut'], self.free['bias'], self.free['act'], self.ub_ready[ub].max(initial=0)]
+        elif opcode == 'BIAS':
+            waits = [self.free['lut'], self.free['act'], self.ub_ready[ub].max(initial=0)]
+        elif opcode == 'RW':
+            waits = [self.rw_done + 1]  # the top of the FIFO fills the cycle the transfer lands
+            depth = self.cfg.WEIGHT_FIFO_DEPTH
+            if len(self.arrivals) >= depth:  # FIFO full of tiles: wait for the oldest to be programmed
+                waits.append(self.loaded(len(self.arrivals) - depth)[1] + depth + 1)
+        elif opcode == 'SYNC':
+            waits = [self.free['rhm'], self.free['whm'], self.rw_done]
+        elif opcode == 'HLT':
+            waits = [self.free['mm'], self.mm_done, self.free['act'], self.free['rhm'], self.free['whm'], self.rw_done, self.free['lut'], self.free['bias']]
+
+        if not self.cfg.INTERLOCK and opcode != 'SYNC':
+            waits = []  # the program's NOPs cover every latency
+        return int(max([earliest] + waits))
+
+    def issue(self, opcode, addr, ubaddr, length, flag, t=None):
+        '''Account for one instruction and return the cycle it issues in.
+
+        t is the cycle a shared memory port lets it issue in, if later than ready().
+        '''
+        ub = slice(ubaddr, ubaddr + length)
+        acc = slice(addr, addr + length)
+        earliest = self.cycle + 1
+        t = max(t or 0, self.ready(opcode, addr, ubaddr, length, flag))
+        self.stalls[opcode] = self.stalls.get(opcode, 0) + t - earliest
+        self.cycle = t
+
+        if opcode == 'MMC':
+            self.free['mm'] = t + length + 1
+            self.ub_free[ub] = np.maximum(self.ub_free[ub], t + length + 1)
+            done = t + length + self.cfg.MAT_ROWS + self.cfg.MAT_COLS + self.cfg.MAC_PIPELINE + 1  # last vector through the array and the accumulators
+            self.acc_ready[acc] = done
+            self.mm_done = max(self.mm_done, done)
+            if flag & isa.SWITCH_MASK:
+                self.switches.append(t)
+        elif opcode == 'ACT':
+            self.free['act'] = t + length + 1
+            self.ub_ready[ub] = t + length + 1
+            self.acc_free[acc] = t + length + 1
+        elif opcode == 'RHM':
+            beats = self.host_model.schedule(t, -(-length // self.cfg.HOST_VECS_PER_BEAT))
+            self.free['rhm'] = (beats[-1] if beats else t) + 1
+            self.ub_ready[ub] = self.free['rhm']
+        elif opcode == 'WHM':
+            slots = self.host_model.schedule(t, -(-length // self.cfg.HOST_VECS_PER_BEAT))
+            self.free['whm'] = (slots[-1] if slots else t) + 1
+            self.ub_free[ub] = np.maximum(self.ub_free[ub], self.free['whm'])
+        elif opcode == 'LUT':
+            self.free['lut'] = t + length + 1
+            self.ub_free[ub] = np.maximum(self.ub_free[ub], t + length + 1)
+        elif opcode == 'BIAS':
+            self.free['bias'] = t + 2
+            self.ub_free[ub] = np.maximum(self.ub_free[ub], t + 2)
+        elif opcode == 'RW':
+            beats = self.weights_model.schedule(t, self.nchunks)
+            self.arrivals.append(beats[-1])
+            self.rw_done = beats[-1] + 1
+        elif opcode == 'HLT':
+            self.halted = t
+        return t
+
+    def summary(self):
+        stalled = sum(self.stalls.values())
+        by_op = ', '.join('{} {}'.format(op, n) for op, n in sorted(self.stalls.items()) if n)
+        return '{} cycles, {} of them waiting to issue{}'.format(self.halted, stalled, ' ({})'.format(by_op) if by_op else '')
+
+
+class MultiCoreTiming(object):
+    '''Cycle estimate of a program per core on a TPU with cfg.NUM_CORES cores.
+
+    Each core issues its own program as in TimingModel. The cores share the memory models,
+    and each memory port (RW: weight DRAM, RHM/WHM: host memory) takes one request a
+    cycle, picked round-robin like the hardware arbiters; the cores that lose wait a cycle.
+    '''
+
+    PORTS = { 'RW' : 'weights', 'RHM' : 'host', 'WHM' : 'host' }
+
+    def __init__(self, cfg, weights_model=None, host_model=None):
+        self.cfg = cfg
+        self.weights_model = weights_model or MemoryModel(beat_bytes=cfg.WEIGHT_DRAM_BEAT_BYTES)
+        self.host_model = host_model or MemoryModel(beat_bytes=cfg.HOST_VECS_PER_BEAT*cfg.VECSIZE*cfg.DWIDTH//8)
+        self.cores = []
+        self.halted = None  # cycle the last core halts
+
+    def run(self, programs):
+        '''Issue the decoded programs, one per core, until every core has halted.'''
+        n = len(programs)
+        self.cores = [ TimingModel(self.cfg, self.weights_model, self.host_model) for p in programs ]
+        pcs = [0] * n
+        first = { 'weights' : 0, 'host' : 0 }  # core each arbiter looks at first
+        granted = { 'weights' : -1, 'host' : -1 }  # last cycle each port took a request
+        while True:
+            # Issue the instruction that can go first; in a tie for a port, the one the arbiter picks
+            candidates = []
+            for k, core in enumerate(self.cores):
+                if core.halted is not None:
+                    continue
+                instr = programs[k][pcs[k]]
+                t = core.ready(*instr)
+                port = self.PORTS.get(instr[0])
+                rank = 0
+                if port:
+                    t = max(t, granted[port] + 1)
+                    rank = (k - first[port]) % n
+                candidates.append((t, rank, k, port, instr))
+            if not candidates:
+                break
+            t, _, k, port, instr = min(candidates)
+            self.cores[k].issue(*instr, t=t)
+            pcs[k] += 1
+            if port:
+                granted[port] = t
+                first[port] = (k + 1) % n
+        self.halted = max(core.halted for core in self.cores)
+        return self.halted
+
+    def summary(self):
+        if len(self.cores) == 1:
+            return self.cores[0].summary()
+        return '; '.join('core {}: {}'.format(k, core.summary()) for k, core in enumerate(self.cores))
 
 
 class TPUSim(object):
-    def __init__(self, program_filename, dram_filename, hostmem_filename):
-        # TODO: switch b/w 32-bit float vs int
-        self.program = open(program_filename, 'rb')
-        self.weight_memory = np.load(dram_filename)
-        self.host_memory = np.load(hostmem_filename)
-        if not args.raw:
-            assert self.weight_memory.dtype == np.int8, 'DRAM weight mem is not 8-bit ints'
-            assert self.host_memory.dtype == np.int8, 'Hostmem not 8-bit ints'
-        self.unified_buffer = (np.zeros((96000, WIDTH), dtype=np.float32) if args.raw else
-            np.zeros((96000, WIDTH), dtype=np.int8))
-        self.accumulator = (np.zeros((4000, WIDTH), dtype=np.float32) if args.raw else
-            np.zeros((4000, WIDTH), dtype=np.int32))
+    def __init__(self, program_filename, dram_filename, hostmem_filename, cfg=None, raw=False, verbose=True, weights_model=None, host_model=None, core_programs=()):
+        self.cfg = cfg if cfg is not None else Config()
+        self.raw = raw
+        self.verbose = verbose
+        self.width = self.cfg.VECSIZE  # of a UB vector; the accumulators have MAT_COLS elements
+        # One program per core; cores without one of their own run program_filename
+        self.programs = [ self.load(path) for path in [program_filename] + list(core_programs) ]
+        if len(self.programs) > self.cfg.NUM_CORES:
+            raise ValueError('{} programs for {} cores'.format(len(self.programs), self.cfg.NUM_CORES))
+        self.programs += [self.programs[0]] * (self.cfg.NUM_CORES - len(self.programs))
+        self.check_shared_rows()
+        # The memories and programs may also be given as arrays and decoded programs, to keep a model resident
+        self.weight_memory = np.load(dram_filename) if isinstance(dram_filename, str) else dram_filename
+        self.host_memory = np.load(hostmem_filename) if isinstance(hostmem_filename, str) else hostmem_filename
+        if not raw:
+            dtype = self.cfg.INT_DTYPE
+            assert self.weight_memory.dtype == dtype, 'DRAM weight mem is not {} ints'.format(dtype)
+            assert self.host_memory.dtype == dtype, 'Hostmem not {} ints'.format(dtype)
+        self.mmc_stats = []  # (core, ub_addr, length, activation sparsity, weight sparsity, zero MACs) per MMC
+        self.core = 0
+        self.executed = 0  # instructions, over all cores
+        self.finished = False
+        self.reset_core()
+        self.timing = MultiCoreTiming(self.cfg, weights_model, host_model)
+        self.ideal_timing = MultiCoreTiming(self.cfg)  # same programs with the default memories
+
+    def check_shared_rows(self):
+        '''Refuse programs whose cores share host memory rows that one of them writes.
+
+        run() executes the cores one after the other, so a core reading what another writes,
+        or two cores writing different values to the same rows, would not see the order the
+        hardware's timing gives them. Cores running the same program write the same values.
+        '''
+        transfers = [ [ (opcode, addr, addr + length) for opcode, addr, _, length, _ in program if opcode in ('RHM', 'WHM') and length ]
+                      for program in self.programs ]
+        for k, j in itertools.permutations(range(len(self.programs)), 2):
+            same = self.programs[k] == self.programs[j]
+            for opcode, lo, hi in transfers[k]:
+                if opcode != 'WHM':
+                    continue
+                for other, lo2, hi2 in transfers[j]:
+                    if lo < hi2 and lo2 < hi and (other == 'RHM' or not same):
+                        raise ValueError('Core {} writes host memory rows {}..{} that core {} {}; sim.py runs the cores one after '
+                                         'the other, so it cannot order their transfers'.format(k, max(lo, lo2), min(hi, hi2) - 1, j,
+                                                                                              'reads' if other == 'RHM' else 'writes'))
+
+    def reset_core(self):
+        '''Clear the state private to a core: its UB, accumulators and weight FIFO.'''
+        self.pc = 0
+        self.unified_buffer = (np.zeros((96000, self.width), dtype=np.float32) if self.raw else
+            np.zeros((96000, self.width), dtype=self.cfg.INT_DTYPE))
+        self.accumulator = (np.zeros((4000, self.cfg.MAT_COLS), dtype=np.float32) if self.raw else
+            np.zeros((4000, self.cfg.MAT_COLS), dtype=self.cfg.ACC_DTYPE))
         self.weight_fifo = deque()
+        self.weights = None  # tile in use by the matrix unit
+        self.lut = np.zeros(2**self.cfg.ACT_LUT_BITS, dtype=np.int64)  # activation table, in lut_index order
+        self.bias = np.zeros(self.cfg.MAT_COLS, dtype=self.accumulator.dtype)  # added to the accumulators by ACT.B
+
+    def log(self, *msg):
+        if self.verbose:
+            print(*msg)
+
+    def run(self, stop=None):
+        '''Run the programs until they halt, or pause once stop instructions have executed.
 
-    def run(self):
-        # load program and execute instructions
+        A paused run (self.finished is False) goes on from where it stopped with another
+        run(), also after restore(); a finished one starts over. Returns the host memory.
+        '''
+        if self.finished:
+            self.core, self.executed, self.finished = 0, 0, False
+            self.reset_core()
+        # The cores only share the memories, and check_shared_rows() keeps them from depending
+        # on each other's host memory writes, so their programs run one after the other
+        start = self.core
+        for core in range(start, len(self.programs)):
+            if core > start:
+                self.log('Core {}'.format(core))
+                self.reset_core()
+            self.core = core
+            if not self.run_core(self.programs[core], stop):
+                return self.host_memory
+        self.finished = True
+        self.timing.run(self.programs)
+        self.ideal_timing.run(self.programs)
+        return self.host_memory
+
+    def run_core(self, program, stop=None):
+        '''Execute instructions until HLT (True) or until stop instructions have executed (False).'''
         while True:
-            instruction = self.decode()
-            opcode, operands = instruction[0], instruction[1:]
+            if stop is not None and self.executed >= stop:
+                return False
+            opcode, addr, ubaddr, length, flag = program[self.pc]
+            self.pc += 1
+            self.executed += 1
             if opcode in ['RHM', 'WHM', 'RW']:
-                self.memops(opcode, *operands)
+                self.memops(opcode, addr, ubaddr, length, flag)
             elif opcode == 'MMC':
-                self.matrix_multiply_convolve(*operands)
+                self.matrix_multiply_convolve(ubaddr, addr, length, flag)
             elif opcode == 'ACT':
-                self.act(*operands)
+                self.act(addr, ubaddr, length, flag)
+            elif opcode == 'LUT':
+                self.load_lut(ubaddr, addr, length)
+            elif opcode == 'BIAS':
+                self.load_bias(ubaddr, addr)
             elif opcode == 'SYNC':
-                pass
+                pass  # memory operations complete immediately here; the timing model accounts for the wait
             elif opcode == 'NOP':
                 pass
             elif opcode == 'HLT':
-                print('H A L T')
-                break
+                self.log('H A L T')
+                return True
             else:
                 raise Exception('WAT (╯°□°）╯︵ ┻━┻')
 
-        # all done, exit
-        savepath = 'sim32.npy' if args.raw else 'sim8.npy'
-        np.save(savepath, self.host_memory)
-        print(self.host_memory.astype('uint8'))
-        self.program.close()
+    @property
+    def cycles(self):
+        '''Estimated cycles on the hardware, and how many of them are lost to memory stalls.'''
+        return self.timing.halted, self.timing.halted - self.ideal_timing.halted
 
-        print("""ALL DONE!
-        (•_•)
-        ( •_•)>⌐■-■
-        (⌐■_■)""")
+    def fingerprint(self):
+        '''Hash of the programs, configuration and mode, which a checkpoint must match to restore.'''
+        return hashlib.sha256(repr((self.programs, self.cfg.key(), self.raw)).encode()).hexdigest()
 
-    def decode(self):
-        opcode = int.from_bytes(self.program.read(isa.OP_SIZE), byteorder='big')
-        opcode = isa.BIN2OPCODE[opcode]
+    def checkpoint(self, path):
+        '''Save the state of the run to a compressed .npz: host memory, the running core's UB,
+        accumulators, weight FIFO, tile in use, LUT and bias, and where it is in the programs.
+        The weight DRAM is not saved; it never changes.'''
+        tile = (self.cfg.MAT_ROWS, self.cfg.MAT_COLS)
+        fifo = np.array(self.weight_fifo) if self.weight_fifo else np.zeros((0,) + tile, dtype=self.weight_memory.dtype)
+        np.savez_compressed(path, fingerprint=self.fingerprint(), host_memory=self.host_memory,
+                            unified_buffer=self.unified_buffer, accumulator=self.accumulator, weight_fifo=fifo,
+                            weights=np.array([self.weights]) if self.weights is not None else np.zeros((0,) + tile, dtype=fifo.dtype),
+                            lut=self.lut, bias=self.bias, mmc_stats=np.array(self.mmc_stats, dtype=np.float64).reshape(-1, 6),
+                            position=np.array([self.core, self.pc, self.executed, self.finished]))
 
-        flag = int.from_bytes(self.program.read(isa.FLAGS_SIZE), byteorder='big')
-        length = int.from_bytes(self.program.read(isa.LEN_SIZE), byteorder='big')
-        src_addr = int.from_bytes(self.program.read(isa.ADDR_SIZE), byteorder='big')
-        dest_addr = int.from_bytes(self.program.read(isa.UB_ADDR_SIZE), byteorder='big')
-        #print('{} decoding: len {}, flags {}, src {}, dst {}'.format(opcode, length, flag, src_addr, dest_addr))
-        return opcode, src_addr, dest_addr, length, flag
+    def restore(self, path):
+        '''Load the state saved by checkpoint(), which must be of the same programs and configuration.'''
+        with np.load(path) as state:
+            if str(state['fingerprint']) != self.fingerprint():
+                raise ValueError('Checkpoint {} is of other programs or another configuration'.format(path))
+            self.host_memory = state['host_memory']
+            self.unified_buffer = state['unified_buffer']
+            self.accumulator = state['accumulator']
+            self.weight_fifo = deque(state['weight_fifo'])
+            self.weights = state['weights'][0] if len(state['weights']) else None
+            self.lut = state['lut']
+            self.bias = state['bias']
+            self.mmc_stats = [ (int(s[0]), int(s[1]), int(s[2])) + tuple(s[3:]) for s in state['mmc_stats'] ]
+            self.core, self.pc, self.executed, finished = [ int(v) for v in state['position'] ]
+            self.finished = bool(finished)
+
+    def load(self, program):
+        return load_program(program) if isinstance(program, str) else list(program)
 
     # opcodes
     def act(self, src, dest, length, flag):
-        print('ACTIVATE!')
+        self.log('ACTIVATE!')
 
         result = self.accumulator[src:src+length]
-        if flag & isa.FUNC_RELU_MASK:
-            print('  RELU!!!!')
+        if flag & isa.BIAS_MASK and self.cfg.ACT_BIAS:
+            self.log('  + BIAS')
+            result = result + self.bias  # wraps around like the accumulators
+        if flag & isa.ACT_FUNC_MASK == isa.FUNC_LUT_MASK:
+            self.log('  LOOKUP TABLE')
+            bits = self.cfg.ACT_LUT_BITS
+            if bits:
+                idx = np.clip(np.asarray(result, dtype=np.int64) >> self.cfg.ACT_LUT_SHIFT, -2**(bits-1), 2**(bits-1) - 1)
+                result = self.lut[idx % 2**bits]
+            vfunc = np.vectorize(lambda x: x)
+        elif flag & isa.FUNC_RELU_MASK:
+            self.log('  RELU!!!!')
             vfunc = np.vectorize(lambda x: 0 * x if x < 0. else x)
         elif flag & isa.FUNC_SIGMOID_MASK:
-            print('  SIGMOID')
-            vfunc = np.vectorize(lambda x: int(255./(1.+exp(-x))))
+            self.log('  SIGMOID')
+            vfunc = lambda x: sigmoid(x, self.cfg.DWIDTH, self.raw)
         else:
             vfunc = np.vectorize(lambda x: x)
             #raise Exception('(╯°□°）╯︵ ┻━┻ bad activation function!')
 
         result = vfunc(result)
 
-        # downsample/normalize if needed
-        if not args.raw:
-            result = [v & 0x000000FF for v in result]
-        self.unified_buffer[dest:dest+length] = result
+        # downsample/normalize if needed: keep the low DWIDTH bits, as a signed value
+        if not self.raw:
+            sign = 1 << (self.cfg.DWIDTH - 1)
+            result = ((np.asarray(result, dtype=np.int64) & (2*sign - 1)) ^ sign) - sign
+        self.unified_buffer[dest:dest+length] = 0  # vectors wider than a row of results are zero-padded
+        self.unified_buffer[dest:dest+length, :self.cfg.MAT_COLS] = result
 
-    def memops(self, opcode, src_addr, dest_addr, length, flag):
-        print('Memory xfer! host: {} unified buffer: {}: length: {} (FLAGS? {})'.format(
-            src_addr, dest_addr, length, flag
+    def load_lut(self, src, row, length):
+        self.log('LOAD LUT! unified buffer: {} row: {} length: {}'.format(src, row, length))
+        entries, rows = self.cfg.ACT_LUT_SHAPE
+        if self.cfg.ACT_LUT_BITS:
+            for i in range(length):
+                r = (row + i) % rows
+                self.lut[r*entries:(r+1)*entries] = self.unified_buffer[src+i, :entries]
+
+    def load_bias(self, src, shift):
+        self.log('LOAD BIAS! unified buffer: {} shift: {}'.format(src, shift))
+        vec = self.unified_buffer[src, :self.cfg.MAT_COLS]
+        if self.raw:
+            self.bias = vec * 2.**shift
+        else:
+            width = self.cfg.ACC_WIDTH
+            sign = 1 << (width - 1)
+            self.bias[:] = [ (((int(x) << shift) & (2*sign - 1)) ^ sign) - sign for x in vec ]
+
+    def memops(self, opcode, addr, ubaddr, length, flag):
+        self.log('Memory xfer! host: {} unified buffer: {}: length: {} (FLAGS? {})'.format(
+            addr, ubaddr, length, flag
         ))
 
         if opcode == 'RHM':
-            print('  read host memory to unified buffer')
-            self.unified_buffer[dest_addr:dest_addr + length] = self.host_memory[src_addr:src_addr + length]
+            self.log('  read host memory to unified buffer')
+            self.unified_buffer[ubaddr:ubaddr + length] = self.host_memory[addr:addr + length]
         elif opcode == 'WHM':
-            print('  write unified buffer to host memory')
-            self.host_memory[dest_addr:dest_addr + length] = self.unified_buffer[src_addr:src_addr + length]
+            self.log('  write unified buffer to host memory')
+            self.host_memory[addr:addr + length] = self.unified_buffer[ubaddr:ubaddr + length]
         elif opcode == 'RW':
-            print('  read weights from DRAM into MMU')
-            self.weight_fifo.append(self.weight_memory[src_addr])
+            self.log('  read weights from DRAM into MMU')
+            self.weight_fifo.append(self.weight_memory[addr])
         else:
             raise Exception('WAT (╯°□°）╯︵ ┻━┻')
 
     def matrix_multiply_convolve(self, ub_addr, accum_addr, size, flags):
-        print('Matrix things....')
-        print('  UB@{} + {} -> MMU -> accumulator@{} + {}'.format(
+        self.log('Matrix things....')
+        self.log('  UB@{} + {} -> MMU -> accumulator@{} + {}'.format(
             ub_addr, size, accum_addr, size
         ))
 
-        inp = self.unified_buffer[ub_addr: ub_addr + size]
-        print('MMC input shape: {}'.format(inp.shape))
-        weight_mat = self.weight_fifo.popleft()
-        print('MMC weight: {}'.format(weight_mat))
-        if not args.raw:
-            inp = inp.astype(np.int32)
-            weight_mat = weight_mat.astype(np.int32)
+        inp = self.unified_buffer[ub_addr: ub_addr + size, :self.cfg.MAT_ROWS]  # an element per array row
+        self.log('MMC input shape: {}'.format(inp.shape))
+        if flags & isa.SWITCH_MASK or self.weights is None:
+            self.weights = self.weight_fifo.popleft()  # switch to the next tile
+        weight_mat = self.weights
+        self.log('MMC weight: {}'.format(weight_mat))
+        if not self.raw:
+            inp = inp.astype(self.cfg.ACC_DTYPE)
+            weight_mat = weight_mat.astype(self.cfg.ACC_DTYPE)
         out = np.matmul(inp, weight_mat)
-        print('MMC output shape: {}'.format(out.shape))
+        self.log('MMC output shape: {}'.format(out.shape))
+        self.record_sparsity(ub_addr, inp, weight_mat)
         overwrite = isa.OVERWRITE_MASK & flags
         if overwrite:
             self.accumulator[accum_addr:accum_addr + size] = out
         else:
             self.accumulator[accum_addr:accum_addr + size] += out
 
+    def record_sparsity(self, ub_addr, inp, weight_mat):
+        '''Note the fraction of zero activations, zero weights and MACs with a zero operand in an MMC.'''
+        act_nonzero, weight_nonzero = inp != 0, weight_mat != 0
+        # A MAC does useful work only when both of its operands are nonzero
+        useful = np.matmul(act_nonzero.astype(np.int64), weight_nonzero.astype(np.int64)).sum()
+        macs = inp.shape[0] * weight_mat.size
+        self.mmc_stats.append((self.core, ub_addr, inp.shape[0], 1 - act_nonzero.mean(), 1 - weight_nonzero.mean(), 1 - useful / max(1, macs)))
+
+    def sparsity(self):
+        '''Activation sparsity, weight sparsity and fraction of zero-operand MACs over the whole run.
+
+        Sparsities are weighted by the MACs of each MMC, so they describe the work the MM array did.
+        '''
+        if not self.mmc_stats:
+            return 0., 0., 0.
+        macs = np.array([ length for _, _, length, _, _, _ in self.mmc_stats ], dtype=np.float64)
+        stats = np.array([ s[3:] for s in self.mmc_stats ])
+        return tuple(np.average(stats, axis=0, weights=macs))
+
+
+def lut_vectors(func, cfg):
+    '''Host memory vectors holding an activation table, for RHM and then LUT src, 0, len(vectors).
+
+    func maps a table index, the accumulator value shifted right by ACT_LUT_SHIFT and saturated
+    to ACT_LUT_BITS signed bits, to a signed DWIDTH-bit result.
+    '''
+    entries, rows = cfg.ACT_LUT_SHAPE
+    size = entries * rows
+    table = [ func(i - size if i >= size // 2 else i) for i in range(size) ]
+    vecs = np.zeros((rows, cfg.VECSIZE), dtype=cfg.INT_DTYPE)
+    vecs[:, :entries] = np.reshape(table, (rows, entries))
+    return vecs
+
 def parse_args():
     global args
 
@@ -141,9 +545,41 @@ def parse_args():
                         help='Path to host file.')
     parser.add_argument('dram_file', action='store',
                         help='Path to dram file.')
+    parser.add_argument('--core-program', action='append', metavar='PROGRAM', default=[],
+                        help='With NUM_CORES > 1, the program for the next core (repeatable: cores 1, 2, ...). Cores without one run the main program.')
     parser.add_argument('--raw', action='store_true', default=False,
                         help='Gen sim32.npy instead of sim8.npy.')
+    parser.add_argument('--sparsity', action='store_true', default=False,
+                        help='Print the activation and weight sparsity of every MMC.')
+    parser.add_argument('--config', action='append', metavar='NAME=VALUE', default=[],
+                        help='Override a hardware parameter from config.py, e.g. --config MATSIZE=8 (repeatable).')
+    parser.add_argument('--weights-mem', metavar='SPEC', default='',
+                        help='Weight DRAM timing for the cycle estimate, e.g. latency=40,bandwidth=32,burst=4,jitter=8 (same format as runtpu.py).')
+    parser.add_argument('--host-mem', metavar='SPEC', default='',
+                        help='Host memory timing for the cycle estimate, in the same format.')
+    parser.add_argument('--mem-seed', type=int, default=0, help='Seed for the memory latency jitter.')
+    parser.add_argument('--stop-after', type=int, metavar='N', default=None,
+                        help='Pause after N instructions and save the state to --checkpoint.')
+    parser.add_argument('--checkpoint', metavar='FILE', default='checkpoint.npz',
+                        help='Where --stop-after saves the state (default checkpoint.npz).')
+    parser.add_argument('--restore', metavar='FILE', default=None,
+                        help='Go on from the state saved in FILE, by a run of the same programs and configuration.')
+    parser.add_argument('--energy', action='store_true', default=False,
+                        help='Estimate the energy of the run from its operation counts (see energy.py).')
+    parser.add_argument('--area', type=float, metavar='MM2', default=None,
+                        help='Design area for the leakage part of --energy, e.g. from runtpu.py --energy. Default: no leakage.')
+    parser.add_argument('--clock-mhz', type=float, default=700.,
+                        help='Clock for the leakage part of --energy (default 700).')
+    parser.add_argument('--inferences', type=int, default=None,
+                        help='Inferences the program runs, for the energy per inference; required with --energy.')
     args = parser.parse_args()
+    if args.energy and args.inferences is None:
+        parser.error('--energy needs --inferences: the inferences a program runs cannot be told from its host memory')
+    overrides = {}
+    for setting in args.config:
+        name, _, value = setting.partition('=')
+        overrides[name] = int(value, 0)
+    args.cfg = Config(**overrides)
 
 if __name__ == '__main__':
     if len(sys.argv) < 4:
@@ -151,5 +587,40 @@ if __name__ == '__main__':
         sys.exit(0)
     
     parse_args()
-    tpusim = TPUSim(args.program, args.dram_file, args.host_file)
-    tpusim.run()
+    cfg = args.cfg
+    weights_model = MemoryModel.from_spec(args.weights_mem, beat_bytes=cfg.WEIGHT_DRAM_BEAT_BYTES, seed=args.mem_seed)
+    host_model = MemoryModel.from_spec(args.host_mem, beat_bytes=cfg.HOST_VECS_PER_BEAT*cfg.VECSIZE*cfg.DWIDTH//8, seed=args.mem_seed + 1)
+    tpusim = TPUSim(args.program, args.dram_file, args.host_file, cfg=cfg, raw=args.raw, weights_model=weights_model, host_model=host_model, core_programs=args.core_program)
+    if args.restore:
+        tpusim.restore(args.restore)
+        print('Restored {} at core {}, pc {} ({} instructions executed)'.format(args.restore, tpusim.core, tpusim.pc, tpusim.executed))
+    host_memory = tpusim.run(stop=args.stop_after)
+    if not tpusim.finished:
+        tpusim.checkpoint(args.checkpoint)
+        print('Paused at core {}, pc {} ({} instructions executed); saved the state to {}'.format(tpusim.core, tpusim.pc, tpusim.executed, args.checkpoint))
+        sys.exit(0)
+
+    # all done, exit
+    savepath = 'sim32.npy' if args.raw else 'sim8.npy'
+    np.save(savepath, host_memory)
+    print(host_memory if args.raw else host_memory.astype(np.int64) & (2**cfg.DWIDTH - 1))
+
+    cycles, memory_stalls = tpusim.cycles
+    print('Estimated hardware cycles: {} ({} lost to memory stalls)'.format(cycles, memory_stalls))
+    print('  ' + tpusim.timing.summary())
+    if args.sparsity:
+        print('MMC sparsity (zero activations, zero weights, zero-operand MACs):')
+        for core, ub_addr, length, act, weight, macs in tpusim.mmc_stats:
+            print('  {}UB@{} x {}: {:.1%} {:.1%} {:.1%}'.format('core {} '.format(core) if cfg.NUM_CORES > 1 else '', ub_addr, length, act, weight, macs))
+    print('Sparsity: {:.1%} of activations, {:.1%} of weights and {:.1%} of MACs have a zero operand'.format(*tpusim.sparsity()))
+    if args.energy:
+        import energy
+        counts = energy.op_counts(tpusim.programs, cfg, tpusim.mmc_stats)
+        print('Operations: ' + ', '.join('{} {}'.format(k, v) for k, v in sorted(counts.items())))
+        static = energy.static_pj(args.area, cycles, args.clock_mhz) if args.area else None
+        print(energy.report(energy.op_energy(counts, cfg), args.inferences, static))
+
+    print("""ALL DONE!
+        (•_•)
+        ( •_•)>⌐■-■
+        (⌐■_■)""")
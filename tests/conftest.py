@@ -0,0 +1,109 @@
+'''
+Shared helpers for the tests: workloads from gen_workload.py, run on sim.py and on the
+RTL through runtpu.py.
+
+    python3 -m pytest tests
+'''
+
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+import gen_workload
+import sim
+
+
+class Workload(object):
+    '''A gen_workload.py workload written to a directory, with its manifest.'''
+
+    def __init__(self, directory, cfg, layers, batch, acts=None, **kwargs):
+        self.cfg = cfg
+        self.prefix = os.path.join(str(directory), 'w')
+        self.manifest = gen_workload.generate(self.prefix, cfg, layers, batch, acts, **kwargs)
+
+    @property
+    def program(self):
+        return self.prefix + '.out'
+
+    def path(self, suffix):
+        return self.prefix + suffix
+
+    def load(self, suffix):
+        return np.load(self.prefix + suffix)
+
+    def outputs(self, hostmem):
+        '''The outputs in a final host memory, a row per input.'''
+        return gen_workload.outputs(hostmem, self.manifest)
+
+
+@pytest.fixture
+def workload(tmp_path):
+    '''workload(cfg, layers, batch, ...) generates a workload (see Workload) in a fresh directory.'''
+    return lambda cfg, layers, batch, acts=None, **kwargs: Workload(tmp_path, cfg, layers, batch, acts, **kwargs)
+
+
+def run_sim(w, raw=False, **kwargs):
+    '''Run a Workload on sim.py; returns the TPUSim after the run.'''
+    suffix = '_raw.npy' if raw else '.npy'
+    tpusim = sim.TPUSim(w.program, w.path('_weights' + suffix), w.path('_host' + suffix), cfg=w.cfg, raw=raw, verbose=False, **kwargs)
+    tpusim.run()
+    return tpusim
+
+
+def unpack(hostmem, rows, cfg):
+    '''runtpu.py's host memory, a dict of packed vectors, as a rows x VECSIZE array.'''
+    bits = cfg.DWIDTH
+    out = np.zeros((rows, cfg.VECSIZE), dtype=np.int64)
+    for a in range(rows):
+        v = hostmem.get(a, 0)
+        out[a] = [ (v >> (bits*k)) & (2**bits - 1) for k in range(cfg.VECSIZE) ]
+    return np.where(out >= 2**(bits - 1), out - 2**bits, out)
+
+
+def assemble(directory, lines):
+    '''Assemble a program given as lines of assembly (an HLT is added); returns the binary's path.'''
+    import assembler
+    path = os.path.join(str(directory), 'p.a')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines + ['HLT']) + '\n')
+    assembler.assemble(path, 0)
+    return path[:-2] + assembler.SUFFIX
+
+
+def run_rtl(cfg, program, hostarray, weightsarray, core_programs=(), trace='off', trace_args=None, **kwargs):
+    '''Run a program on the RTL design; returns the cycles, the final host memory as an array
+    shaped like hostarray, the performance counters and the tracer (see tracing.make_tracer,
+    which also takes trace_args).'''
+    import runtpu
+    import tracing
+    from tpu import build_tpu
+    bits = cfg.DWIDTH
+    hostmem = { a : runtpu.concat_vec(vec, bits) for a, vec in enumerate(hostarray) }
+    weightsmem = { a : runtpu.concat_tile(tile, bits) for a, tile in enumerate(weightsarray) }
+    ports = build_tpu(cfg)
+    tracer = tracing.make_tracer(trace, block=ports.block, cfg=cfg, **(trace_args or {}))
+    cycles, perf = runtpu.run(ports, runtpu.load_program(program, cfg), hostmem, weightsmem, tracer,
+                              core_instrs=[ runtpu.load_program(p, cfg) for p in core_programs ], **kwargs)
+    return cycles, unpack(hostmem, len(hostarray), cfg), perf, tracer
+
+
+def run_both(cfg, program, hostarray, weightsarray, core_programs=(), **kwargs):
+    '''Run a program on the RTL design and on sim.py, which must agree on the final host memory
+    and the cycle count; returns the cycles, the host memory and the performance counters.'''
+    cycles, hostmem, perf, _ = run_rtl(cfg, program, hostarray, weightsarray, core_programs, **kwargs)
+    tpusim = sim.TPUSim(program, weightsarray.copy(), hostarray.copy(), cfg=cfg, verbose=False, core_programs=core_programs)
+    assert np.array_equal(tpusim.run(), hostmem)
+    assert cycles == tpusim.cycles[0]
+    return cycles, hostmem, perf
+
+
+def run_rtl_workload(w, **kwargs):
+    '''Run a Workload on the RTL design; returns the cycles and the outputs.'''
+    cycles, hostmem, _, _ = run_rtl(w.cfg, w.program, w.load('_host.npy'), w.load('_weights.npy'), **kwargs)
+    return cycles, w.outputs(hostmem)
@@ -0,0 +1,91 @@
+'''
+The activate unit on hand-written programs: the lookup table, the bias registers and
+sigmoid, on the RTL and in sim.py, against numpy.
+'''
+
+import os
+
+import numpy as np
+import pytest
+
+import assembler
+from config import Config
+from conftest import run_rtl
+import sim
+
+N = 12  # input vectors
+OUT = 300  # host memory row of the outputs
+
+
+def run_both(tmp_path, cfg, lines, host, weights):
+    '''Run an assembly program on the RTL and on sim.py, which must agree on the final host
+    memory and the cycle count. Returns the outputs: N rows of MAT_COLS from row OUT.'''
+    path = os.path.join(str(tmp_path), 'p.a')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines + ['HLT']) + '\n')
+    assembler.assemble(path, 0)
+    program = path[:-2] + assembler.SUFFIX
+    cycles, hostmem, _, _ = run_rtl(cfg, program, host, weights)
+    tpusim = sim.TPUSim(program, weights.copy(), host.copy(), cfg=cfg, verbose=False)
+    assert np.array_equal(tpusim.run(), hostmem)
+    assert cycles == tpusim.cycles[0]
+    return hostmem[OUT:OUT + N, :cfg.MAT_COLS]
+
+
+def operands(cfg, seed=0, low=-8, high=8):
+    rng = np.random.RandomState(seed)
+    host = np.zeros((OUT + N, cfg.VECSIZE), dtype=cfg.INT_DTYPE)
+    host[:N] = rng.randint(low, high, (N, cfg.VECSIZE))
+    weights = rng.randint(low, high, (1, cfg.MAT_ROWS, cfg.MAT_COLS)).astype(cfg.INT_DTYPE)
+    acc = host[:N, :cfg.MAT_ROWS].astype(np.int64) @ weights[0].astype(np.int64)
+    return host, weights, acc
+
+
+def wrap(x, bits):
+    sign = 1 << (bits - 1)
+    return ((np.asarray(x, dtype=np.int64) & (2*sign - 1)) ^ sign) - sign
+
+
+def test_lookup_table(tmp_path):
+    cfg = Config(MATSIZE=4, ACT_LUT_SHIFT=1)
+    func = lambda i: max(-128, min(127, 3*i - 20))
+    table = sim.lut_vectors(func, cfg)
+    host, weights, acc = operands(cfg, low=-20, high=20)
+    host[100:100 + len(table)] = table
+    lines = ['RHM 0, 0, {}'.format(N), 'RHM 100, 16, {}'.format(len(table)), 'LUT 16, 0, {}'.format(len(table)),
+             'RW 0', 'MMC.SO 0, 0, {}'.format(N), 'ACT.L 0, 200, {}'.format(N), 'WHM 200, {}, {}'.format(OUT, N)]
+    out = run_both(tmp_path, cfg, lines, host, weights)
+    index = np.clip(acc >> 1, -128, 127)
+    assert np.array_equal(out, np.vectorize(func)(index))
+    assert (np.abs(acc) > 256).any()  # some indices saturate
+
+
+def test_lookup_table_left_out(tmp_path):
+    cfg = Config(MATSIZE=4, ACT_LUT_BITS=0)
+    host, weights, acc = operands(cfg, low=-20, high=20)
+    lines = ['RHM 0, 0, {}'.format(N), 'RW 0', 'MMC.SO 0, 0, {}'.format(N), 'ACT.L 0, 200, {}'.format(N), 'WHM 200, {}, {}'.format(OUT, N)]
+    assert np.array_equal(run_both(tmp_path, cfg, lines, host, weights), wrap(acc, 8))
+
+
+@pytest.mark.parametrize('act_bias', [True, False])
+def test_bias(tmp_path, act_bias):
+    cfg = Config(MATSIZE=4, ACT_BIAS=act_bias)
+    host, weights, acc = operands(cfg)
+    bias = np.array([3, -2, 7, -8])
+    host[100] = bias
+    lines = ['RHM 0, 0, {}'.format(N), 'RHM 100, 16, 1', 'BIAS 16, 3', 'RW 0', 'MMC.SO 0, 0, {}'.format(N),
+             'ACT.RB 0, 200, 6', 'ACT.B 6, 206, {}'.format(N - 6), 'WHM 200, {}, {}'.format(OUT, N)]
+    out = run_both(tmp_path, cfg, lines, host, weights)
+    biased = acc + (bias << 3 if act_bias else 0)  # the registers are left out without ACT_BIAS
+    biased[:6] = np.maximum(biased[:6], 0)
+    assert np.array_equal(out, wrap(biased, 8))
+
+
+def test_sigmoid(tmp_path):
+    cfg = Config(MATSIZE=4)
+    host, weights, acc = operands(cfg, low=-2, high=3)  # sums around -8 to 7, where the ROM is
+    lines = ['RHM 0, 0, {}'.format(N), 'RW 0', 'MMC.SO 0, 0, {}'.format(N), 'ACT.Q 0, 200, {}'.format(N), 'WHM 200, {}, {}'.format(OUT, N)]
+    out = run_both(tmp_path, cfg, lines, host, weights)
+    expected = np.where(acc < -8, 0, np.where(acc > 7, 255, np.ceil(255 / (1. + np.exp(-np.clip(acc, -8, 7))))))
+    assert np.array_equal(out, wrap(expected, 8))
+    assert (acc < 0).any() and (out[acc < 0] >= 0).all()  # below half the range, not saturated
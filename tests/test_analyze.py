@@ -0,0 +1,27 @@
+import os
+
+import analyze
+from config import Config
+from conftest import run_sim
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_bounds_and_estimate(workload):
+    w = workload(Config(MATSIZE=8), [20, 16, 8], 50, ['relu', 'none'])
+    program = analyze.load(w.program)
+    result = analyze.analyze([program], w.cfg)
+    tpusim = run_sim(w)
+    assert result['cycles'] == tpusim.cycles[0]
+    assert result['macs'] == sum(length for opcode, _, _, length, _ in program if opcode == 'MMC') * 64
+    assert all(bound <= result['cycles'] for bound in result['bounds'].values())
+    assert result['nop_cycles'] == 0  # generated programs have no NOPs
+    assert 0 < result['utilization'] <= result['utilization_bound'] <= 1
+
+
+def test_nop_padding_is_counted():
+    program = analyze.load(os.path.join(HERE, 'simplemult.a'))
+    result = analyze.analyze([program], Config(MATSIZE=8, INTERLOCK=False))
+    assert result['instructions']['NOP'] > 0
+    assert result['nop_cycles'] > 0
+    assert analyze.tile_vectors(program) == [8] * result['weight_tiles']
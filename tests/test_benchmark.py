@@ -0,0 +1,40 @@
+import json
+
+import numpy as np
+import pytest
+
+import assembler
+import benchmark
+from config import Config
+import gen_workload
+import isa
+import sim
+
+
+def test_assembler_rejects_oversized_fields():
+    assembler.format_instr(isa.OPCODE2BIN['MMC'][0], 0, 255, 0, 0)
+    with pytest.raises(Exception):
+        assembler.format_instr(isa.OPCODE2BIN['MMC'][0], 0, 256, 0, 0)  # would spill into the flags
+
+
+def test_large_batches_are_split(tmp_path):
+    cfg = Config(MATSIZE=8)
+    batch = 300  # more than one instruction's length
+    [(name, n, program, host, weights)] = [ case for case in benchmark.workloads(cfg, [batch], str(tmp_path)) if case[0] == 'mlp' ]
+    assert n == batch
+    result = benchmark.bench_sim(cfg, program, host, weights, batch, False, 1, str(tmp_path))
+    assert result['macs'] == batch * benchmark.MLP_LAYERS * cfg.MAT_ROWS * cfg.MAT_COLS
+    prefix = str(tmp_path.joinpath('mlp8_b{}'.format(batch)))
+    with open(prefix + '.json') as f:
+        manifest = json.load(f)
+    out = sim.TPUSim(program, weights, host.copy(), cfg=cfg, verbose=False).run()
+    assert np.array_equal(gen_workload.outputs(out, manifest), np.load(prefix + '_ref_int.npy'))
+
+
+def test_regressions():
+    case = dict(simulator='sim', workload='mlp', MATSIZE=8, batch=16, mode='int')
+    baseline = { 'results' : [dict(case, macs_per_sec=100., peak_rss_mb=50., cycles_per_sec=0)] }
+    assert benchmark.regressions([dict(case, macs_per_sec=85., peak_rss_mb=55.)], baseline, 0.2) == []
+    found = benchmark.regressions([dict(case, macs_per_sec=70., peak_rss_mb=70., cycles_per_sec=5.)], baseline, 0.2)
+    assert sorted(metric for _, metric, _, _ in found) == ['macs_per_sec', 'peak_rss_mb']
+    assert benchmark.regressions([dict(case, batch=32, macs_per_sec=1.)], baseline, 0.2) == []  # no such case before
@@ -0,0 +1,32 @@
+'''
+build_tpu elaborates each configuration into a Block of its own, leaving PyRTL's working
+block alone, so several designs can be built and simulated in one process.
+'''
+
+import numpy as np
+import pyrtl
+
+import runtpu
+import tpu
+import tracing
+from config import Config
+from conftest import unpack
+
+
+def test_configurations_coexist(workload):
+    pyrtl.reset_working_block()
+    one = workload(Config(MATSIZE=4), [6, 5, 3], 8, ['relu', 'none'])
+    two = workload(Config(MATSIZE=4, NUM_CORES=2), [6, 5, 3], 8, ['relu', 'none'])
+    designs = [ (w, tpu.build_tpu(w.cfg)) for w in (one, two) ]
+    assert designs[0][1].block is not designs[1][1].block
+    assert len(designs[1][1].imems) == 2 and len(designs[0][1].imems) == 1
+
+    # simulate both, the first again after the second was elaborated
+    for w, ports in designs:
+        hostmem = { a : runtpu.concat_vec(vec, w.cfg.DWIDTH) for a, vec in enumerate(w.load('_host.npy')) }
+        weightsmem = { a : runtpu.concat_tile(tile, w.cfg.DWIDTH) for a, tile in enumerate(w.load('_weights.npy')) }
+        runtpu.run(ports, runtpu.load_program(w.program, w.cfg), hostmem, weightsmem, tracing.make_tracer('off'))
+        assert np.array_equal(w.outputs(unpack(hostmem, len(w.load('_host.npy')), w.cfg)), w.load('_ref_int.npy'))
+
+    block = pyrtl.working_block()
+    assert not block.logic and not block.wirevector_set and not block.memblock_by_name
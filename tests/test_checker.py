@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import checker
+
+
+def spread(a, width):
+    '''a as hostmem: each row over consecutive rows of width elements, zero-padded.'''
+    per_row = -(-a.shape[1] // width)
+    out = np.zeros((a.shape[0], per_row * width), dtype=a.dtype)
+    out[:, :a.shape[1]] = a
+    return out.reshape(-1, width)
+
+
+def summary(result):
+    return (result.mismatches, result.first, result.worst, result.max_abs, result.max_ulp, result.histogram)
+
+
+def test_equal():
+    a = np.arange(60, dtype=np.int8).reshape(20, 3)
+    assert checker.compare(a, a.copy())
+    checker.equal(a, a.copy())
+
+
+@pytest.mark.parametrize('chunk', [1, 3, 4, 7, 100])
+def test_chunk_boundaries(chunk):
+    ref = np.zeros((20, 3), dtype=np.int32)
+    res = ref.copy()
+    res[3, 2] = 1  # the last row of a chunk of 4
+    res[4, 0] = -9  # the first of the next
+    res[19, 1] = 5  # the last row
+    result = checker.compare(ref, res, chunk=chunk)
+    assert not result
+    assert summary(result) == (3, (3, 2), (4, 0), 9, 0, { 0 : 1, 2 : 1, 3 : 1 })
+
+
+def test_width_locates_hostmem_rows():
+    ref = np.arange(50, dtype=np.int8).reshape(5, 10)
+    res = spread(ref, 4)
+    res[7, 1] += 1  # row 2 of the results spans hostmem rows 6-8
+    for chunk in (1, 2, 100):
+        result = checker.compare(ref, res, width=4, chunk=chunk)
+        assert result.mismatches == 1
+        assert result.first == (2, 5)
+        assert result.locate(result.first) == (7, 1)
+    with pytest.raises(ValueError):
+        checker.compare(ref, res[:-1], width=4)
+
+
+def test_ints_compare_as_bit_patterns():
+    ref = np.array([[-1, -128, 5]], dtype=np.int8)
+    assert checker.compare(ref, ref.astype(np.uint8))
+    wider = ref.astype(np.int16)
+    wider[0, 2] += 1
+    assert checker.compare(ref, wider).mismatches == 1
+
+
+def test_float_tolerances():
+    ref = np.array([[1., 2., np.nan]], dtype=np.float32)
+    res = ref.copy()
+    res[0, 0] = np.nextafter(np.float32(1.), np.float32(2.))
+    res[0, 1] = 2.01
+    assert checker.compare(ref, res).mismatches == 2  # NaNs agree with NaNs
+    assert checker.compare(ref, res, ulps=1).mismatches == 1
+    assert checker.compare(ref, res, atol=0.02)
+    assert checker.compare(ref, res).max_ulp > 1000
+
+
+def test_shape_mismatch():
+    with pytest.raises(ValueError):
+        checker.compare(np.zeros((3, 2)), np.zeros((2, 3)))
@@ -0,0 +1,70 @@
+'''
+Checkpoints: a run paused, saved and restored ends as an uninterrupted one does, in the
+functional simulator and on the RTL design.
+'''
+
+import numpy as np
+import pytest
+from pyrtl import PyrtlError
+
+import runtpu
+import sim
+import tpu
+import tracing
+from config import Config
+from conftest import run_sim, unpack
+
+
+def load_sim(w, cfg=None):
+    return sim.TPUSim(w.program, w.path('_weights.npy'), w.path('_host.npy'), cfg=cfg or w.cfg, verbose=False)
+
+
+def test_sim_round_trip(workload, tmp_path):
+    w = workload(Config(MATSIZE=4), [6, 5, 3], 12, ['relu', 'sigmoid'], chunk=5)
+    whole = run_sim(w)
+    for stop in (1, 7, len(whole.programs[0]) - 2):
+        paused = load_sim(w)
+        paused.run(stop=stop)
+        assert not paused.finished and paused.executed == stop
+        path = str(tmp_path / 'sim{}.npz'.format(stop))
+        paused.checkpoint(path)
+        resumed = load_sim(w)
+        resumed.restore(path)
+        resumed.run()
+        assert resumed.finished
+        assert np.array_equal(resumed.host_memory, whole.host_memory)
+        assert resumed.mmc_stats == whole.mmc_stats
+
+
+def test_sim_rejects_another_configuration(workload, tmp_path):
+    w = workload(Config(MATSIZE=4), [4, 4], 4, ['none'])
+    path = str(tmp_path / 'sim.npz')
+    paused = load_sim(w)
+    paused.run(stop=2)
+    paused.checkpoint(path)
+    with pytest.raises(ValueError, match='another configuration'):
+        load_sim(w, Config(MATSIZE=4, ACT_BIAS=True)).restore(path)
+
+
+def test_rtl_round_trip(workload, tmp_path):
+    # runtpu.py restores into the cached design: a fresh elaboration names its wires afresh
+    w = workload(Config(MATSIZE=4), [6, 5, 3], 8, ['relu', 'none'])
+    cache = str(tmp_path / 'cache')
+
+    def run(**kwargs):
+        ports = tpu.load_tpu(w.cfg, cache_dir=cache)
+        hostmem = { a : runtpu.concat_vec(vec, w.cfg.DWIDTH) for a, vec in enumerate(w.load('_host.npy')) }
+        weightsmem = { a : runtpu.concat_tile(tile, w.cfg.DWIDTH) for a, tile in enumerate(w.load('_weights.npy')) }
+        cycles, _ = runtpu.run(ports, runtpu.load_program(w.program, w.cfg), hostmem, weightsmem, tracing.make_tracer('off'), **kwargs)
+        return cycles, unpack(hostmem, len(w.load('_host.npy')), w.cfg)
+
+    cycles, hostmem = run()
+    path = str(tmp_path / 'rtl.npz')
+    stop = cycles // 2
+    assert run(checkpoint_at=stop, checkpoint_file=path, stop=stop)[0] == stop
+    resumed_cycles, resumed_hostmem = run(restore=path)
+    assert resumed_cycles == cycles
+    assert np.array_equal(resumed_hostmem, hostmem)
+    assert np.array_equal(w.outputs(resumed_hostmem), w.load('_ref_int.npy'))
+    with pytest.raises(PyrtlError, match='another design'):
+        runtpu.load_checkpoint(path, tpu.load_tpu(Config(MATSIZE=8), cache_dir=cache))
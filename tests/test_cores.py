@@ -0,0 +1,51 @@
+'''
+Several cores: a batch split between them, contending for the shared memory ports, and
+programs whose cores would pass data through host memory, which sim.py refuses.
+'''
+
+import numpy as np
+import pytest
+
+import gen_workload
+import sim
+from config import Config
+from conftest import assemble, run_both
+
+
+def test_split_batch_contends_for_ports(workload, tmp_path):
+    cfg = Config(MATSIZE=4, NUM_CORES=2, PERF_COUNTERS=True)
+    layers, acts, n = [6, 5, 3], ['relu', 'none'], 8
+    w = workload(cfg, layers, 2 * n, acts, chunk=n)
+    base = w.manifest['output_base']
+    ins, outs = gen_workload.blocks(layers[0], cfg), gen_workload.blocks(layers[-1], cfg)
+    halves = []
+    for k in range(2):
+        (tmp_path / str(k)).mkdir()
+        halves.append(assemble(tmp_path / str(k), gen_workload.chunk_program(cfg, layers, acts, n, k * n * ins, base + k * n * outs)))
+    host, weights = w.load('_host.npy'), w.load('_weights.npy')
+
+    cycles, hostmem, perf = run_both(cfg, halves[0], host, weights, core_programs=halves[1:])
+    assert np.array_equal(w.outputs(hostmem), w.load('_ref_int.npy'))
+    assert perf['core1_stall'] > 0
+
+    # One half alone, with core 1 halting at once: the ports are all core 0's
+    halt = assemble(tmp_path, [])
+    alone = sim.TPUSim(halves[0], weights, host.copy(), cfg=cfg, verbose=False, core_programs=[halt])
+    alone.run()
+    assert alone.cycles[0] < cycles < 2 * alone.cycles[0]
+
+
+@pytest.mark.parametrize('core1, error', [
+    (['RHM 40, 0, 4'], 'core 1 reads'),  # a layer split: core 1 reads core 0's outputs
+    (['RHM 0, 0, 4', 'WHM 0, 42, 4'], 'core 1 writes'),  # different values into the same rows
+])
+def test_shared_rows_refused(tmp_path, core1, error):
+    cfg = Config(MATSIZE=4, NUM_CORES=2)
+    (tmp_path / 'a').mkdir()
+    core0 = assemble(tmp_path / 'a', ['RHM 0, 0, 4', 'WHM 0, 40, 4'])
+    host = np.zeros((50, 4), dtype=cfg.INT_DTYPE)
+    weights = np.zeros((1, 4, 4), dtype=cfg.INT_DTYPE)
+    with pytest.raises(ValueError, match=error):
+        sim.TPUSim(core0, weights, host, cfg=cfg, verbose=False, core_programs=[assemble(tmp_path, core1)])
+    # the same program on both cores writes the same values
+    sim.TPUSim(core0, weights, host, cfg=cfg, verbose=False).run()
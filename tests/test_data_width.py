@@ -0,0 +1,39 @@
+'''
+Datapath widths other than 8 bits: operands at the ends of their range, accumulators of
+ACC_WIDTH = 4*DWIDTH bits, and results cut to DWIDTH bits by ACT.
+'''
+
+import numpy as np
+import pytest
+
+from config import Config
+from conftest import assemble, run_both
+from gen_workload import wrap
+
+N = 8  # input vectors
+
+
+@pytest.mark.parametrize('dwidth', [4, 8, 16])
+def test_extreme_operands(tmp_path, dwidth):
+    cfg = Config(MATSIZE=4, DWIDTH=dwidth)
+    assert cfg.ACC_WIDTH == 4 * dwidth
+    low, high = -2**(dwidth - 1), 2**(dwidth - 1) - 1
+    rng = np.random.RandomState(dwidth)
+    host = np.zeros((40 + 2 * N, 4), dtype=cfg.INT_DTYPE)
+    host[:N] = rng.choice([low, high, -1, 0, 1], (N, 4))
+    host[0] = low  # the largest products: low * low, over every row
+    weights = rng.choice([low, high, -1, 1], (2, 4, 4)).astype(cfg.INT_DTYPE)
+    weights[:, :, 0] = low
+    lines = ['RHM 0, 0, {}'.format(N), 'RW 0', 'RW 1', 'MMC.SO 0, 0, {}'.format(N), 'MMC.S 0, 0, {}'.format(N),
+             'ACT 0, 100, {}'.format(N), 'ACT.R 0, 108, {}'.format(N), 'WHM 100, 40, {}'.format(2 * N)]
+    _, hostmem, _ = run_both(cfg, assemble(tmp_path, lines), host, weights)
+    x = host[:N].astype(np.int64)
+    acc = x @ weights[0] + x @ weights[1]
+    assert acc.max() == 8 * low**2 and np.abs(acc).max() < 2**(cfg.ACC_WIDTH - 1)  # no accumulator overflow
+    assert np.array_equal(hostmem[40:40 + N], wrap(acc, dwidth))
+    assert np.array_equal(hostmem[40 + N:], wrap(np.maximum(acc, 0), dwidth))
+
+
+def test_unsupported_width():
+    with pytest.raises(ValueError, match='DWIDTH must be one of'):
+        Config(DWIDTH=12)
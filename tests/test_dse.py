@@ -0,0 +1,59 @@
+'''
+The design-space exploration runner: sweep expansion, the Pareto marking, and results
+cached so a rerun does not evaluate a point again.
+'''
+
+import multiprocessing
+import os
+
+import pytest
+
+import dse
+import tpu
+from config import Config
+
+
+def test_sweep_points():
+    points = list(dse.sweep_points([('MATSIZE', [4, 8]), ('DWIDTH', [8, 16])], { 'NUM_CORES' : 2, 'MATSIZE' : 16 }))
+    assert points == [
+        { 'NUM_CORES' : 2, 'MATSIZE' : 4, 'DWIDTH' : 8 },
+        { 'NUM_CORES' : 2, 'MATSIZE' : 4, 'DWIDTH' : 16 },
+        { 'NUM_CORES' : 2, 'MATSIZE' : 8, 'DWIDTH' : 8 },
+        { 'NUM_CORES' : 2, 'MATSIZE' : 8, 'DWIDTH' : 16 },
+    ]
+    assert list(dse.sweep_points([], { 'MATSIZE' : 4 })) == [{ 'MATSIZE' : 4 }]
+    assert dse.parse_setting('MATSIZE=8,0x10') == ('MATSIZE', [8, 16])
+
+
+def test_pareto():
+    result = lambda logic, mem, freq, ips: { 'logic_area' : logic, 'mem_area' : mem, 'max_freq' : freq, 'inferences_per_sec' : ips }
+    results = [
+        result(1., 1., 100., 10.),  # smallest
+        result(2., 1., 100., 20.),  # bigger, but faster
+        result(2., 1., 90., 20.),  # beaten by the one above on frequency
+        result(3., 1., 100., 20.),  # beaten on area
+        result(1., 1., 100., 10.),  # ties with the first: neither beats the other
+        result(0.5, 0.5, 50., None),  # no cycle count, but the smallest
+    ]
+    dse.pareto(results)
+    assert [ r['pareto'] for r in results ] == [True, True, False, False, True, True]
+
+
+def test_cached_point_is_not_evaluated_again(workload, tmp_path, monkeypatch):
+    w = workload(Config(MATSIZE=2), [2, 2], 2, ['none'])
+    job = ({ 'MATSIZE' : 2 }, (w.program, w.path('_host.npy'), w.path('_weights.npy')), str(tmp_path / 'cache'))
+    pool = multiprocessing.Pool(1)
+    try:
+        result, = pool.map(dse.evaluate, [job])
+    finally:
+        pool.close()
+        pool.join()
+    assert result['cycles'] > 0 and result['logic_area'] > 0 and result['max_freq'] > 0
+    assert len(os.listdir(str(tmp_path / 'cache' / 'dse'))) == 1
+
+    def elaborate(*args, **kwargs):
+        raise AssertionError('a cached point was elaborated again')
+    monkeypatch.setattr(tpu, 'load_tpu', elaborate)
+    assert dse.evaluate(job) == result
+    with pytest.raises(AssertionError, match='elaborated again'):
+        dse.evaluate(({ 'MATSIZE' : 2, 'DWIDTH' : 4 },) + job[1:])
@@ -0,0 +1,60 @@
+'''
+Operation counts, their energy, and sim.py's --energy option.
+'''
+
+import os
+import subprocess
+import sys
+
+import energy
+import isa
+from config import Config
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_op_counts():
+    cfg = Config(MATSIZE=4)
+    program = [
+        ('RHM', 0, 0, 3, 0),
+        ('RW', 0, 0, 1, 0),
+        ('MMC', 0, 0, 3, isa.OVERWRITE_MASK),
+        ('MMC', 0, 0, 3, 0),
+        ('ACT', 0, 0, 3, 0),
+        ('WHM', 0, 0, 3, 0),
+        ('HLT', 0, 0, 0, 0),
+    ]
+    counts = energy.op_counts([program, program], cfg)
+    acc = 4 * cfg.ACC_WIDTH // 8
+    assert counts['instructions'] == 14
+    assert counts['macs'] == 2 * 2 * 3 * 16
+    assert counts['gated_macs'] == 0
+    assert counts['dram_bytes'] == 2 * 16
+    assert counts['host_bytes'] == 2 * 6 * 4
+    assert counts['activations'] == 2 * 3 * 4
+    assert counts['sram_bytes'] == 2 * (7 * isa.INSTRUCTION_WIDTH_BYTES + 6 * 4 + 2 * 16 + 3 * (4 + acc) + 3 * (4 + 2 * acc) + 3 * (acc + 4))
+
+
+def test_op_energy_and_report():
+    cfg = Config(MATSIZE=4)
+    counts = dict.fromkeys(['macs', 'gated_macs', 'sram_bytes', 'dram_bytes', 'host_bytes', 'activations', 'instructions'], 0)
+    counts.update(macs=100, gated_macs=40)
+    dynamic = energy.op_energy(counts, cfg)
+    assert dynamic['mac_array'] == 60 * energy.mac_pj(cfg)
+    assert energy.mac_pj(Config(MATSIZE=4, DWIDTH=16)) > energy.mac_pj(cfg)
+    static = energy.static_pj(2., 700, 700.)  # 2 mm2 for a microsecond
+    assert static == 2e3
+    text = energy.report(dynamic, 4, static)
+    assert 'per inference (4 inferences)' in text and 'leakage' in text
+
+
+def test_energy_needs_inferences(workload):
+    w = workload(Config(MATSIZE=4), [4, 4], 8, ['relu'])
+    run = lambda *extra: subprocess.run([sys.executable, os.path.join(HERE, 'sim.py'), w.program, w.path('_host.npy'), w.path('_weights.npy'),
+                                         '--config', 'MATSIZE=4', '--energy'] + list(extra),
+                                        cwd=os.path.dirname(w.prefix), capture_output=True, text=True)
+    result = run()
+    assert result.returncode == 2 and '--energy needs --inferences' in result.stderr
+    result = run('--inferences', '8')
+    assert result.returncode == 0, result.stderr
+    assert 'per inference (8 inferences)' in result.stdout
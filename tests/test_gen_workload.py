@@ -0,0 +1,45 @@
+'''
+Generated workloads on sim.py, in int and raw mode, against their reference outputs.
+'''
+
+import numpy as np
+import pytest
+
+from config import Config
+from conftest import run_sim
+import sim
+
+CASES = [
+    (dict(MATSIZE=8), [40, 20, 10], ['relu', 'none']),  # layers tiled over several vectors and tiles
+    (dict(MATSIZE=16), [16, 16, 16, 16], ['relu', 'sigmoid', 'none']),
+    (dict(MATSIZE=16, MAT_COLS=8), [30, 12, 5], ['sigmoid', 'relu']),
+    (dict(MATSIZE=8, MAT_ROWS=4), [10, 7, 5], ['relu', 'sigmoid']),  # wide: blocks of MAT_ROWS
+    (dict(MATSIZE=8, DWIDTH=4), [12, 9, 4], ['relu', 'none']),
+    (dict(MATSIZE=8, DWIDTH=16), [12, 9, 4], ['relu', 'sigmoid']),
+    (dict(MATSIZE=8, NUM_CORES=2), [12, 9, 4], None),
+]
+
+
+@pytest.mark.parametrize('overrides,layers,acts', CASES)
+def test_sim_matches_reference(workload, overrides, layers, acts):
+    w = workload(Config(**overrides), layers, 40, acts, sparsity=0.3, weight_sparsity=0.3, chunk=16)
+    assert np.array_equal(w.outputs(run_sim(w).host_memory), w.load('_ref_int.npy'))
+    raw = w.outputs(run_sim(w, raw=True).host_memory)
+    assert np.allclose(raw, w.load('_ref_float.npy'), rtol=1e-5)
+
+
+def test_manifest_and_chunks(workload):
+    w = workload(Config(MATSIZE=8), [20, 10], 100, chunk=30)
+    assert w.manifest['chunk'] == 30
+    assert w.manifest['output_base'] == 100 * 3  # three 8-wide blocks per input
+    with pytest.raises(ValueError):
+        workload(Config(MATSIZE=8), [20, 10], 10, chunk=1000)
+    with pytest.raises(ValueError):
+        workload(Config(MATSIZE=8), [20, 10], 10, ['tanh'])
+
+
+def test_sigmoid_handles_negative_inputs():
+    x = np.array([-100, -9, -8, -1, 0, 1, 7, 8, 1000])
+    assert list(sim.sigmoid(x)) == [0, 0, 1, 69, 128, 187, 255, 255, 255]
+    assert list(sim.sigmoid(x, 4)) == [0, 0, 1, 5, 8, 11, 15, 15, 15]
+    assert list(sim.sigmoid(x, raw=True)) == [ int(255 / (1. + np.exp(-v))) for v in x ]
@@ -0,0 +1,31 @@
+'''
+Host memory beats of several vectors: transfers whose length is not a multiple of
+HOST_VECS_PER_BEAT end in a partial beat, which must not touch the rows after them.
+'''
+
+import numpy as np
+import pytest
+
+from config import Config
+from conftest import assemble, run_both
+from runtpu import beats
+
+
+@pytest.mark.parametrize('vecs', [2, 3])
+def test_partial_last_beats(tmp_path, vecs):
+    cfg = Config(MATSIZE=4, HOST_VECS_PER_BEAT=vecs, PERF_COUNTERS=True)
+    rng = np.random.RandomState(vecs)
+    host = np.full((80, cfg.VECSIZE), -1, dtype=cfg.INT_DTYPE)
+    host[:20] = rng.randint(-128, 128, (20, cfg.VECSIZE))
+    weights = np.zeros((1, 4, 4), dtype=cfg.INT_DTYPE)
+    transfers = [ (0, 5), (7, 7), (15, 1) ]  # (host row, length); every length leaves a partial beat
+    lines = [ 'RHM {}, {}, {}'.format(addr, addr, n) for addr, n in transfers ]
+    lines += [ 'WHM {}, {}, {}'.format(addr, 40 + addr, n) for addr, n in transfers ]
+    program = assemble(tmp_path, lines)
+    _, hostmem, perf = run_both(cfg, program, host, weights)
+
+    expected = host.copy()
+    for addr, n in transfers:
+        expected[40 + addr:40 + addr + n] = host[addr:addr + n]
+    assert np.array_equal(hostmem, expected)
+    assert perf['rhm_busy'] == perf['whm_busy'] == sum(beats(n, vecs) for _, n in transfers)
@@ -0,0 +1,53 @@
+'''
+The pipelined MAC (MAC_PIPELINE=1): a shorter critical path, the same results a cycle
+later.
+'''
+
+import numpy as np
+import pytest
+import pyrtl
+from pyrtl.analysis import TimingAnalysis
+
+import matrix
+from config import Config
+from conftest import assemble, run_both
+
+N = 12  # input vectors
+
+
+def mac_fmax(pipeline):
+    block = pyrtl.Block()
+    with pyrtl.set_working_block(block):
+        ins = [ pyrtl.Input(w, name) for w, name in ((8, 'data'), (32, 'acc'), (1, 'switch'), (8, 'weight'), (1, 'we'), (2, 'tag')) ]
+        for out in matrix.MAC(8, 4, *ins, pipeline=pipeline):
+            o = pyrtl.Output(len(out))
+            o <<= out
+        pyrtl.synthesize()
+        pyrtl.optimize()
+        return TimingAnalysis().max_freq()
+
+
+def test_shorter_critical_path():
+    assert mac_fmax(1) > mac_fmax(0)
+
+
+def test_depth_is_0_or_1():
+    with pytest.raises(Exception, match='must be 0 or 1'):
+        matrix.MAC(8, 4, pyrtl.Const(0, 8), pyrtl.Const(0, 32), pyrtl.Const(0, 1), pyrtl.Const(0, 8),
+                   pyrtl.Const(0, 1), pyrtl.Const(0, 2), pipeline=2)
+
+
+def test_same_results_a_cycle_later(tmp_path):
+    results = {}
+    for pipeline in (0, 1):
+        cfg = Config(MATSIZE=4, MAC_PIPELINE=pipeline)
+        host = np.zeros((40 + 2 * N, cfg.VECSIZE), dtype=cfg.INT_DTYPE)
+        host[:N] = np.random.RandomState(1).randint(-3, 4, (N, 4))
+        weights = np.random.RandomState(2).randint(-3, 4, (2, 4, 4)).astype(cfg.INT_DTYPE)
+        # the second MMC accumulates onto the first, and ACT waits for the last vector
+        lines = ['RHM 0, 0, {}'.format(N), 'RW 0', 'RW 1', 'MMC.SO 0, 0, {}'.format(N), 'MMC.S 0, 0, {}'.format(N),
+                 'ACT 0, 100, {}'.format(N), 'WHM 100, 40, {}'.format(N)]
+        results[pipeline] = run_both(cfg, assemble(tmp_path, lines), host, weights)[:2]
+        expected = host[:N].astype(np.int64) @ (weights[0].astype(np.int64) + weights[1])
+        assert np.array_equal(results[pipeline][1][40:40 + N], expected)
+    assert results[1][0] > results[0][0]
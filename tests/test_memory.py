@@ -0,0 +1,64 @@
+'''
+The off-chip memory model, and the RTL and sim.py timing under slow memories and SYNC.
+'''
+
+import numpy as np
+import pytest
+
+import assembler
+from config import Config
+from conftest import run_rtl_workload, run_sim
+from memory import MemoryModel
+
+
+def test_schedule_latency_and_bandwidth():
+    assert MemoryModel(64, latency=5).schedule(10, 3) == [15, 16, 17]
+    assert MemoryModel(64, latency=5, bandwidth=32).schedule(10, 3) == [15, 17, 19]
+    # each burst pays the latency again
+    assert MemoryModel(64, latency=5, burst=2).schedule(0, 4) == [5, 6, 11, 12]
+
+
+def test_schedule_queues_transfers():
+    m = MemoryModel(64, latency=3)
+    assert m.schedule(0, 2) == [3, 4]
+    assert m.schedule(1, 2) == [7, 8]  # after the channel is done with the first
+    assert m.schedule(20, 1) == [23]
+
+
+def test_from_spec():
+    m = MemoryModel.from_spec('latency=40,bandwidth=32,burst=4,jitter=8', 64)
+    assert (m.latency, m.bandwidth, m.burst, m.jitter) == (40, 32., 4, 8)
+    with pytest.raises(ValueError):
+        MemoryModel.from_spec('speed=3', 64)
+    with pytest.raises(ValueError):
+        MemoryModel(64, latency=0)
+
+
+def models(cfg, seed=0):
+    host_bytes = cfg.HOST_VECS_PER_BEAT * cfg.VECSIZE * cfg.DWIDTH // 8
+    return dict(weights_model=MemoryModel.from_spec('latency=20,bandwidth=8,burst=2,jitter=4', cfg.WEIGHT_DRAM_BEAT_BYTES, seed=seed),
+                host_model=MemoryModel.from_spec('latency=7,jitter=3', host_bytes, seed=seed + 1))
+
+
+def test_slow_memories(workload):
+    w = workload(Config(MATSIZE=4), [10, 6, 3], 12, ['relu', 'none'])
+    cycles, outputs = run_rtl_workload(w, **models(w.cfg))
+    tpusim = run_sim(w, **models(w.cfg))
+    assert np.array_equal(outputs, w.load('_ref_int.npy'))
+    assert cycles == tpusim.cycles[0]
+    assert tpusim.cycles[1] > 0  # cycles lost to the memories
+
+
+def test_sync(workload):
+    w = workload(Config(MATSIZE=4), [10, 6, 3], 12, ['relu', 'none'])
+    with open(w.prefix + '.a') as f:
+        lines = f.read().splitlines()
+    with open(w.prefix + '.a', 'w') as f:
+        for line in lines:
+            f.write(line + '\n')
+            if line.startswith(('RW', 'RHM')):
+                f.write('SYNC\n')
+    assembler.assemble(w.prefix + '.a', 0)
+    cycles, outputs = run_rtl_workload(w, **models(w.cfg))
+    assert np.array_equal(outputs, w.load('_ref_int.npy'))
+    assert cycles == run_sim(w, **models(w.cfg)).cycles[0]
@@ -0,0 +1,37 @@
+'''
+The design's performance counters (config.PERF_COUNTERS) against what the program does.
+'''
+
+import pytest
+from pyrtl import Output, Register
+
+import sim
+import tpu
+from config import Config
+from conftest import run_rtl
+from runtpu import beats
+
+
+@pytest.mark.parametrize('vecs', [1, 2])
+def test_counters(workload, vecs):
+    w = workload(Config(MATSIZE=4, PERF_COUNTERS=True, HOST_VECS_PER_BEAT=vecs), [6, 5, 3], 12, ['relu', 'none'], chunk=5)
+    cycles, _, perf, _ = run_rtl(w.cfg, w.program, w.load('_host.npy'), w.load('_weights.npy'))
+    program = sim.load_program(w.program)
+    lengths = lambda opcode: [ length for op, _, _, length, _ in program if op == opcode ]
+    assert perf['cycles'] == cycles
+    assert perf['mm_busy'] == sum(lengths('MMC'))
+    assert perf['act_busy'] == sum(lengths('ACT'))
+    assert perf['rhm_busy'] == sum(beats(n, vecs) for n in lengths('RHM'))
+    assert perf['whm_busy'] == sum(beats(n, vecs) for n in lengths('WHM'))
+    assert perf['weights_programming'] == len(lengths('RW')) * w.cfg.MAT_ROWS
+    assert perf['nop'] == 0 and perf['sync'] == 0
+    assert perf['idle'] + perf['mm_busy'] <= cycles and perf['stall'] < cycles
+
+
+def test_counters_off_cost_nothing():
+    on = tpu.build_tpu(Config(MATSIZE=4, PERF_COUNTERS=True))
+    off = tpu.build_tpu(Config(MATSIZE=4))
+    assert len(on.perf) == len(tpu.PERF_COUNTERS) and off.perf == {}
+    assert not [ w for w in off.block.wirevector_subset(Output) if w.name.startswith('perf_') ]
+    registers = lambda ports: len(ports.block.wirevector_subset(Register))
+    assert registers(on) - registers(off) == len(tpu.PERF_COUNTERS)
@@ -0,0 +1,34 @@
+'''
+Rectangular arrays on the RTL and in sim.py: tall ones, and wide ones with more columns
+than rows.
+'''
+
+import numpy as np
+import pytest
+
+from config import Config
+from conftest import assemble, run_both, run_rtl_workload, run_sim
+
+N = 12  # input vectors
+
+
+@pytest.mark.parametrize('rows,cols', [(8, 4), (4, 8)])
+def test_every_column(tmp_path, rows, cols):
+    cfg = Config(MAT_ROWS=rows, MAT_COLS=cols)
+    rng = np.random.RandomState(rows)
+    host = np.zeros((40 + N, cfg.VECSIZE), dtype=cfg.INT_DTYPE)
+    host[:N] = rng.randint(-3, 4, (N, cfg.VECSIZE))  # elements past MAT_ROWS are not read
+    weights = rng.randint(-3, 4, (1, rows, cols)).astype(cfg.INT_DTYPE)
+    lines = ['RHM 0, 0, {}'.format(N), 'RW 0', 'MMC.SO 0, 0, {}'.format(N), 'ACT 0, 100, {}'.format(N), 'WHM 100, 40, {}'.format(N)]
+    _, hostmem, _ = run_both(cfg, assemble(tmp_path, lines), host, weights)
+    out = hostmem[40:40 + N]
+    assert np.array_equal(out[:, :cols], host[:N, :rows].astype(np.int64) @ weights[0])
+    assert not out[:, cols:].any()  # ACT zero-fills past MAT_COLS
+
+
+@pytest.mark.parametrize('rows,cols', [(8, 4), (4, 8)])
+def test_generated_workload(workload, rows, cols):
+    w = workload(Config(MAT_ROWS=rows, MAT_COLS=cols), [10, 7, 5], 12, ['relu', 'none'], weight_sparsity=0.3)
+    cycles, outputs = run_rtl_workload(w)
+    assert np.array_equal(outputs, w.load('_ref_int.npy'))
+    assert cycles == run_sim(w).cycles[0]
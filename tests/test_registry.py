@@ -0,0 +1,86 @@
+'''
+The model registry: entries shared by contents, and evicted least recently used first.
+'''
+
+import shutil
+
+import numpy as np
+import pytest
+
+import registry
+import runtpu
+import sim
+from config import Config
+
+
+def test_entries_match_the_loaders(workload):
+    w = workload(Config(MATSIZE=4), [4, 4], 4, ['none'])
+    models = registry.Registry()
+    assert models.program(w.program) == sim.load_program(w.program)
+    assert models.instructions(w.program, w.cfg) == runtpu.load_program(w.program, w.cfg)
+    tiles = models.tiles(w.path('_weights.npy'))
+    assert np.array_equal(tiles, w.load('_weights.npy'))
+    assert not tiles.flags.writeable
+    with pytest.raises(ValueError):
+        tiles[0] = 0
+    packed = models.packed_weights(w.path('_weights.npy'), w.cfg)
+    assert packed == { a : runtpu.concat_tile(tile, w.cfg.DWIDTH) for a, tile in enumerate(w.load('_weights.npy')) }
+
+
+def test_same_contents_share_an_entry(workload, tmp_path):
+    w = workload(Config(MATSIZE=4), [4, 4], 4, ['none'])
+    copy = str(tmp_path / 'copy.npy')
+    shutil.copy(w.path('_weights.npy'), copy)
+    models = registry.Registry()
+    first = models.tiles(w.path('_weights.npy'))
+    assert models.tiles(copy) is first
+    assert models.tiles(w.load('_weights.npy')) is first
+    assert models.tiles(np.asfortranarray(w.load('_weights.npy'))) is first
+    stats = models.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (3, 1, 1)
+
+
+def test_clear_forgets_entries_and_hashes(workload):
+    w = workload(Config(MATSIZE=4), [4, 4], 4, ['none'])
+    models = registry.Registry()
+    models.tiles(w.path('_weights.npy'))
+    models.program(w.program)
+    models.clear()
+    assert (models.entries, models.hashes, models.used) == ({}, {}, 0)
+    models.tiles(w.path('_weights.npy'))
+    assert models.stats()['misses'] == 3
+
+
+def test_changed_file_is_hashed_again(tmp_path):
+    path = str(tmp_path / 'tiles.npy')
+    np.save(path, np.zeros((2, 4, 4), dtype=np.int8))
+    models = registry.Registry()
+    assert not models.tiles(path).any()
+    np.save(path, np.ones((3, 4, 4), dtype=np.int8))
+    assert models.tiles(path).shape == (3, 4, 4)
+    assert models.stats()['misses'] == 2
+
+
+def test_least_recently_used_is_evicted():
+    arrays = [ np.full((16, 16), i, dtype=np.int32) for i in range(4) ]  # 1 KiB each
+    models = registry.Registry(budget=3 * 1024)
+    for a in arrays[:3]:
+        models.tiles(a)
+    models.tiles(arrays[0])  # now the most recent: arrays[1] goes first
+    models.tiles(arrays[3])
+    stats = models.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (3, 3 * 1024, 1)
+    assert (stats['hits'], stats['misses']) == (1, 4)
+    models.tiles(arrays[1])
+    assert models.stats()['evictions'] == 2
+    assert models.stats()['misses'] == 5
+    models.tiles(arrays[3])
+    assert models.stats()['hits'] == 2
+
+
+def test_entry_over_budget_is_not_kept():
+    models = registry.Registry(budget=100)
+    big = np.zeros(1000, dtype=np.int8)
+    assert np.array_equal(models.tiles(big), big)
+    stats = models.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (0, 0, 0)
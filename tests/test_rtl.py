@@ -0,0 +1,56 @@
+'''
+The RTL design against the functional simulator: generated workloads must give the
+reference outputs on both, in the number of cycles sim.py's timing model predicts.
+'''
+
+import numpy as np
+import pytest
+
+from config import Config
+from conftest import run_rtl_workload, run_sim
+
+# Config overrides of the designs checked, all small enough to simulate quickly
+CONFIGS = [
+    dict(MATSIZE=4),  # the scoreboard orders the NOP-free generated programs
+    dict(MATSIZE=4, HOST_VECS_PER_BEAT=2),  # two vectors per host memory beat
+    dict(MATSIZE=4, WEIGHT_FIFO_DEPTH=2, WEIGHT_DRAM_BEAT_BYTES=4),  # a shallow FIFO, tiles in several beats
+    dict(MATSIZE=4, MAC_PIPELINE=1),
+    dict(MATSIZE=8, MAT_COLS=4),  # rectangular array
+    dict(MATSIZE=4, NUM_CORES=2),  # both cores run the program, sharing the memory ports
+    dict(MATSIZE=4, MAC_ZERO_GATING=True),
+    dict(MATSIZE=4, DWIDTH=4),
+    dict(MATSIZE=4, DWIDTH=16),
+]
+
+
+@pytest.mark.parametrize('overrides', CONFIGS, ids=lambda o: ','.join('{}={}'.format(*kv) for kv in sorted(o.items())))
+def test_workload_matches_reference_and_timing(workload, overrides):
+    w = workload(Config(**overrides), [10, 6, 3], 12, ['relu', 'sigmoid'], sparsity=0.3, weight_sparsity=0.5)
+    cycles, outputs = run_rtl_workload(w)
+    tpusim = run_sim(w)
+    ref = w.load('_ref_int.npy')
+    assert np.array_equal(outputs, ref)
+    assert np.array_equal(w.outputs(tpusim.host_memory), ref)
+    assert cycles == tpusim.cycles[0]
+
+
+def test_scoreboard_waits_for_results(workload):
+    # One chunk at a time and no slack: every instruction depends on the one before it
+    w = workload(Config(MATSIZE=4), [4, 4], 3, ['none'], chunk=1)
+    cycles, outputs = run_rtl_workload(w)
+    assert np.array_equal(outputs, w.load('_ref_int.npy'))
+    assert cycles == run_sim(w).cycles[0]
+
+
+def test_cores_run_their_own_programs(workload):
+    import assembler
+    w = workload(Config(MATSIZE=4, NUM_CORES=2), [10, 6, 3], 12, ['relu', 'none'])
+    with open(w.prefix + '_idle.a', 'w') as f:
+        f.write('HLT\n')
+    assembler.assemble(w.prefix + '_idle.a', 0)
+    idle = [w.prefix + '_idle.out']
+    cycles, outputs = run_rtl_workload(w, core_programs=idle)
+    assert np.array_equal(outputs, w.load('_ref_int.npy'))
+    tpusim = run_sim(w, core_programs=idle)
+    assert cycles == tpusim.cycles[0]
+    assert cycles < run_sim(w).cycles[0]  # without core 1 competing for the ports
@@ -0,0 +1,97 @@
+'''
+The batching server, over a real socket: concurrent clients share batches, and every bad
+request gets an error reply.
+'''
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import gen_workload
+import server
+from config import Config
+
+
+@pytest.fixture
+def model(workload):
+    w = workload(Config(MATSIZE=4), [6, 5, 3], 20, ['relu', 'none'])
+    inputs = gen_workload.from_host(w.load('_host.npy'), 20, 6, w.cfg)
+    return w, inputs
+
+
+def serve(w, test, path=None, **kwargs):
+    '''Run test(client, srv) against a Server of the workload's model, on a Unix socket at path or a free port.'''
+    async def main():
+        srv = server.Server([server.Model(w.prefix)], **kwargs)
+        listener = await srv.start(port=0, path=path)
+        try:
+            if path:
+                client = await server.Client.connect(path=path)
+            else:
+                client = await server.Client.connect(port=listener.sockets[0].getsockname()[1])
+            try:
+                await test(client, srv)
+            finally:
+                await client.close()
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            for task in srv.tasks:
+                task.cancel()
+            srv.executor.shutdown()
+    asyncio.run(main())
+
+
+def test_concurrent_requests_share_batches(model):
+    w, inputs = model
+
+    async def test(client, srv):
+        outputs = await asyncio.gather(*[ client.infer('w', x) for x in inputs ])
+        assert np.array_equal(np.array(outputs), w.load('_ref_int.npy'))
+        metrics = (await client.metrics())['w']
+        assert metrics['requests'] == 20 and metrics['queue_depth'] == 0
+        assert metrics['batches'] < 20 and metrics['hw_cycles'] > 0
+        models = await client.call(op='models')
+        assert models['w'] == { 'layers' : [6, 5, 3], 'acts' : ['relu', 'none'], 'max_batch' : 8 }
+    serve(w, test, max_batch=8, max_delay=0.05)
+
+
+def test_unix_socket(model, tmp_path):
+    w, inputs = model
+
+    async def test(client, srv):
+        assert np.array_equal(await client.infer('w', inputs[3]), w.load('_ref_int.npy')[3])
+    serve(w, test, path=str(tmp_path / 'tpu.sock'))
+
+
+@pytest.mark.parametrize('request_, error', [
+    ({ 'model' : 'w', 'input' : [300, 0, 0, 0, 0, 0] }, 'integers from -128 to 127'),
+    ({ 'model' : 'w', 'input' : [1.5, 0, 0, 0, 0, 0] }, 'integers from -128 to 127'),
+    ({ 'model' : 'w', 'input' : ['a', 0, 0, 0, 0, 0] }, 'ValueError'),
+    ({ 'model' : 'w', 'input' : [1e400, 0, 0, 0, 0, 0] }, 'finite'),
+    ({ 'model' : 'w', 'input' : [1, 2, 3] }, 'takes 6 inputs'),
+    ({ 'model' : 'w' }, "KeyError: 'input'"),
+    ({ 'model' : 'other', 'input' : [0] * 6 }, 'Unknown model'),
+    ({ 'op' : 'reboot' }, 'Unknown op'),
+])
+def test_error_replies(model, request_, error):
+    w, inputs = model
+
+    async def test(client, srv):
+        with pytest.raises(RuntimeError, match=error):
+            await client.call(**request_)
+        # the connection and the model still serve good requests
+        assert np.array_equal(await client.infer('w', inputs[0]), w.load('_ref_int.npy')[0])
+    serve(w, test)
+
+
+def test_malformed_lines(model):
+    w, _ = model
+
+    async def test(client, srv):
+        for line in (b'not json\n', b'[1, 2]\n'):
+            future = client.waiting[None] = asyncio.get_event_loop().create_future()
+            client.writer.write(line)
+            assert 'error' in await future
+    serve(w, test)
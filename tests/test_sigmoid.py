@@ -0,0 +1,36 @@
+'''
+ACT.Q's sigmoid: a ROM for inputs -8 to 7, rounded up, saturating to 0 below and to the
+top of the range above, in the activate unit and in sim.py alike.
+'''
+
+import numpy as np
+import pytest
+import pyrtl
+
+import activate
+import sim
+
+
+@pytest.mark.parametrize('data_width', [4, 8, 16])
+def test_activate_unit_matches_sim(data_width):
+    xs = list(range(-40, 41)) + [-2**31, 2**31 - 1]
+    block = pyrtl.Block()
+    with pyrtl.set_working_block(block):
+        x = pyrtl.Input(32, 'x')
+        y = pyrtl.Output(data_width, 'y')
+        y <<= activate.sigmoid(x, data_width)
+        simulation = pyrtl.Simulation()
+        for v in xs:
+            simulation.step({ 'x' : v & (2**32 - 1) })
+    assert simulation.tracer.trace['y'] == list(sim.sigmoid(xs, data_width))
+
+
+def test_values():
+    top = 255
+    y = sim.sigmoid(np.arange(-12, 12))
+    assert (y[:4] == 0).all() and (y[-4:] == top).all()  # saturated outside -8..7
+    assert y[4] == 1 and y[12] == 128  # sigmoid(-8) and sigmoid(0), rounded up
+    assert (np.diff(y) >= 0).all()
+    # raw mode keeps the function itself
+    assert sim.sigmoid(-9, raw=True) == int(top / (1. + np.exp(9)))
+    assert sim.sigmoid(12, raw=True) == int(top / (1. + np.exp(-12)))
@@ -0,0 +1,56 @@
+'''
+MAC zero-operand gating: the same results, less switching in the multipliers, and sim.py's
+sparsity statistics.
+'''
+
+import numpy as np
+import pytest
+
+import energy
+import sim
+from config import Config
+from conftest import assemble, run_both, run_rtl, run_sim
+
+
+def test_gating_saves_multiplier_toggles(workload):
+    toggles = {}
+    for gating in (False, True):
+        w = workload(Config(MATSIZE=4, MAC_ZERO_GATING=gating), [8, 8], 32, ['none'], sparsity=0.7, weight_sparsity=0.5)
+        cycles, hostmem, _, counter = run_rtl(w.cfg, w.program, w.load('_host.npy'), w.load('_weights.npy'), trace='toggles')
+        assert np.array_equal(w.outputs(hostmem), w.load('_ref_int.npy'))
+        toggles[gating] = counter.by_op()['*']
+    assert toggles[True] < toggles[False]
+
+
+def test_sparsity_statistics(workload):
+    w = workload(Config(MATSIZE=4, MAC_ZERO_GATING=True), [4, 4], 8, ['none'], sparsity=1.)
+    tpusim = run_sim(w)
+    activations, weights, zero_macs = tpusim.sparsity()
+    assert activations == 1. and zero_macs == 1.
+    assert weights == np.mean(w.load('_weights.npy') == 0)
+    counts = energy.op_counts(tpusim.programs, w.cfg, tpusim.mmc_stats)
+    assert counts['macs'] == 8 * 4 * 4
+    assert counts['gated_macs'] == counts['macs']  # gating skips them all
+
+
+@pytest.mark.parametrize('pipeline', [0, 1])
+def test_gated_macs_still_accumulate(tmp_path, pipeline):
+    # zero operands pass the accumulator input through, also onto an earlier MMC's results
+    cfg = Config(MATSIZE=4, MAC_ZERO_GATING=True, MAC_PIPELINE=pipeline)
+    rng = np.random.RandomState(pipeline)
+    n = 12
+    host = np.zeros((40 + n, 4), dtype=cfg.INT_DTYPE)
+    host[:n] = rng.randint(-3, 4, (n, 4)) * (rng.random_sample((n, 4)) > 0.6)
+    weights = (rng.randint(-3, 4, (2, 4, 4)) * (rng.random_sample((2, 4, 4)) > 0.5)).astype(cfg.INT_DTYPE)
+    lines = ['RHM 0, 0, {}'.format(n), 'RW 0', 'RW 1', 'MMC.SO 0, 0, {}'.format(n), 'MMC.S 0, 0, {}'.format(n),
+             'ACT 0, 100, {}'.format(n), 'WHM 100, 40, {}'.format(n)]
+    program = assemble(tmp_path, lines)
+    _, hostmem, _ = run_both(cfg, program, host, weights)
+    x = host[:n].astype(np.int64)
+    assert np.array_equal(hostmem[40:], x @ weights[0] + x @ weights[1])
+
+    tpusim = sim.TPUSim(program, weights, host.copy(), cfg=cfg, verbose=False)
+    tpusim.run()
+    for k, (_, _, _, act, weight, macs) in enumerate(tpusim.mmc_stats):
+        assert np.isclose(act, np.mean(x == 0)) and np.isclose(weight, np.mean(weights[k] == 0))
+        assert np.isclose(macs, 1 - ((x != 0).astype(int) @ (weights[k] != 0)).sum() / (n * 16.))
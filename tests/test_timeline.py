@@ -0,0 +1,36 @@
+'''
+The instruction timeline of an RTL run (runtpu.py --trace timeline).
+'''
+
+import io
+import json
+
+import sim
+from config import Config
+from conftest import run_rtl
+
+
+def test_timeline(workload):
+    w = workload(Config(MATSIZE=4), [6, 5, 3], 8, ['relu', 'none'], chunk=4)
+    cycles, _, _, timeline = run_rtl(w.cfg, w.program, w.load('_host.npy'), w.load('_weights.npy'), trace='timeline')
+    program = sim.load_program(w.program)
+    rows = timeline.instructions()
+    assert [ pc for pc, _, _, _ in rows ] == list(range(len(program)))
+    issued = [ t for _, _, t, _ in rows ]
+    assert issued == sorted(issued) and issued[-1] <= cycles
+    assert all(fetched <= t < done for _, fetched, t, done in rows)
+
+    # no unit works on two instructions at once
+    for unit in timeline.UNITS:
+        events = sorted((start, end) for u, _, start, end in timeline.cores[0].events if u == unit)
+        assert all(end <= start for (_, end), (start, _) in zip(events, events[1:])), unit
+    busy = timeline.utilization()
+    assert busy['mmu'] >= sum(length for opcode, _, _, length, _ in program if opcode == 'MMC')
+    assert busy['dram'] > 0 and busy['drain'] > 0
+
+    path = timeline.critical_path()
+    assert path[0][0] == len(program) - 1 and path[-1][2] is None
+    f = io.StringIO()
+    timeline.chrome_trace(f)
+    events = [ e for e in json.loads(f.getvalue())['traceEvents'] if e['ph'] == 'X' ]
+    assert len(events) == len(timeline.cores[0].events)
@@ -0,0 +1,36 @@
+import os
+import time
+
+from config import Config
+import tpu
+
+
+def cached(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith('.pickle'))
+
+
+def test_load_tpu_reuses_cached_design(tmp_path):
+    cfg = Config(MATSIZE=2)
+    ports = tpu.load_tpu(cfg, cache_dir=str(tmp_path))
+    assert cached(str(tmp_path)) == [tpu.design_key(cfg, False) + '.pickle']
+    again = tpu.load_tpu(cfg, cache_dir=str(tmp_path))
+    assert again.cfg == cfg
+    assert len(again.block.logic) == len(ports.block.logic)
+
+
+def test_cache_keeps_most_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(tpu, 'CACHE_ENTRIES', 2)
+    d = str(tmp_path)
+    for size in (2, 4, 2, 8):  # the hit on 2 makes 4 the oldest
+        tpu.load_tpu(Config(MATSIZE=size), cache_dir=d)
+        time.sleep(0.01)
+    assert len(cached(d)) == 2
+    for size, kept in ((2, True), (4, False), (8, True)):
+        assert os.path.exists(os.path.join(d, tpu.design_key(Config(MATSIZE=size), False) + '.pickle')) == kept
+
+
+def test_prune_cache_empties(tmp_path):
+    d = str(tmp_path)
+    tpu.load_tpu(Config(MATSIZE=2), cache_dir=d)
+    tpu.prune_cache(d, keep=0)
+    assert cached(d) == []
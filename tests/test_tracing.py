@@ -0,0 +1,81 @@
+'''
+The tracing modes of runtpu.py: a window, a signal filter, a VCD streamed to disk, and
+no trace at all by default.
+'''
+
+import re
+
+import pytest
+
+import tracing
+from config import Config
+from conftest import run_rtl
+
+
+@pytest.fixture
+def run(workload):
+    w = workload(Config(MATSIZE=4), [6, 5, 3], 4, ['relu', 'none'])
+    return lambda trace='off', **trace_args: run_rtl(w.cfg, w.program, w.load('_host.npy'), w.load('_weights.npy'),
+                                                     trace=trace, trace_args=trace_args)
+
+
+def named(trace):
+    '''A trace without PyRTL's assertion wires, numbered afresh by every build of the design.'''
+    return { name : values for name, values in trace.items() if not re.match(r'assertion\d+$', name) }
+
+
+def changes(trace):
+    '''name -> [(cycle, value)] at the cycles a wire's value changed, as a VCD has them.'''
+    out = {}
+    for name, values in trace.items():
+        out[name] = [ (t, v) for t, v in enumerate(values) if t == 0 or v != values[t - 1] ]
+    return out
+
+
+def read_vcd(text):
+    out = {}
+    cycle = None
+    for line in text.splitlines():
+        if line.startswith('#'):
+            cycle = int(line[1:]) // 10
+        elif line.startswith('b'):
+            value, name = line[1:].split()
+            out.setdefault(name, []).append((cycle, int(value, 2)))
+    return out
+
+
+def test_window(run):
+    cycles, _, _, full = run('full')
+    _, _, _, window = run('window', window=(5, 15))
+    assert len(window) == 10 and set(named(window.trace)) == set(named(full.trace))
+    for name, values in named(window.trace).items():
+        assert list(values) == list(full.trace[name][5:15])
+
+
+def test_signal_filter(run):
+    _, _, _, tracer = run('full', signals=['pc', 'halt'])
+    assert sorted(tracer.trace) == ['halt', 'pc']
+    _, _, _, window = run('window', signals=['pc'], window=(0, 8))
+    assert list(window.trace) == ['pc'] and len(window) == 8
+    with pytest.raises(Exception, match='No wire named'):
+        run('window', signals=['no_such_wire'])
+
+
+def test_stream_matches_full_trace(run, tmp_path):
+    _, _, _, full = run('full')
+    path = str(tmp_path / 'trace.vcd')
+    with open(path, 'w') as f:
+        _, _, _, stream = run('stream', f=f)
+        stream.close()
+    with open(path) as f:
+        text = f.read()
+    assert re.search(r'\$enddefinitions', text)
+    expected = { tracing._vcd_name(name) : c for name, c in changes(named(full.trace)).items() }
+    assert named(read_vcd(text)) == expected
+
+
+def test_off_records_nothing(run):
+    cycles, _, _, tracer = run()
+    assert isinstance(tracer, tracing.NullTrace)
+    assert tracer.trace == {} and tracer.wires_to_track == []
+    assert cycles > 0
@@ -0,0 +1,35 @@
+'''
+The weight FIFO and DRAM beat width: RWs issued faster than the array consumes their
+tiles fill a shallow FIFO, and the next RW waits for a free slot.
+'''
+
+import numpy as np
+
+from config import Config
+from conftest import assemble, run_both
+
+N = 12  # input vectors
+TILES = 3  # one more than the shallow FIFO holds: the array takes the first
+
+
+def run(tmp_path, depth):
+    cfg = Config(MATSIZE=4, WEIGHT_FIFO_DEPTH=depth, WEIGHT_DRAM_BEAT_BYTES=4, PERF_COUNTERS=True)
+    rng = np.random.RandomState(0)
+    host = np.zeros((40 + TILES * N, cfg.VECSIZE), dtype=cfg.INT_DTYPE)
+    host[:N] = rng.randint(-3, 4, (N, 4))
+    weights = rng.randint(-3, 4, (TILES, 4, 4)).astype(cfg.INT_DTYPE)
+    lines = ['RHM 0, 0, {}'.format(N)] + [ 'RW {}'.format(k) for k in range(TILES) ]
+    lines += [ 'MMC.SO 0, {}, {}'.format(k * N, N) for k in range(TILES) ]
+    lines += ['ACT 0, 100, {}'.format(TILES * N), 'WHM 100, 40, {}'.format(TILES * N)]
+    cycles, hostmem, perf = run_both(cfg, assemble(tmp_path, lines), host, weights)
+    expected = np.concatenate([ host[:N].astype(np.int64) @ weights[k] for k in range(TILES) ])
+    assert np.array_equal(hostmem[40:], expected)
+    return cycles, perf
+
+
+def test_full_fifo_holds_the_next_rw(tmp_path):
+    shallow_cycles, shallow = run(tmp_path, 2)
+    deep_cycles, deep = run(tmp_path, 4)
+    assert shallow['fifo_full'] > 0 and deep['fifo_full'] == 0
+    assert shallow['stall'] > deep['stall']
+    assert shallow_cycles > deep_cycles
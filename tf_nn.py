@@ -11,18 +11,20 @@ from sklearn.model_selection import train_test_split
 from sklearn import preprocessing
 from sklearn import metrics
 
+from config import Config
+
 args = None
 
-def model(inputs, layers, act):
+def model(inputs, layers, act, biases=None):
     [m1, m2, m3] = layers
-    #y1 = tf.add(tf.matmul(inputs, m1), b1)
-    y1 = tf.matmul(inputs, m1)
+    [b1, b2, b3] = biases or [0, 0, 0]
+    y1 = tf.add(tf.matmul(inputs, m1), b1)
     y1_act = act(y1)
 
-    y2 = tf.matmul(y1_act, m2)
+    y2 = tf.add(tf.matmul(y1_act, m2), b2)
     y2_act = act(y2)
     
-    y3 = tf.matmul(y2_act, m3)
+    y3 = tf.add(tf.matmul(y2_act, m3), b3)
     #y3 = act(y3)
 
     #y4 = tf.add(tf.matmul(y3, m4), b4)
@@ -65,10 +67,13 @@ def main():
         #m4 = tf.Variable(tf.random_normal([layers[3], layers[4]], 0, .1, dtype=tf.float32), name='m4')
         #m_out = tf.Variable(tf.random_normal([layers[4], layers[5]],
         #    0, .1, dtype=tf.float32), name='m_out')
-        # Bias
-        #b1 = tf.Variable(tf.random_normal([layers[1]], 0, .1, dtype=tf.float32), name='b1')
-        #b2 = tf.Variable(tf.random_normal([layers[2]], 0, .1, dtype=tf.float32), name='b2')
-        #b3 = tf.Variable(tf.random_normal([layers[3]], 0, .1, dtype=tf.float32), name='b3')
+        # Bias, added by ACT.B when the activate unit has the bias registers
+        biases = None
+        if args.cfg.ACT_BIAS:
+            b1 = tf.Variable(tf.random_normal([layers[1]], 0, .1, dtype=tf.float32), name='b1')
+            b2 = tf.Variable(tf.random_normal([layers[2]], 0, .1, dtype=tf.float32), name='b2')
+            b3 = tf.Variable(tf.random_normal([layers[3]], 0, .1, dtype=tf.float32), name='b3')
+            biases = [b1, b2, b3]
         #b4 = tf.Variable(tf.random_normal([layers[4]], 0, .1, dtype=tf.float32), name='b4')
         #b_out = tf.Variable(tf.random_normal([layers[5]], 0, .1, dtype=tf.float32), name='b_out')
         # Actication function
@@ -77,7 +82,7 @@ def main():
 
     with tf.name_scope('TRAIN'):
         learning_rate = .5
-        y_out, y1, y1_act, y2, y2_act = model(inputs, [m1, m2, m3], act)
+        y_out, y1, y1_act, y2, y2_act = model(inputs, [m1, m2, m3], act, biases)
         
         cost_op = tf.reduce_mean(tf.pow(y_out - outputs, 2))
         train_op = tf.train.AdagradOptimizer(learning_rate=learning_rate).minimize(cost_op)
@@ -116,43 +121,63 @@ def main():
         test_x = test_x[:args.N]
         test_y = test_y[:args.N]
 
-        # Quantize inputs/outputs/weights
-        qtz_input = norm2byte(test_x)
-        qtz_output = norm2byte(test_y)
+        # Quantize inputs/outputs/weights to the DWIDTH-bit integers of the hardware
+        bits = args.cfg.DWIDTH
+        qtz_input = norm2byte(test_x, bits=bits)
+        qtz_output = norm2byte(test_y, bits=bits)
         m1_val = sess.run(m1)
-        qtz_m1 = norm2byte(m1_val)
+        qtz_m1 = norm2byte(m1_val, bits=bits)
         m2_val = sess.run(m2)
-        qtz_m2 = norm2byte(m2_val)
+        qtz_m2 = norm2byte(m2_val, bits=bits)
         m3_val = sess.run(m3)
-        qtz_m3 = norm2byte(m3_val)
+        qtz_m3 = norm2byte(m3_val, bits=bits)
 
-        # Pad/Save inputs/weights
-        HW_WIDTH = 16
+        # Pad/Save inputs/weights to the shape of the hardware: vectors of VECSIZE elements,
+        # tiles of MAT_ROWS inputs by MAT_COLS outputs
+        cfg = args.cfg
+        HW_WIDTH = cfg.VECSIZE
+        ROWS, COLS = cfg.MAT_ROWS, cfg.MAT_COLS
+        dtype = np.dtype(cfg.INT_DTYPE) if not args.raw else np.float32
 
-        # input
+        # input, followed by one row per layer bias
         shape = qtz_input.shape
-        pad_input = np.zeros((shape[0], HW_WIDTH), dtype=np.int8 if not args.raw else np.float32)
+        pad_input = np.zeros((shape[0] + (3 if biases else 0), HW_WIDTH), dtype=dtype)
         pad_input[:shape[0], :shape[1]] = qtz_input if not args.raw else test_x
+        if biases:
+            # The bias registers take a DWIDTH-bit bias shifted left to the scale of the products
+            b_vals = [ sess.run(b) for b in biases ]
+            qtz_b = [ norm2byte(b_val, bits=bits) for b_val in b_vals ]
+            shifts = []
+            scale = quant_scale(test_x, bits)
+            for m_val, b_val in zip([m1_val, m2_val, m3_val], b_vals):
+                scale *= quant_scale(m_val, bits)
+                shift = int(round(np.log2(scale / quant_scale(b_val, bits))))
+                shifts.append(0 if args.raw else min(max(shift, 0), cfg.ACC_WIDTH - 1))
+            for l, b_val in enumerate(b_vals):
+                pad_input[shape[0] + l, :b_val.size] = qtz_b[l] if not args.raw else b_val
+            with open(args.save_program_path, 'w') as f:
+                f.write(bias_program(shape[0], shifts))
+            print 'bias shifts: {}, program: {}'.format(shifts, args.save_program_path)
         print 'padded input: {}'.format(pad_input)
         np.save(args.save_input_path, pad_input)
 
         # weights
         shape = qtz_m1.shape
-        pad_m1 = np.zeros((HW_WIDTH, HW_WIDTH), dtype=np.int8 if not args.raw else np.float32)
+        pad_m1 = np.zeros((ROWS, COLS), dtype=dtype)
         pad_m1[:shape[0], :shape[1]] = qtz_m1 if not args.raw else m1_val
-        pad_m1.reshape((1, HW_WIDTH, HW_WIDTH))
+        pad_m1.reshape((1, ROWS, COLS))
         print 'padded m1: {}'.format(pad_m1)
 
         shape = qtz_m2.shape
-        pad_m2 = np.zeros((HW_WIDTH, HW_WIDTH), dtype=np.int8 if not args.raw else np.float32)
+        pad_m2 = np.zeros((ROWS, COLS), dtype=dtype)
         pad_m2[:shape[0], :shape[1]] = qtz_m2 if not args.raw else m2_val
-        pad_m2.reshape((1, HW_WIDTH, HW_WIDTH))
+        pad_m2.reshape((1, ROWS, COLS))
         print 'padded m2: {}'.format(pad_m2)
 
         shape = qtz_m3.shape
-        pad_m3 = np.zeros((HW_WIDTH, HW_WIDTH), dtype=np.int8 if not args.raw else np.float32)
+        pad_m3 = np.zeros((ROWS, COLS), dtype=dtype)
         pad_m3[:shape[0], :shape[1]] = qtz_m3 if not args.raw else m3_val
-        pad_m3.reshape((1, HW_WIDTH, HW_WIDTH))
+        pad_m3.reshape((1, ROWS, COLS))
         print 'padded m3: {}'.format(pad_m3)
         padded_weights = np.array((pad_m1, pad_m2, pad_m3))
         print 'padded weights: {}'.format(padded_weights)
@@ -163,14 +188,17 @@ def main():
             sess.run(m1.assign(qtz_m1))
             sess.run(m2.assign(qtz_m2))
             sess.run(m3.assign(qtz_m3))
+            if biases:
+                for b, q, shift in zip(biases, qtz_b, shifts):
+                    sess.run(b.assign(q.astype(np.float32) * 2**shift))
 
-        # Test with 8b inputs/weights
+        # Test with the quantized inputs/weights
         test_input = qtz_input if not args.raw else test_x
         test_output = qtz_output if not args.raw else test_y
         v = sess.run([y_out, y1, y1_act, y2, y2_act],
                 feed_dict={inputs: test_input, outputs: test_output})
         pred_y, y1, y1_act, y2, y2_act = v[0], v[1], v[2], v[3], v[4]
-        pred_y = pred_y.astype(np.int8) if not args.raw else pred_y
+        pred_y = pred_y.astype(dtype) if not args.raw else pred_y
         print y1.shape, y2.shape, pred_y.shape
         pred_out = np.array((pred_y.tolist(), y1.tolist(),
             y1_act.tolist(), y2.tolist(), y2_act.tolist()))
@@ -184,10 +212,29 @@ def main():
         r2 = metrics.r2_score(test_y, pred_y)
         print 'R2: {}'.format(r2)
 
-def norm2byte(mat, shape=None):
+def bias_program(n, shifts):
+    '''boston.a with the layer biases: RHM brings them in after the n inputs, BIAS loads each before its ACT.B.'''
+    prog = [ 'RHM 0, 0, {}   # {} inputs, then a bias vector per layer'.format(n + len(shifts), n) ]
+    for l, shift in enumerate(shifts):
+        prog.append('BIAS {}, {}'.format(n + l, shift))
+        prog.append('RW {}'.format(l))
+        prog.append('MMC.SO 0, 0, {}'.format(n))
+        prog.append('ACT.{}B 0, 0, {}'.format('R' if l < len(shifts) - 1 else '', n))
+    prog.append('WHM 0, 0, {}'.format(n))
+    prog.append('HLT')
+    return '\n'.join(prog) + '\n'
+
+def quant_scale(mat, bits=8):
+    # The factor norm2byte multiplies mat by
+    return (2**(bits - 1) - 1) / np.amax(np.abs(mat))
+
+def norm2byte(mat, shape=None, bits=8):
+    # Scale to signed bits-bit integers: the largest magnitude maps to 2**(bits-1) - 1
     pos_mat = np.vectorize(lambda x: np.abs(x))(mat)
     max_w = np.amax(pos_mat)
-    mat = np.vectorize(lambda x: (127 * x/max_w).astype(np.int8))(mat)
+    top = 2**(bits - 1) - 1
+    dtype = np.int8 if bits <= 8 else np.int16
+    mat = np.vectorize(lambda x: (top * x/max_w).astype(dtype))(mat)
     return mat.reshape(shape) if shape else mat
 
 def parse_args():
@@ -201,11 +248,20 @@ def parse_args():
                         help='path to save inputs.')
     parser.add_argument('--save-output-path', action='store', default='app_out',
                         help='path to save predicts.')
+    parser.add_argument('--save-program-path', action='store', default='boston_bias.a',
+                        help='path to save the assembly program using the biases (with --config ACT_BIAS=1).')
     parser.add_argument('--N', action='store', type=int,
                         help='number of test cases.')
     parser.add_argument('--raw', action='store_true', default=False,
                         help='use float32 raw numbers.')
+    parser.add_argument('--config', action='append', metavar='NAME=VALUE', default=[],
+                        help='Override a hardware parameter from config.py to pad for, e.g. --config MAT_COLS=8 (repeatable).')
     args = parser.parse_args()
+    overrides = {}
+    for setting in args.config:
+        name, _, value = setting.partition('=')
+        overrides[name] = int(value, 0)
+    args.cfg = Config(**overrides)
 
 if __name__ == '__main__':
     parse_args()
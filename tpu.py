@@ -1,155 +1,590 @@
+import hashlib
+import os
+import pickle
+import sys
+from functools import reduce
+
+import pyrtl
 from pyrtl import *
 from pyrtl.analysis import area_estimation, TimingAnalysis
 
-from config import *
+from config import Config
+import isa
 from decoder import decode
+from scoreboard import scoreboard
 from matrix import MMU_top
 from activate import act_top
+from arbiter import round_robin, transfer_queue, onehot_select
+from tracing import module
+
+# Source files that make up the design; editing any of them invalidates the elaboration cache
+DESIGN_FILES = ['tpu.py', 'matrix.py', 'decoder.py', 'activate.py', 'scoreboard.py', 'arbiter.py', 'isa.py', 'config.py', 'tracing.py']
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.tpu_cache')
+CACHE_ENTRIES = 16  # designs kept in the cache; the least recently used beyond this are deleted
+
+# Performance counters built when cfg.PERF_COUNTERS is set, each readable as the Output perf_<name>
+PERF_COUNTERS = [
+    'cycles',               # cycles since reset
+    'mm_busy',              # MMU issuing vectors
+    'act_busy',             # activate unit running
+    'rhm_busy',             # reading host memory
+    'whm_busy',             # writing host memory
+    'weights_programming',  # loading a weight tile into the array
+    'fifo_occupancy',       # sum over cycles of tiles held in the weight FIFO
+    'fifo_full',            # weight FIFO has no free slot
+    'nop',                  # NOP instructions issued
+    'idle',                 # no unit busy
+    'stall',                # issue held by the scoreboard, SYNC or a busy shared memory port
+    'sync',                 # SYNC waiting for memory transfers
+]
+
+
+def build_tpu(cfg=None, block=None):
+    '''Elaborate a TPU with the hardware parameters in cfg (a config.Config; defaults to config.py).
+
+    The design goes into block (a new Block by default) rather than the working block, so
+    any number of configurations can coexist in one process. Returns a TPUPorts with the
+    block, its config and handles on the top-level I/O.
+    '''
+    if cfg is None:
+        cfg = Config()
+    if block is None:
+        block = Block()
+    with set_working_block(block):
+        _build_tpu(cfg)
+    return TPUPorts(block, cfg)
+
+
+# Memory ports of a core driven by the memory controllers; the rest of its ports drive them
+MEM_INPUTS = ['weights_dram_in', 'weights_dram_valid', 'hostmem_rdata', 'hostmem_rvalid', 'hostmem_wready']
+
+
+def core_prefix(core):
+    '''Prefix of the names of the wires and instruction memory of a core (core 0 has none).'''
+    return 'core{}_'.format(core) if core else ''
+
+
+def _build_tpu(cfg):
+    # The top-level I/O and instruction memory are named, so handles to them can be
+    # recovered with TPUPorts after the block is optimized or loaded from the cache.
+
+    halt = Output(1, 'halt')  # When raised, stop simulation
+    block = working_block()
+
+    if cfg.NUM_CORES == 1:
+        core = _build_core(cfg)
+        halt <<= core['halt']
+        for name in MEM_INPUTS:
+            core[name] <<= Input(len(core[name]), name)
+        for name in core['mem_outputs']:
+            out = Output(len(core[name]), name)
+            out <<= core[name]
+        return
+
+    # Build the last core first and give its named wires a prefix, so core 0 keeps the
+    # plain names and no two cores share one
+    cores = []
+    for k in reversed(range(cfg.NUM_CORES)):
+        before = set(block.wirevector_set)
+        cores.insert(0, _build_core(cfg, k, arbitrated=True))
+        for w in block.wirevector_set - before:
+            if k and not (w.name.startswith('tmp') or w.name.startswith('const_')):
+                w.name = core_prefix(k) + w.name
+
+    # Every core has halted
+    halt <<= reduce(lambda a, b: a & b, [ core['halt'] for core in cores ])
+
+    ############################################################
+    #  Shared Memory Ports
+    ############################################################
+
+    # Each port takes one request a cycle, picked round-robin among the cores asking; the
+    # others stall. Requests are served in order, so a queue of the cores that made the
+    # requests in flight says which core each beat (or write slot) belongs to.
+    ncores = len(cores)
+    owner_width = max(1, (ncores - 1).bit_length())
+
+    def owner(grants):
+        return onehot_select(grants, [ Const(k, bitwidth=owner_width) for k in range(ncores) ])
+
+    weights_dram_in = Input(cfg.WEIGHT_DRAM_BEAT_BYTES*8, 'weights_dram_in')
+    weights_dram_valid = Input(1, 'weights_dram_valid')
+    weights_dram_raddr = Output(len(cores[0]['weights_dram_raddr']), 'weights_dram_raddr')
+    weights_dram_read = Output(1, 'weights_dram_read')
+
+    weights_grants = round_robin([ core['weights_req'] for core in cores ])
+    reads = [ core['weights_dram_read'] for core in cores ]
+    read = reduce(lambda a, b: a | b, reads)
+    weights_dram_read <<= read
+    weights_dram_raddr <<= onehot_select(reads, [ core['weights_dram_raddr'] for core in cores ])
+    # A core can have a tile in flight for each slot of its weight FIFO
+    chunks_per_tile = cfg.TILE_BEATS
+    weights_owner = transfer_queue(ncores * cfg.WEIGHT_FIFO_DEPTH, read, owner(reads), Const(chunks_per_tile), weights_dram_valid, 1)
+
+    hostmem_raddr = Output(len(cores[0]['hostmem_raddr']), 'hostmem_raddr')
+    hostmem_rlen = Output(len(cores[0]['hostmem_rlen']), 'hostmem_rlen')
+    hostmem_re = Output(1, 'hostmem_re')
+    hostmem_rdata = Input(len(cores[0]['hostmem_rdata']), 'hostmem_rdata')
+    hostmem_rvalid = Input(1, 'hostmem_rvalid')
+    hostmem_wreq = Output(1, 'hostmem_wreq')
+    hostmem_wlen = Output(len(cores[0]['hostmem_wlen']), 'hostmem_wlen')
+    hostmem_waddr = Output(len(cores[0]['hostmem_waddr']), 'hostmem_waddr')
+    hostmem_wdata = Output(len(cores[0]['hostmem_wdata']), 'hostmem_wdata')
+    hostmem_we = Output(1, 'hostmem_we')
+    hostmem_wready = Input(1, 'hostmem_wready')
+
+    # Reads and writes share the host memory channel, so one arbiter takes either
+    host_grants = round_robin([ core['host_req'] for core in cores ])
+    res = [ core['hostmem_re'] for core in cores ]
+    wreqs = [ core['hostmem_wreq'] for core in cores ]
+    re, rlen = reduce(lambda a, b: a | b, res), onehot_select(res, [ core['hostmem_rlen'] for core in cores ])
+    wreq, wlen = reduce(lambda a, b: a | b, wreqs), onehot_select(wreqs, [ core['hostmem_wlen'] for core in cores ])
+    hostmem_re <<= re
+    hostmem_raddr <<= onehot_select(res, [ core['hostmem_raddr'] for core in cores ])
+    hostmem_rlen <<= rlen
+    hostmem_wreq <<= wreq
+    hostmem_wlen <<= wlen
+    vecs = cfg.HOST_VECS_PER_BEAT
+    read_owner = transfer_queue(ncores, re, owner(res), rlen, hostmem_rvalid, vecs)
+    write_owner = transfer_queue(ncores, wreq, owner(wreqs), wlen, hostmem_wready, vecs)
+
+    # The core owning the write slot sends its beat in the same cycle
+    hostmem_we <<= reduce(lambda a, b: a | b, [ core['hostmem_we'] for core in cores ])
+    hostmem_waddr <<= mux(write_owner, *[ core['hostmem_waddr'] for core in cores ], default=Const(0))
+    hostmem_wdata <<= mux(write_owner, *[ core['hostmem_wdata'] for core in cores ], default=Const(0))
+
+    for k, core in enumerate(cores):
+        core['weights_grant'] <<= weights_grants[k]
+        core['host_grant'] <<= host_grants[k]
+        core['weights_dram_in'] <<= weights_dram_in
+        core['weights_dram_valid'] <<= weights_dram_valid & (weights_owner == k)
+        core['hostmem_rdata'] <<= hostmem_rdata
+        core['hostmem_rvalid'] <<= hostmem_rvalid & (read_owner == k)
+        core['hostmem_wready'] <<= hostmem_wready & (write_owner == k)
+
+
+def _build_core(cfg, core=0, arbitrated=False):
+    '''One core: instruction memory, decoder, scoreboard, Unified Buffer, MMU and activate unit.
+
+    Returns a dict of its memory ports, by the name of the top-level port they connect to,
+    and its halt signal. An arbitrated core also has weights_req/host_req, raised when
+    the instruction it is decoding needs that port, and waits for weights_grant/host_grant.
+    '''
+    io = { 'mem_outputs' : ['weights_dram_raddr', 'weights_dram_read', 'hostmem_raddr', 'hostmem_rlen', 'hostmem_re', 'hostmem_wreq', 'hostmem_wlen', 'hostmem_waddr', 'hostmem_wdata', 'hostmem_we'] }
+
+    ############################################################
+    #  Control Signals
+    ############################################################
+
+    accum_act_raddr = WireVector(cfg.ACC_ADDR_SIZE)  # Activate unit read address for accumulator buffers
+    weights_dram_in = io['weights_dram_in'] = WireVector(cfg.WEIGHT_DRAM_BEAT_BYTES*8)  # Input signal from weights DRAM controller
+    weights_dram_valid = io['weights_dram_valid'] = WireVector(1)  # Valid bit for weights DRAM signal
+    halt = io['halt'] = WireVector(1)  # HLT issued, or issued earlier
+
+
+    ############################################################
+    #  Instruction Memory and PC
+    ############################################################
+
+    IMem = MemBlock(bitwidth=cfg.INSTRUCTION_WIDTH, addrwidth=cfg.IMEM_ADDR_SIZE, name=core_prefix(core) + 'IMem')
+    pc = Register(cfg.IMEM_ADDR_SIZE, 'pc')
+    #probe(pc, 'pc')
+    pc.incr = WireVector(1)
+    with conditional_assignment:
+        with pc.incr:
+            pc.next |= pc + 1
+    stall = WireVector(1, 'stall')  # set by the scoreboard when the instruction at pc cannot issue yet
+    pc.incr <<= ~stall
+    instr = IMem[pc]
+    instr.name = 'instr'
+    #probe(instr, "instr")
+
+    ############################################################
+    #  Unified Buffer
+    ############################################################
+
+    # Ports: MM, WHM and LUT/BIAS read, activate and RHM write; the host side moves HOST_VECS_PER_BEAT vectors a cycle
+    UBuffer = MemBlock(bitwidth=cfg.VECSIZE*cfg.DWIDTH, addrwidth=cfg.UB_ADDR_SIZE, max_read_ports=2+cfg.HOST_VECS_PER_BEAT, max_write_ports=1+cfg.HOST_VECS_PER_BEAT)
+    UBuffer.module = 'ub'  # its reads, for tracing.ToggleCounter.by_module()
+
+    # Address and data wires for MM read port
+    ub_mm_raddr = WireVector(UBuffer.addrwidth)  # MM UB read address
+    UB2MM = UBuffer[ub_mm_raddr]
+
+    ############################################################
+    #  Decoder
+    ############################################################
+
+    dec_mm, dec_act, dec_rhm, dec_whm, dec_halt, dec_sync, ub_start_addr, ub_dec_addr, ub_dest_addr, rhm_dec_addr, whm_dec_addr, rhm_length, whm_length, mmc_length, act_length, act_type, accum_raddr, accum_waddr, accum_overwrite, switch_weights, weights_raddr, dec_rw, dec_lut, lut_dec_row, lut_length, dec_bias, bias_dec_shift, act_bias = decode(instr, cfg)
+
+    # Nothing is dispatched while the scoreboard stalls
+    dispatch_mm, dispatch_act, dispatch_rhm, dispatch_whm, dispatch_halt, weights_read, dispatch_lut, dispatch_bias = [ d & ~stall for d in (dec_mm, dec_act, dec_rhm, dec_whm, dec_halt, dec_rw, dec_lut, dec_bias) ]
+
+    halted = Register(1)  # nothing issues after HLT
+    halted.next <<= halted | dispatch_halt
+    halt <<= halted | dispatch_halt
+
+    # Name the dispatch signals so they can be picked out of a trace
+    dispatch_mm.name = 'dispatch_mm'
+    dispatch_act.name = 'dispatch_act'
+    dispatch_rhm.name = 'dispatch_rhm'
+    dispatch_whm.name = 'dispatch_whm'
+    weights_read.name = 'dispatch_rw'
+    dispatch_lut.name = 'dispatch_lut'
+    dispatch_bias.name = 'dispatch_bias'
+
+    ############################################################
+    #  Matrix Multiply Unit
+    ############################################################
+
+    with module('mmu'):
+        ub_mm_raddr_sig, acc_out, mm_busy, mm_done, weights_programming, fifo_occupancy, fifo_top_full, weights_loaded = MMU_top(data_width=cfg.DWIDTH, matrix_size=cfg.MAT_ROWS, accum_size=cfg.ACC_ADDR_SIZE, ub_size=cfg.UB_ADDR_SIZE, start=dispatch_mm, start_addr=ub_start_addr, nvecs=mmc_length, dest_acc_addr=accum_waddr, overwrite=accum_overwrite, swap_weights=switch_weights, ub_rdata=UB2MM, accum_raddr=accum_act_raddr, weights_dram_in=weights_dram_in, weights_dram_valid=weights_dram_valid, fifo_depth=cfg.WEIGHT_FIFO_DEPTH, mac_pipeline=cfg.MAC_PIPELINE, matrix_cols=cfg.MAT_COLS, zero_gating=cfg.MAC_ZERO_GATING, acc_width=cfg.ACC_WIDTH)
+
+    ub_mm_raddr <<= ub_mm_raddr_sig
+    mm_busy.name = 'mm_busy'
+    mm_done.name = 'mm_done'
+
+    ############################################################
+    #  Activation Lookup Table and Bias
+    ############################################################
+
+    # LUT copies one UB vector a cycle into the next row of the activate unit's table, and BIAS
+    # one vector into its bias registers; they share a UB read port
+    entries, rows = cfg.ACT_LUT_SHAPE
+    lut_busy = Register(1, 'lut_busy')
+    bias_busy = Register(1, 'bias_busy')
+    lut_N = Register(len(lut_length))
+    act_load_raddr = Register(len(ub_dec_addr))
+    lut_row = Register(max(1, (rows - 1).bit_length()))
+    bias_shift = Register(len(bias_dec_shift))
+    bias_busy.next <<= dispatch_bias
+    with conditional_assignment:
+        with dispatch_lut:
+            lut_N.next |= lut_length
+            act_load_raddr.next |= ub_dec_addr
+            lut_row.next |= lut_dec_row[:len(lut_row)]
+            lut_busy.next |= 1
+        with dispatch_bias:
+            act_load_raddr.next |= ub_dec_addr
+            bias_shift.next |= bias_dec_shift
+        with lut_busy:
+            lut_N.next |= lut_N - 1
+            act_load_raddr.next |= act_load_raddr + 1
+            lut_row.next |= lut_row + 1
+            with lut_N == 1:
+                lut_busy.next |= 0
+    act_load_data = UBuffer[act_load_raddr]
+    act_extra = {}
+    if cfg.ACT_LUT_BITS:
+        act_extra.update(lut_we=lut_busy, lut_waddr=lut_row, lut_wdata=act_load_data, lut_bits=cfg.ACT_LUT_BITS, lut_shift=cfg.ACT_LUT_SHIFT, lut_entries=entries)
+    # else no table: LUT only takes its cycles, and ACT.L passes values through
+    if cfg.ACT_BIAS:
+        act_extra.update(use_bias=act_bias, bias_we=bias_busy, bias_wdata=act_load_data, bias_shift=bias_shift)
+
+    ############################################################
+    #  Activate Unit
+    ############################################################
+
+    with module('activate'):
+        accum_raddr_sig, ub_act_waddr, act_out, ub_act_we, act_busy = act_top(start=dispatch_act, start_addr=accum_raddr, dest_addr=ub_dest_addr, nvecs=act_length, func=act_type, accum_out=acc_out, data_width=cfg.DWIDTH, **act_extra)
+    accum_act_raddr <<= accum_raddr_sig
+    act_busy.name = 'act_busy'
+    ub_act_waddr.name = 'ub_act_waddr'
+    act_out.name = 'act_out'
+    accum_raddr_sig.name = 'accum_act_raddr'
+
+    # Write the result of activate to the unified buffer; it has an element per column,
+    # and the rest of a vector wider than that is zeroed
+    with conditional_assignment:
+        with ub_act_we:
+            UBuffer[ub_act_waddr] |= act_out.zero_extended(UBuffer.bitwidth)
+
+    #probe(ub_act_we, "ub_act_we")
+    #probe(ub_act_waddr, "ub_act_waddr")
+    #probe(act_out, "act_out")
+    #probe(accum_raddr_sig, "accum_raddr")
+
+    ############################################################
+    #  Read/Write Host Memory
+    ############################################################
+
+    # The host memory controller answers requests with a latency: RHM sends one request for
+    # the whole transfer and writes each beat to the UB when it arrives (hostmem_rvalid);
+    # WHM announces its transfer and sends a beat each cycle the controller takes one
+    # (hostmem_wready). A beat is HOST_VECS_PER_BEAT vectors, the first in the low bits;
+    # lengths and addresses count vectors.
+    vecs = cfg.HOST_VECS_PER_BEAT
+    vecwidth = cfg.DWIDTH*cfg.VECSIZE
+    hostmem_raddr = io['hostmem_raddr'] = WireVector(cfg.HOST_ADDR_SIZE)
+    hostmem_rlen = io['hostmem_rlen'] = WireVector(len(rhm_length))
+    hostmem_re = io['hostmem_re'] = WireVector(1)
+    hostmem_rdata = io['hostmem_rdata'] = WireVector(vecs*vecwidth)
+    hostmem_rvalid = io['hostmem_rvalid'] = WireVector(1)
+    hostmem_wreq = io['hostmem_wreq'] = WireVector(1)
+    hostmem_wlen = io['hostmem_wlen'] = WireVector(len(whm_length))
+    hostmem_waddr = io['hostmem_waddr'] = WireVector(cfg.HOST_ADDR_SIZE)
+    hostmem_wdata = io['hostmem_wdata'] = WireVector(vecs*vecwidth)
+    hostmem_we = io['hostmem_we'] = WireVector(1)
+    hostmem_wready = io['hostmem_wready'] = WireVector(1)
+
+    # Write Host Memory control logic
+    whm_N = Register(len(whm_length))  # vectors still to send
+    whm_ub_raddr = [ Register(len(ub_dec_addr)) for i in range(vecs) ]  # one per vector, so UB reads use registered addresses
+    whm_addr = Register(len(whm_dec_addr))
+    whm_busy = Register(1, 'whm_busy')
+
+    ubuffer_out = concat_list([ UBuffer[raddr] for raddr in whm_ub_raddr ])
+
+    hostmem_wreq <<= dispatch_whm
+    hostmem_wlen <<= whm_length
+    hostmem_waddr <<= whm_addr
+    hostmem_wdata <<= ubuffer_out
+
+    with conditional_assignment:
+        with dispatch_whm:
+            whm_N.next |= whm_length
+            for i, raddr in enumerate(whm_ub_raddr):
+                raddr.next |= ub_dec_addr + i
+            whm_addr.next |= whm_dec_addr
+            whm_busy.next |= 1
+        with whm_busy & hostmem_wready:
+            whm_N.next |= whm_N - vecs
+            for raddr in whm_ub_raddr:
+                raddr.next |= raddr + vecs
+            whm_addr.next |= whm_addr + vecs
+            hostmem_we |= 1
+            with whm_N <= vecs:
+                whm_busy.next |= 0
+
+
+    # Read Host Memory control logic
+    #probe(rhm_length, "rhm_length")
+    rhm_N = Register(len(rhm_length))  # vectors still to arrive
+    rhm_busy = Register(1, 'rhm_busy')
+    rhm_ub_waddr = [ Register(len(ub_dec_addr)) for i in range(vecs) ]
+
+    hostmem_re <<= dispatch_rhm
+    hostmem_raddr <<= rhm_dec_addr
+    hostmem_rlen <<= rhm_length
+
+    with conditional_assignment:
+        with dispatch_rhm:
+            rhm_N.next |= rhm_length
+            rhm_busy.next |= 1
+            for i, waddr in enumerate(rhm_ub_waddr):
+                waddr.next |= ub_dec_addr + i
+        with rhm_busy & hostmem_rvalid:
+            rhm_N.next |= rhm_N - vecs
+            for waddr in rhm_ub_waddr:
+                waddr.next |= waddr + vecs
+            with rhm_N <= vecs:
+                rhm_busy.next |= 0
+
+    for i, waddr in enumerate(rhm_ub_waddr):
+        # The last beat may be only partly filled
+        write = rhm_busy & hostmem_rvalid & (rhm_N > i)
+        UBuffer[waddr] <<= MemBlock.EnabledWrite(hostmem_rdata[i*vecwidth:(i+1)*vecwidth], write)
+
+    ############################################################
+    #  Weights Memory
+    ############################################################
+
+    weights_dram_raddr = io['weights_dram_raddr'] = WireVector(cfg.WEIGHT_DRAM_ADDR_SIZE)
+    weights_dram_read = io['weights_dram_read'] = WireVector(1)
+
+    weights_dram_raddr <<= weights_raddr
+    weights_dram_read <<= weights_read
+
+    # Count the DRAM beats requested by RW but not yet received
+    chunks_per_tile = cfg.TILE_BEATS
+    rw_beats = Register(16, 'rw_beats')
+    with conditional_assignment:
+        with weights_read & weights_dram_valid:
+            rw_beats.next |= rw_beats + (chunks_per_tile - 1)
+        with weights_read:
+            rw_beats.next |= rw_beats + chunks_per_tile
+        with weights_dram_valid:
+            rw_beats.next |= rw_beats - 1
+    rw_pending = rw_beats != 0
+
+    ############################################################
+    #  Scoreboard
+    ############################################################
+
+    # SYNC waits for every outstanding host memory and weight DRAM transfer
+    sync_stall = dec_sync & (rhm_busy | whm_busy | rw_pending)
+    hold = WireVector(1)  # the instruction at pc cannot issue yet, whatever the memory ports say
+
+    if cfg.INTERLOCK:
+        dec = { 'mm' : dec_mm, 'act' : dec_act, 'rhm' : dec_rhm, 'whm' : dec_whm, 'rw' : dec_rw, 'lut' : dec_lut, 'bias' : dec_bias, 'halt' : dec_halt }
+        hold <<= halted | sync_stall | scoreboard(ub_size=cfg.UB_ADDR_SIZE, acc_size=cfg.ACC_ADDR_SIZE, op=dec, ub_start_addr=ub_start_addr, ub_dec_addr=ub_dec_addr, ub_dest_addr=ub_dest_addr, accum_waddr=accum_waddr, accum_raddr=accum_raddr, mmc_length=mmc_length, act_length=act_length, rhm_length=rhm_length, whm_length=whm_length, switch_weights=switch_weights, mm_busy=mm_busy, mm_done=mm_done, act_busy=act_busy, rhm_busy=rhm_busy, whm_busy=whm_busy, weights_loaded=weights_loaded, fifo_top_full=fifo_top_full, rw_pending=rw_pending, lut_length=lut_length, lut_busy=lut_busy, bias_busy=bias_busy)
+    else:
+        hold <<= halted | sync_stall  # the program is padded with NOPs to cover every other latency
+
+    if arbitrated:
+        # Ask for the shared memory port the instruction needs, and wait until it is granted
+        weights_req = io['weights_req'] = dec_rw & ~hold
+        host_req = io['host_req'] = (dec_rhm | dec_whm) & ~hold
+        weights_grant = io['weights_grant'] = WireVector(1)
+        host_grant = io['host_grant'] = WireVector(1)
+        stall <<= hold | (weights_req & ~weights_grant) | (host_req & ~host_grant)
+    else:
+        stall <<= hold
+
+    ############################################################
+    #  Performance Counters
+    ############################################################
+
+    if cfg.PERF_COUNTERS:
+        op = instr[ isa.OP_START*8 : isa.OP_END*8 ]
+        events = {
+            'cycles': Const(1),
+            'mm_busy': mm_busy,
+            'act_busy': act_busy,
+            'rhm_busy': rhm_busy,
+            'whm_busy': whm_busy,
+            'weights_programming': weights_programming,
+            'fifo_occupancy': fifo_occupancy,
+            'fifo_full': fifo_occupancy == cfg.WEIGHT_FIFO_DEPTH,
+            'nop': (op == isa.OPCODE2BIN['NOP'][0]) & ~stall,
+            'idle': ~(mm_busy | act_busy | rhm_busy | whm_busy | lut_busy | bias_busy | weights_programming),
+            'stall': stall & ~halted,
+            'sync': sync_stall,
+        }
+        for name in PERF_COUNTERS:
+            perf_counter(name, events[name], cfg.PERF_COUNTER_WIDTH)
+
+    return io
+
+
+    #probe(dispatch_mm, "dispatch_mm")
+    #probe(dispatch_act, "dispatch_act")
+    #probe(dispatch_rhm, "dispatch_rhm")
+    #probe(dispatch_whm, "dispatch_whm")
+
+
+def perf_counter(name, inc, width):
+    '''Add inc to a counter every cycle; the count is readable as the Output perf_<name>.'''
+    count = Register(width)
+    count.next <<= count + inc
+    out = Output(width, 'perf_' + name)
+    out <<= count
+
+
+class TPUPorts(object):
+    '''An elaborated TPU: its block, its config, and handles on the top-level I/O (looked up by name).'''
+
+    def __init__(self, block, cfg):
+        self.block = block
+        self.cfg = cfg
+        w = block.get_wirevector_by_name
+        self.imems = [ block.get_memblock_by_name(core_prefix(k) + 'IMem') for k in range(cfg.NUM_CORES) ]
+        self.imem = self.imems[0]
+        self.halt = w('halt')
+        self.weights_dram_in = w('weights_dram_in')
+        self.weights_dram_valid = w('weights_dram_valid')
+        self.weights_dram_raddr = w('weights_dram_raddr')
+        self.weights_dram_read = w('weights_dram_read')
+        self.hostmem_raddr = w('hostmem_raddr')
+        self.hostmem_rlen = w('hostmem_rlen')
+        self.hostmem_re = w('hostmem_re')
+        self.hostmem_rdata = w('hostmem_rdata')
+        self.hostmem_rvalid = w('hostmem_rvalid')
+        self.hostmem_wreq = w('hostmem_wreq')
+        self.hostmem_wlen = w('hostmem_wlen')
+        self.hostmem_waddr = w('hostmem_waddr')
+        self.hostmem_wdata = w('hostmem_wdata')
+        self.hostmem_we = w('hostmem_we')
+        self.hostmem_wready = w('hostmem_wready')
+        # Performance counter outputs by counter name (prefixed by core_prefix() for the other
+        # cores); empty unless built with cfg.PERF_COUNTERS
+        self.perf = {}
+        for k in range(cfg.NUM_CORES):
+            for name in PERF_COUNTERS:
+                if w(core_prefix(k) + 'perf_' + name) is not None:
+                    self.perf[core_prefix(k) + name] = w(core_prefix(k) + 'perf_' + name)
+
+
+def optimize_tpu(block=None):
+    '''Run PyRTL's optimize() on the design without constant-folding registers.
+
+    Constant propagation replaces a register whose next value is a constant by that
+    constant, which throws away its reset value. The startup registers in matrix.FIFO
+    and matrix.MMU are exactly that and are 0 only in the first cycle, so those register
+    nets are held out of the passes and put back afterwards.
+    '''
+    block = working_block(block)
+    held = [net for net in block.logic if net.op == 'r' and isinstance(net.args[0], Const)]
+    block.logic.difference_update(held)
+    optimize(block=block, skip_sanity_check=True)
+    for net in held:
+        block.add_wirevector(net.args[0])
+        block.add_net(net)
+    block.sanity_check()
+    return block
+
+
+def design_key(cfg, optimized):
+    '''Hash of everything an elaborated design depends on: its config, the design sources, the PyRTL version.'''
+    h = hashlib.sha1()
+    h.update(repr(cfg.key()).encode())
+    h.update(repr((optimized, getattr(pyrtl, '__version__', None), sys.version_info[:2])).encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in DESIGN_FILES:
+        with open(os.path.join(here, name), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def load_tpu(cfg=None, optimized=False, cache_dir=CACHE_DIR):
+    '''Like build_tpu(), but optionally optimized and cached on disk.
+
+    Designs are pickled to cache_dir keyed on design_key(), so later runs with the same
+    configuration skip elaboration and optimization. Pass cache_dir=None to always rebuild.
+    '''
+    if cfg is None:
+        cfg = Config()
+    # Pickling a netlist recurses through the wire graph
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, design_key(cfg, optimized) + '.pickle')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                ports = pickle.load(f)
+            os.utime(path)  # mark it recently used
+            return ports
+
+    ports = build_tpu(cfg)
+    if optimized:
+        optimize_tpu(ports.block)
+
+    if path is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp = path + '.tmp{}'.format(os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(ports, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)  # atomic, so concurrent runs never see a partial file
+        prune_cache(cache_dir, CACHE_ENTRIES)
+    return ports
+
+
+def prune_cache(cache_dir=CACHE_DIR, keep=CACHE_ENTRIES):
+    '''Delete all but the keep most recently used designs in cache_dir (keep=0 empties it).'''
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pickle'):
+            try:
+                entries.append((os.path.getmtime(os.path.join(cache_dir, name)), name))
+            except OSError:  # deleted by a concurrent run
+                pass
+    for _, name in sorted(entries, reverse=True)[keep:]:
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
 
-############################################################
-#  Control Signals
-############################################################
-
-accum_act_raddr = WireVector(ACC_ADDR_SIZE)  # Activate unit read address for accumulator buffers
-weights_dram_in = Input(64*8, "weights_dram_in")  # Input signal from weights DRAM controller
-weights_dram_valid = Input(1, "weights_dram_valid")  # Valid bit for weights DRAM signal
-halt = Output(1)  # When raised, stop simulation
-
-
-############################################################
-#  Instruction Memory and PC
-############################################################
-
-IMem = MemBlock(bitwidth=INSTRUCTION_WIDTH, addrwidth=IMEM_ADDR_SIZE)
-pc = Register(IMEM_ADDR_SIZE)
-#probe(pc, 'pc')
-pc.incr = WireVector(1)
-with conditional_assignment:
-    with pc.incr:
-        pc.next |= pc + 1
-pc.incr <<= 1  # right now, increment the PC every cycle
-instr = IMem[pc]
-#probe(instr, "instr")
-        
-############################################################
-#  Unified Buffer
-############################################################
-
-UBuffer = MemBlock(bitwidth=MATSIZE*DWIDTH, addrwidth=UB_ADDR_SIZE, max_write_ports=2)
-
-# Address and data wires for MM read port
-ub_mm_raddr = WireVector(UBuffer.addrwidth)  # MM UB read address
-UB2MM = UBuffer[ub_mm_raddr]
-
-############################################################
-#  Decoder
-############################################################
-
-dispatch_mm, dispatch_act, dispatch_rhm, dispatch_whm, dispatch_halt, ub_start_addr, ub_dec_addr, ub_dest_addr, rhm_dec_addr, whm_dec_addr, rhm_length, whm_length, mmc_length, act_length, act_type, accum_raddr, accum_waddr, accum_overwrite, switch_weights, weights_raddr, weights_read = decode(instr)
-
-halt <<= dispatch_halt
-
-############################################################
-#  Matrix Multiply Unit
-############################################################
-
-ub_mm_raddr_sig, acc_out, mm_busy, mm_done = MMU_top(data_width=DWIDTH, matrix_size=MATSIZE, accum_size=ACC_ADDR_SIZE, ub_size=UB_ADDR_SIZE, start=dispatch_mm, start_addr=ub_start_addr, nvecs=mmc_length, dest_acc_addr=accum_waddr, overwrite=accum_overwrite, swap_weights=switch_weights, ub_rdata=UB2MM, accum_raddr=accum_act_raddr, weights_dram_in=weights_dram_in, weights_dram_valid=weights_dram_valid)
-
-ub_mm_raddr <<= ub_mm_raddr_sig
-
-############################################################
-#  Activate Unit
-############################################################
-
-accum_raddr_sig, ub_act_waddr, act_out, ub_act_we, act_busy = act_top(start=dispatch_act, start_addr=accum_raddr, dest_addr=ub_dest_addr, nvecs=act_length, func=act_type, accum_out=acc_out)
-accum_act_raddr <<= accum_raddr_sig
-
-# Write the result of activate to the unified buffer
-with conditional_assignment:
-    with ub_act_we:
-        UBuffer[ub_act_waddr] |= act_out
-
-#probe(ub_act_we, "ub_act_we")
-#probe(ub_act_waddr, "ub_act_waddr")
-#probe(act_out, "act_out")
-#probe(accum_raddr_sig, "accum_raddr")
-
-############################################################
-#  Read/Write Host Memory
-############################################################
-
-hostmem_raddr = Output(HOST_ADDR_SIZE, "raddr")
-hostmem_rdata = Input(DWIDTH*MATSIZE)
-hostmem_re = Output(1, "hostmem_re")
-hostmem_waddr = Output(HOST_ADDR_SIZE)
-hostmem_wdata = Output(DWIDTH*MATSIZE)
-hostmem_we = Output(1)
-
-# Write Host Memory control logic
-whm_N = Register(len(whm_length))
-whm_ub_raddr = Register(len(ub_dec_addr))
-whm_addr = Register(len(whm_dec_addr))
-whm_busy = Register(1)
-
-ubuffer_out = UBuffer[whm_ub_raddr]
-
-hostmem_waddr <<= whm_addr
-hostmem_wdata <<= ubuffer_out
-
-with conditional_assignment:
-    with dispatch_whm:
-        whm_N.next |= whm_length
-        whm_ub_raddr.next |= ub_dec_addr
-        whm_addr.next |= whm_dec_addr
-        whm_busy.next |= 1
-    with whm_busy:
-        whm_N.next |= whm_N - 1
-        whm_ub_raddr.next |= whm_ub_raddr + 1
-        whm_addr.next |= whm_addr + 1
-        hostmem_we |= 1
-        with whm_N == 1:
-            whm_busy.next |= 0
-
-
-# Read Host Memory control logic
-#probe(rhm_length, "rhm_length")
-rhm_N = Register(len(rhm_length))
-rhm_addr = Register(len(rhm_dec_addr))
-rhm_busy = Register(1)
-rhm_ub_waddr = Register(len(ub_dec_addr))
-with conditional_assignment:
-    with dispatch_rhm:
-        rhm_N.next |= rhm_length
-        rhm_busy.next |= 1
-        hostmem_raddr |= rhm_dec_addr
-        hostmem_re |= 1
-        rhm_addr.next |=  + 1
-        rhm_ub_waddr.next |= ub_dec_addr
-    with rhm_busy:
-        rhm_N.next |= rhm_N - 1
-        hostmem_raddr |= rhm_addr
-        hostmem_re |= 1
-        rhm_addr.next |= rhm_addr + 1
-        rhm_ub_waddr.next |= rhm_ub_waddr + 1
-        UBuffer[rhm_ub_waddr] |= hostmem_rdata
-        with rhm_N == 1:
-            rhm_busy.next |= 0
-
-############################################################
-#  Weights Memory
-############################################################
-
-weights_dram_raddr = Output(WEIGHT_DRAM_ADDR_SIZE)
-weights_dram_read = Output(1)
-
-weights_dram_raddr <<= weights_raddr
-weights_dram_read <<= weights_read
-
-            
-#probe(dispatch_mm, "dispatch_mm")
-#probe(dispatch_act, "dispatch_act")
-#probe(dispatch_rhm, "dispatch_rhm")
-#probe(dispatch_whm, "dispatch_whm")
 
 def run_synth():
     print("logic = {:2f} mm^2, mem={:2f} mm^2".format(*area_estimation()))
@@ -174,4 +609,7 @@ def run_synth():
     t = TimingAnalysis()
     print("Max freq = {} MHz".format(t.max_freq()))
 
-#run_synth()
+
+if __name__ == '__main__':
+    with set_working_block(build_tpu().block):
+        run_synth()
@@ -0,0 +1,465 @@
+'''
+Simulation tracers for the hardware simulation.
+
+SimulationTrace keeps every value of every tracked wire in memory until the end
+of the run. The tracers here bound that cost: WindowedTrace only stores a range
+of cycles, and StreamingVCDTrace writes value changes to disk as it goes.
+ToggleCounter keeps no trace at all, only a count of the bits that change, and
+Timeline only what each unit works on.
+'''
+
+import sys
+from contextlib import contextmanager
+
+from pyrtl import *
+
+
+def _vcd_name(name):
+    # VCD identifiers cannot contain whitespace; PyRTL names rarely do, but probes can
+    return ''.join(c if c.isalnum() or c in '_.$[]' else '_' for c in name)
+
+
+class VCDWriter(object):
+    '''Writes a value change dump one cycle at a time, emitting only changed values.'''
+
+    def __init__(self, f, wires):
+        self.f = f
+        self.wires = sorted(wires, key=lambda w: w.name)
+        self.last = {}
+        print('$timescale 1ns $end', file=f)
+        print('$scope module logic $end', file=f)
+        for w in self.wires:
+            print('$var wire {} {} {} $end'.format(w.bitwidth, _vcd_name(w.name), _vcd_name(w.name)), file=f)
+        print('$upscope $end', file=f)
+        print('$enddefinitions $end', file=f)
+
+    def step(self, cycle, values):
+        '''values maps wire names to their value in this cycle.'''
+        changes = []
+        for w in self.wires:
+            v = values[w.name]
+            if self.last.get(w.name) != v:
+                self.last[w.name] = v
+                changes.append('b{:b} {}'.format(v, _vcd_name(w.name)))
+        if changes:
+            print('#{}'.format(cycle * 10), file=self.f)
+            print('\n'.join(changes), file=self.f)
+
+    def close(self, cycle):
+        print('#{}'.format(cycle * 10), file=self.f)
+        self.f.flush()
+
+
+def _track(wires_to_track, block):
+    '''Resolve a list of wire names (or 'all', or None for all named wires) to WireVectors.'''
+    block = working_block(block)
+    if wires_to_track is None or wires_to_track == 'all':
+        return wires_to_track
+    wires = []
+    for w in wires_to_track:
+        if isinstance(w, str):
+            wv = block.get_wirevector_by_name(w)
+            if wv is None:
+                raise PyrtlError('No wire named "{}" to trace; names of internal wires are '
+                                 'lost if the design has been optimized'.format(w))
+            w = wv
+        wires.append(w)
+    return wires
+
+
+@contextmanager
+def module(name, block=None):
+    '''Tag the wires and memories created inside the with block as part of module name.
+
+    PyRTL netlists are flat; the tags let ToggleCounter.by_module() say which part of the
+    design the activity is in. Tags of inner modules take precedence over outer ones. PyRTL
+    builds a memory read net only when the read is used, so a memory read outside the
+    module can be tagged by setting its MemBlock's module attribute instead.
+    '''
+    block = working_block(block)
+    wires, nets = set(block.wirevector_set), set(block.logic)
+    yield
+    for w in block.wirevector_set - wires:
+        if getattr(w, 'module', None) is None:
+            w.module = name
+    for net in block.logic - nets:
+        if net.op in 'm@' and getattr(net.op_param[1], 'module', None) is None:
+            net.op_param[1].module = name
+
+
+def wire_modules(block=None, default='control'):
+    '''Wire name -> (module, op of the net driving it). Memory reads belong to their memory's module.'''
+    block = working_block(block)
+    out = {}
+    for net in block.logic:
+        for w in net.dests:
+            owner = net.op_param[1] if net.op == 'm' else w
+            out[w.name] = (getattr(owner, 'module', None) or getattr(w, 'module', None) or default, net.op)
+    for w in block.wirevector_subset(Input):
+        out[w.name] = (getattr(w, 'module', None) or default, None)
+    return out
+
+
+class NullTrace(object):
+    '''Tracer that records nothing, for running with tracing off.'''
+
+    def __init__(self):
+        self.trace = {}
+        self.wires_to_track = []
+
+    def _set_initial_values(self, default_value, init_regvalue, init_memvalue):
+        pass
+
+    def add_step(self, value_map):
+        pass
+
+    def add_fast_step(self, fastsim):
+        pass
+
+
+class WindowedTrace(SimulationTrace):
+    '''SimulationTrace that only records cycles in [start, end).'''
+
+    def __init__(self, start=0, end=None, wires_to_track=None, block=None):
+        super(WindowedTrace, self).__init__(wires_to_track=_track(wires_to_track, block), block=block)
+        self.start = start
+        self.end = end
+        self.cycle = 0
+
+    def _in_window(self):
+        return self.cycle >= self.start and (self.end is None or self.cycle < self.end)
+
+    def add_step(self, value_map):
+        if self._in_window():
+            super(WindowedTrace, self).add_step(value_map)
+        self.cycle += 1
+
+    def add_fast_step(self, fastsim):
+        if self._in_window():
+            super(WindowedTrace, self).add_fast_step(fastsim)
+        self.cycle += 1
+
+    def print_vcd(self, file=sys.stdout, include_clock=False):
+        '''Dump the recorded window, with timestamps matching the simulation cycles.'''
+        vcd = VCDWriter(file, self.wires_to_track)
+        n = len(self) if len(self.trace) else 0
+        for t in range(n):
+            vcd.step(self.start + t, {name: vals[t] for name, vals in self.trace.items()})
+        vcd.close(self.start + n)
+
+
+class StreamingVCDTrace(SimulationTrace):
+    '''Tracer that writes each cycle straight to a VCD file instead of keeping it in memory.
+
+    Only the last value of each wire is kept, so memory use does not grow with
+    the length of the run. Cycles outside [start, end) are skipped.
+    '''
+
+    def __init__(self, f, start=0, end=None, wires_to_track=None, block=None):
+        super(StreamingVCDTrace, self).__init__(wires_to_track=_track(wires_to_track, block), block=block)
+        self.f = f
+        self.start = start
+        self.end = end
+        self.cycle = 0
+        self.vcd = VCDWriter(f, self.wires_to_track)
+
+    def __len__(self):
+        return self.cycle
+
+    def _write(self, values):
+        if self.cycle >= self.start and (self.end is None or self.cycle < self.end):
+            self.vcd.step(self.cycle, values)
+        self.cycle += 1
+
+    def add_step(self, value_map):
+        self._write({w.name: value_map[w] for w in self.wires_to_track})
+
+    def add_fast_step(self, fastsim):
+        self._write({name: fastsim.context[name] for name in self.trace})
+
+    def close(self):
+        self.vcd.close(self.cycle if self.end is None else min(self.cycle, self.end))
+
+    def print_vcd(self, file=sys.stdout, include_clock=False):
+        raise PyrtlError('StreamingVCDTrace has already written its trace to {}'.format(self.f.name))
+
+
+class ToggleCounter(SimulationTrace):
+    '''Tracer that counts bit toggles (0->1 and 1->0) on each wire from cycle to cycle.
+
+    The switching activity of a run is a first-order proxy for its dynamic energy,
+    e.g. to compare the MMU with and without MAC_ZERO_GATING. Every wire is counted
+    unless wires_to_track says otherwise.
+    '''
+
+    def __init__(self, wires_to_track='all', block=None):
+        super(ToggleCounter, self).__init__(wires_to_track=_track(wires_to_track, block), block=block)
+        self.last = {}
+        self.toggles = dict.fromkeys(self.trace, 0)
+        self.cycles = 0
+
+    def __len__(self):
+        return self.cycles
+
+    def _count(self, values):
+        for name, v in values:
+            self.toggles[name] += bin(v ^ self.last.get(name, 0)).count('1')
+            self.last[name] = v
+        self.cycles += 1
+
+    def add_step(self, value_map):
+        self._count((w.name, value_map[w]) for w in self.wires_to_track)
+
+    def add_fast_step(self, fastsim):
+        self._count((name, fastsim.context[name]) for name in self.toggles)
+
+    def total(self):
+        return sum(self.toggles.values())
+
+    def by_op(self):
+        '''Toggles grouped by the operation driving each wire, e.g. '*' for multiplier outputs.
+
+        Word-level nets hide the activity inside a multiplier or adder, so the toggles on
+        their outputs are the better measure of what gating saves there.
+        '''
+        ops = {}
+        for net in self.block.logic:
+            for w in net.dests:
+                if w.name in self.toggles:
+                    ops[net.op] = ops.get(net.op, 0) + self.toggles[w.name]
+        return ops
+
+    def by_module(self):
+        '''Toggles grouped by module (see module()), e.g. mac_array or accumulators.'''
+        modules = {}
+        for name, (m, _) in wire_modules(self.block).items():
+            if name in self.toggles:
+                modules[m] = modules.get(m, 0) + self.toggles[name]
+        return modules
+
+    def busiest(self, n=10):
+        '''The n wires with the most toggles, as (name, toggles) pairs.'''
+        return sorted(self.toggles.items(), key=lambda item: -item[1])[:n]
+
+    def print_vcd(self, file=sys.stdout, include_clock=False):
+        raise PyrtlError('ToggleCounter keeps no trace to dump')
+
+
+class Timeline(SimulationTrace):
+    '''Tracer that records which instruction (by PC) each unit of each core works on, cycle by cycle.
+
+    Units: mmu (issuing vectors into the array), drain (the last vector of an MMC going
+    through the array to the accumulators), act, lut, bias, rhm, whm, dram (a weight tile
+    arriving) and program (a tile loaded from the weight FIFO into the array). Waiting
+    to issue shows up as the stall unit of the waiting instruction. Needs the design's
+    internal wire names, so it cannot follow an optimized design or the compiled backend.
+    '''
+
+    UNITS = ['stall', 'mmu', 'drain', 'act', 'lut', 'bias', 'rhm', 'whm', 'dram', 'program']
+    # unit -> (its dispatch signal, its busy signal)
+    BUSY = { 'mmu' : ('dispatch_mm', 'mm_busy'), 'act' : ('dispatch_act', 'act_busy'), 'lut' : ('dispatch_lut', 'lut_busy'),
+             'bias' : ('dispatch_bias', 'bias_busy'), 'rhm' : ('dispatch_rhm', 'rhm_busy'), 'whm' : ('dispatch_whm', 'whm_busy') }
+    SIGNALS = ['pc', 'stall', 'dispatch_rw', 'mm_done', 'rw_beats', 'weights_programming'] + [ name for pair in BUSY.values() for name in pair ]
+
+    def __init__(self, ncores=1, tile_beats=1, labels=None, block=None):
+        '''labels: the assembly text of each core's program, by pc (see sim.describe), to name the
+        instructions and to spot the HLT that ends each core's timeline.'''
+        from tpu import core_prefix
+        self.prefixes = [ core_prefix(k) for k in range(ncores) ]
+        super(Timeline, self).__init__(wires_to_track=_track([ p + name for p in self.prefixes for name in self.SIGNALS ], block), block=block)
+        self.tile_beats = tile_beats
+        self.cycle = 0
+        self.cores = [ _CoreTimeline(labels[k] if labels else None) for k in range(ncores) ]
+
+    def __len__(self):
+        return self.cycle
+
+    def add_step(self, value_map):
+        self._step({ w.name : value_map[w] for w in self.wires_to_track })
+
+    def add_fast_step(self, fastsim):
+        self._step({ name : fastsim.context[name] for name in self.trace })
+
+    def _step(self, values):
+        t = self.cycle
+        for prefix, core in zip(self.prefixes, self.cores):
+            v = lambda name: values[prefix + name]
+            if core.halted:
+                continue
+            pc = v('pc')
+            core.fetch.setdefault(pc, t)
+            issued = not v('stall')
+            if issued:
+                core.issue[pc] = t
+                if core.fetch[pc] < t:
+                    core.add('stall', pc, core.fetch[pc], t)
+
+            # Units that are busy from their dispatch until their busy signal drops
+            for unit, (dispatch, busy) in self.BUSY.items():
+                if unit in core.open and t > core.open[unit][1] and not v(busy):
+                    pc0, start = core.open.pop(unit)
+                    core.add(unit, pc0, start, t)
+                    if unit == 'mmu':
+                        core.draining.append((pc0, t))
+                if v(dispatch):
+                    if unit in core.open:
+                        core.add(unit, *core.open.pop(unit), end=t)
+                    core.open[unit] = (pc, t)
+            if v('mm_done') and core.draining:
+                pc0, start = core.draining.popleft()
+                core.add('drain', pc0, max(start, core.last_end('drain')), t + 1)
+
+            # Weight tiles: the DRAM beats still due say when each RW's transfer is complete
+            if core.beats is not None:
+                arrived = core.beats + core.requested - v('rw_beats')
+                while arrived and core.transfers:
+                    n = min(arrived, core.transfers[0][2])
+                    core.transfers[0][2] -= n
+                    arrived -= n
+                    if not core.transfers[0][2]:
+                        pc0, start, _ = core.transfers.popleft()
+                        core.add('dram', pc0, max(start, core.last_end('dram')), t)
+                        core.tiles.append(pc0)
+            core.beats = v('rw_beats')
+            core.requested = self.tile_beats if v('dispatch_rw') else 0
+            if v('dispatch_rw'):
+                core.transfers.append([pc, t, self.tile_beats])
+            programming = v('weights_programming')
+            if programming and not core.programming:
+                core.open['program'] = (core.tiles.popleft() if core.tiles else None, t)
+            elif core.programming and not programming and 'program' in core.open:
+                core.add('program', *core.open.pop('program'), end=t)
+            core.programming = programming
+
+            if issued and core.labels is not None and pc < len(core.labels) and core.labels[pc].startswith('HLT'):
+                core.halted = True  # the run stops once every core has, so close what is open now
+                core.finish(t + 1)
+        self.cycle += 1
+
+    def instructions(self, core=0):
+        '''(pc, fetched, issued, done) of every instruction the core issued, in program order.'''
+        c = self.cores[core]
+        done = {}
+        for unit, pc, start, end in c.events:
+            if unit != 'stall' and pc is not None:
+                done[pc] = max(done.get(pc, 0), end)
+        return [ (pc, c.fetch[pc], t, max(done.get(pc, t + 1), t + 1)) for pc, t in sorted(c.issue.items()) ]
+
+    def critical_path(self, core=0):
+        '''The chain of instructions that decided when the core finished, from its last one back.
+
+        Each step is (pc, cycles, blocker): the instruction issued cycles after blocker did, either
+        because it waited for blocker to complete, or, when blocker is the instruction before it
+        and there was no such wait, simply in order.
+        '''
+        rows = self.instructions(core)
+        order = [ pc for pc, _, _, _ in rows ]
+        issue = dict((pc, t) for pc, _, t, _ in rows)
+        done = dict((pc, d) for pc, _, _, d in rows)
+        path = []
+        i = len(order) - 1
+        while i > 0:
+            t = issue[order[i]]
+            k = i - 1
+            if t > issue[order[k]] + 1:
+                # Held up: by the earlier instruction that completed last before this one issued
+                finished = [ (done[q], j) for j, q in enumerate(order[:i]) if done[q] <= t ]
+                if finished:
+                    k = max(finished)[1]
+            path.append((order[i], t - issue[order[k]], order[k]))
+            i = k
+        if order:
+            path.append((order[0], issue[order[0]], None))
+        return path
+
+    def chrome_trace(self, f):
+        '''Write the timeline as a Chrome trace (chrome://tracing, ui.perfetto.dev), a cycle per microsecond.'''
+        import json
+        events = []
+        for k, core in enumerate(self.cores):
+            events.append({ 'name' : 'process_name', 'ph' : 'M', 'pid' : k, 'args' : { 'name' : 'core {}'.format(k) } })
+            for tid, unit in enumerate(self.UNITS):
+                events.append({ 'name' : 'thread_name', 'ph' : 'M', 'pid' : k, 'tid' : tid, 'args' : { 'name' : unit } })
+                events.append({ 'name' : 'thread_sort_index', 'ph' : 'M', 'pid' : k, 'tid' : tid, 'args' : { 'sort_index' : tid } })
+            for unit, pc, start, end in core.events:
+                name = core.text(pc)
+                events.append({ 'name' : name, 'cat' : unit, 'ph' : 'X', 'pid' : k, 'tid' : self.UNITS.index(unit),
+                                'ts' : start, 'dur' : end - start, 'args' : { 'pc' : pc } })
+        json.dump({ 'traceEvents' : events, 'displayTimeUnit' : 'ns' }, f)
+
+    def utilization(self, core=0):
+        '''Cycles each unit of a core was busy.'''
+        busy = dict.fromkeys(self.UNITS, 0)
+        for unit, _, start, end in self.cores[core].events:
+            busy[unit] += end - start
+        return busy
+
+    def print_vcd(self, file=sys.stdout, include_clock=False):
+        raise PyrtlError('Timeline keeps no trace to dump; see chrome_trace()')
+
+
+class _CoreTimeline(object):
+    '''Timeline state of one core.'''
+
+    def __init__(self, labels=None):
+        from collections import deque
+        self.fetch = {}  # pc -> first cycle it was at the head of the pipeline
+        self.issue = {}  # pc -> cycle it issued
+        self.events = []  # (unit, pc, start, end), end exclusive
+        self.ends = {}  # unit -> end of its last event
+        self.open = {}  # unit -> (pc, start) of its instruction in progress
+        self.draining = deque()  # (pc, cycle its vectors were all issued) of MMCs still in the array
+        self.transfers = deque()  # [pc, start, beats due] of RWs in flight
+        self.tiles = deque()  # pcs of RWs whose tile waits in the FIFO
+        self.beats = None  # rw_beats the cycle before
+        self.requested = 0  # beats an RW asked for the cycle before
+        self.programming = 0
+        self.halted = False
+        self.labels = labels
+
+    def add(self, unit, pc, start, end):
+        if end > start:
+            self.events.append((unit, pc, start, end))
+            self.ends[unit] = end
+
+    def last_end(self, unit):
+        return self.ends.get(unit, 0)
+
+    def finish(self, t):
+        '''Close what the core is still doing after it halted (the HLT waits for most of it).'''
+        for unit, (pc, start) in list(self.open.items()):
+            self.add(unit, pc, start, t)
+        self.open.clear()
+
+    def text(self, pc):
+        if pc is None:
+            return '?'
+        if self.labels is not None and pc < len(self.labels):
+            return '{}: {}'.format(pc, self.labels[pc])
+        return 'pc {}'.format(pc)
+
+
+def make_tracer(mode, signals=None, window=None, f=None, block=None, cfg=None, labels=None):
+    '''Build the tracer for a simulation run.
+
+    mode: 'off', 'full', 'window', 'stream', 'toggles' or 'timeline'
+    signals: list of wire names to trace (None traces all named wires, 'all' every wire;
+             'toggles' counts every wire unless given a list)
+    window: (start, end) cycle range for the 'window' and 'stream' modes
+    f: open file the 'stream' mode writes to
+    cfg, labels: the design's config.Config and its programs' text, for the 'timeline' mode
+    '''
+    start, end = window if window else (0, None)
+    if mode == 'off':
+        return NullTrace()
+    elif mode == 'full':
+        return SimulationTrace(wires_to_track=_track(signals, block), block=block)
+    elif mode == 'window':
+        return WindowedTrace(start, end, wires_to_track=signals, block=block)
+    elif mode == 'stream':
+        return StreamingVCDTrace(f, start, end, wires_to_track=signals, block=block)
+    elif mode == 'toggles':
+        return ToggleCounter(wires_to_track='all' if signals is None else signals, block=block)
+    elif mode == 'timeline':
+        return Timeline(cfg.NUM_CORES, cfg.TILE_BEATS, labels, block=block)
+    raise PyrtlError('Unknown trace mode "{}"'.format(mode))